@@ -124,6 +124,8 @@ SEGM_PARAMS = {
     'RG2SP_theshold': RG2SP_THRESHOLDS,
     'slic_size': SLIC_SIZE,
     'slic_regul': SLIC_REGUL,
+    # start superpixels from the previous image, useful for image stacks
+    'slic_warm_start': False,
     'path_list': os.path.join(PATH_IMAGES,
                               'list_imgs-segm-center-points_short.csv'),
     'path_out': tl_data.update_path('results', absolute=True)
@@ -681,12 +683,15 @@ def create_dict_segmentation(params, slic, segm, img, centers):
     return dict_segment_filter
 
 
-def image_segmentation(idx_row, params, debug_export=DEBUG_EXPORT):
+def image_segmentation(idx_row, params, debug_export=DEBUG_EXPORT,
+                       warm_start=None):
     """ image segmentation which prepare inputs (segmentation, centres)
     and perform segmentation of various segmentation methods
 
     :param (int, str) idx_row: input image and centres
     :param {str: ...} params: segmentation parameters
+    :param {str: ndarray} warm_start: previous image and its superpixels
+        which are updated inplace, None means to compute new superpixels
     :return str: image name
     """
     _, row_path = idx_row
@@ -712,8 +717,16 @@ def image_segmentation(idx_row, params, debug_export=DEBUG_EXPORT):
         logging.warning('no center was detected for "%s"', name)
         return name
     # img = seg / float(seg.max())
-    slic = seg_spx.segment_slic_img2d(img_rgb, sp_size=params['slic_size'],
-                                      rltv_compact=params['slic_regul'])
+    if warm_start is not None:
+        slic, lut_prev = seg_spx.segment_slic_img2d_warm(
+            img_rgb, warm_start.get('image'), warm_start.get('slic'),
+            sp_size=params['slic_size'], rltv_compact=params['slic_regul'])
+        img_ref = seg_spx.update_slic_warm_reference(
+            warm_start.get('image'), img_rgb, slic, lut_prev)
+        warm_start.update({'image': img_ref, 'slic': slic})
+    else:
+        slic = seg_spx.segment_slic_img2d(img_rgb, sp_size=params['slic_size'],
+                                          rltv_compact=params['slic_regul'])
 
     path_segm = os.path.join(params['path_exp'], 'input', name + '.png')
     export_draw_image_segm(path_segm, img_rgb, segm_obj=seg, centers=centers)
@@ -808,7 +821,12 @@ def main(params, debug_export=DEBUG_EXPORT):
 
     tqdm_bar = tqdm.tqdm(total=len(df_paths))
     wrapper_segment = partial(image_segmentation, params=params)
-    if params['nb_jobs'] > 1:
+    if params.get('slic_warm_start', False):
+        # consecutive images depend on each other so they run sequentially
+        wrapper_segment = partial(wrapper_segment, warm_start={})
+        for _ in map(wrapper_segment, df_paths.iterrows()):
+            tqdm_bar.update()
+    elif params['nb_jobs'] > 1:
         mproc_pool = mproc.Pool(params['nb_jobs'])
         for _ in mproc_pool.imap_unordered(wrapper_segment, df_paths.iterrows()):
             tqdm_bar.update()
@@ -0,0 +1,210 @@
+"""
+Benchmark superpixel methods regarding speed, memory and quality
+of the superpixel boundaries compared to given annotation
+
+SAMPLE run:
+>> python run_benchmark_superpixels.py \
+    -imgs "images/drosophila_ovary_slice/image/*.jpg" \
+    -segm "images/drosophila_ovary_slice/annot_eggs/*.png" \
+    --img_type 2d_gray --slic_size 20 --slic_regul 0.25 \
+    --engines slic slico felzenszwalb watershed grid
+
+Copyright (C) 2017 Jiri Borovec <jiri.borovec@fel.cvut.cz>
+"""
+
+import os
+import sys
+import time
+import argparse
+import logging
+import multiprocessing as mproc
+from functools import partial
+
+import matplotlib
+if os.environ.get('DISPLAY', '') == '':
+    logging.warning('No display found. Using non-interactive Agg backend')
+matplotlib.use('Agg')
+
+import tqdm
+import numpy as np
+import pandas as pd
+try:
+    import tracemalloc
+except ImportError:
+    logging.warning('memory is not measured, missing "tracemalloc"')
+    tracemalloc = None
+
+sys.path += [os.path.abspath('.'), os.path.abspath('..')]  # Add path to root
+import segmentation.utils.data_io as tl_io
+import segmentation.superpixels as seg_spx
+import segmentation.labeling as seg_lbs
+from run_segm_slic_model_graphcut import load_image
+from run_segm_slic_model_graphcut import TYPES_LOAD_IMAGE
+
+
+PATH_IMAGES = tl_io.update_path(os.path.join('images', 'drosophila_ovary_slice'))
+PATH_RESULTS = tl_io.update_path('results', absolute=True)
+NAME_CSV_BENCHMARK = 'benchmark_superpixels.csv'
+NAME_CSV_BENCHMARK_MEAN = 'benchmark_superpixels_mean.csv'
+PARAMS = {
+    'path_images': os.path.join(PATH_IMAGES, 'image', '*.jpg'),
+    'path_segms': os.path.join(PATH_IMAGES, 'annot_eggs', '*.png'),
+    'path_out': os.path.join(PATH_RESULTS, 'benchmark_superpixels'),
+    'img_type': '2d_gray',
+    'engines': sorted(seg_spx.DICT_SUPERPIXEL_ENGINES),
+}
+
+
+def arg_parse_params(params=PARAMS):
+    """
+    SEE: https://docs.python.org/3/library/argparse.html
+    :return: {str: any}
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-imgs', '--path_images', type=str, required=False,
+                        help='path to directory & name pattern for image',
+                        default=params['path_images'])
+    parser.add_argument('-segm', '--path_segms', type=str, required=False,
+                        help='path to directory & name pattern for annotation',
+                        default=params['path_segms'])
+    parser.add_argument('-out', '--path_out', type=str, required=False,
+                        help='path to the output directory',
+                        default=params['path_out'])
+    parser.add_argument('--img_type', type=str, required=False,
+                        default=params['img_type'], choices=TYPES_LOAD_IMAGE,
+                        help='type of image to be loaded')
+    parser.add_argument('--slic_size', type=int, required=False,
+                        default=20, help='superpixels size')
+    parser.add_argument('--slic_regul', type=float, required=False,
+                        default=0.25, help='superpixel regularization')
+    parser.add_argument('--engines', type=str, required=False, nargs='+',
+                        default=params['engines'],
+                        choices=sorted(seg_spx.DICT_SUPERPIXEL_ENGINES),
+                        help='superpixel methods to be compared')
+    parser.add_argument('--nb_jobs', type=int, required=False, default=1,
+                        help='number of processes in parallel, note that more '
+                             'parallel jobs may affect the measured time')
+    params = vars(parser.parse_args())
+    logging.info('ARG PARAMETERS: \n %s', repr(params))
+    for k in (k for k in params if 'path' in k):
+        params[k] = tl_io.update_path(params[k])
+        if k == 'path_out' and not os.path.isdir(params[k]):
+            params[k] = ''
+            continue
+        p = os.path.dirname(params[k]) if '*' in params[k] else params[k]
+        assert os.path.exists(p), 'missing (%s) "%s"' % (k, p)
+    return params
+
+
+def measure_superpixels(img, segm, engine, sp_size, rltv_compact):
+    """ run selected superpixel method and measure its time, memory peak
+    and quality of superpixels boundaries regarding the annotation
+
+    :param ndarray img: input image
+    :param ndarray segm: annotation
+    :param str engine: name of superpixel method
+    :param int sp_size: superpixel initial size
+    :param float rltv_compact: relative regularisation in range (0, 1)
+    :return {str: any}:
+
+    >>> np.random.seed(0)
+    >>> img = np.random.random((100, 150))
+    >>> segm = np.zeros(img.shape, dtype=int)
+    >>> segm[20:60, 40:100] = 1
+    >>> img[segm == 1] += 1
+    >>> stat = measure_superpixels(img, segm, 'grid', 20, 0.2)
+    >>> sorted(stat.keys())  # doctest: +NORMALIZE_WHITESPACE
+    ['boundary distance', 'boundary recall', 'engine', 'memory [MB]',
+     'nb superpixels', 'time [s]']
+    >>> stat['nb superpixels']
+    40
+    """
+    if tracemalloc is not None:
+        tracemalloc.start()
+    t = time.time()
+    slic = seg_spx.segment_superpixels_img2d(img, sp_size, rltv_compact,
+                                             engine)
+    stat = {'engine': engine, 'time [s]': time.time() - t,
+            'nb superpixels': len(np.unique(slic))}
+    if tracemalloc is not None:
+        _, mem_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stat['memory [MB]'] = mem_peak / 1024. ** 2
+    else:
+        stat['memory [MB]'] = np.nan
+    _, dists = seg_lbs.compute_boundary_distances(segm, slic)
+    stat['boundary distance'] = np.mean(dists)
+    stat['boundary recall'] = seg_spx.compute_boundary_recall(segm, slic)
+    return stat
+
+
+def benchmark_image(idx_row, params):
+    """ benchmark all selected superpixel methods on a single image
+
+    :param (int, str) idx_row:
+    :param {} params:
+    :return [{str: any}]:
+    """
+    _, row = idx_row
+    name = os.path.splitext(os.path.basename(row['path_image']))[0]
+    img = load_image(row['path_image'], params['img_type'])
+    segm = load_image(row['path_segm'], 'segm')
+
+    list_stats = []
+    for engine in params['engines']:
+        logging.debug('benchmark "%s" on image "%s"', engine, name)
+        stat = measure_superpixels(img, segm, engine, params['slic_size'],
+                                   params['slic_regul'])
+        stat['name'] = name
+        list_stats.append(stat)
+    return list_stats
+
+
+def main(params):
+    """ compare superpixel methods on given images and annotations
+
+    :param {str: ...} params:
+    """
+    logging.info('running...')
+
+    if not os.path.isdir(params['path_out']):
+        logging.info('Missing output dir -> no results table.')
+
+    list_paths = [params['path_images'], params['path_segms']]
+    df_paths = tl_io.find_files_match_names_across_dirs(list_paths)
+    df_paths.columns = ['path_image', 'path_segm']
+
+    list_stats = []
+    tqdm_bar = tqdm.tqdm(total=len(df_paths), desc='benchmark superpixels')
+    wrapper_benchmark = partial(benchmark_image, params=params)
+    if params['nb_jobs'] > 1:
+        mproc_pool = mproc.Pool(params['nb_jobs'])
+        for stats in mproc_pool.imap_unordered(wrapper_benchmark,
+                                               df_paths.iterrows()):
+            list_stats += stats
+            tqdm_bar.update()
+        mproc_pool.close()
+        mproc_pool.join()
+    else:
+        for stats in map(wrapper_benchmark, df_paths.iterrows()):
+            list_stats += stats
+            tqdm_bar.update()
+    df_stat = pd.DataFrame(list_stats).set_index('name')
+    df_mean = df_stat.groupby('engine').mean()
+
+    if os.path.isdir(params['path_out']):
+        df_stat.to_csv(os.path.join(params['path_out'], NAME_CSV_BENCHMARK))
+        df_mean.to_csv(os.path.join(params['path_out'],
+                                    NAME_CSV_BENCHMARK_MEAN))
+    logging.info('STATISTIC:')
+    logging.info(df_mean)
+
+    logging.info('DONE')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    params = arg_parse_params(PARAMS)
+
+    main(params)
@@ -0,0 +1,166 @@
+"""
+Evaluate accuracy versus speed of the supervised segmentation computed
+in full resolution and in the multi-resolution (pyramid) mode
+
+The classifier is trained once on all given images and the segmentation
+in each scale is compared to the annotation and to the full resolution result.
+
+SAMPLE run:
+>> python run_eval_pyramid_classif.py \
+    -list images/drosophila_ovary_slice/list_imgs-annot-struct_short.csv \
+    --img_type 2d_gray --slic_size 35 --slic_regul 0.3 --scales 1 0.5 0.25
+
+Copyright (C) 2017 Jiri Borovec <jiri.borovec@fel.cvut.cz>
+"""
+
+import os
+import sys
+import time
+import argparse
+import logging
+
+import matplotlib
+if os.environ.get('DISPLAY', '') == '':
+    logging.warning('No display found. Using non-interactive Agg backend')
+matplotlib.use('Agg')
+
+import tqdm
+import numpy as np
+import pandas as pd
+
+sys.path += [os.path.abspath('.'), os.path.abspath('..')]  # Add path to root
+import segmentation.utils.data_io as tl_io
+import segmentation.pipelines as seg_pipe
+import segmentation.descriptors as seg_fts
+import segmentation.classification as seg_clf
+from run_segm_slic_model_graphcut import load_image
+from run_segm_slic_model_graphcut import TYPES_LOAD_IMAGE
+
+
+PATH_IMAGES = tl_io.update_path(os.path.join('images', 'drosophila_ovary_slice'))
+PATH_RESULTS = tl_io.update_path('results', absolute=True)
+NAME_CSV_PYRAMID = 'evaluation_pyramid_classif.csv'
+NAME_CSV_PYRAMID_MEAN = 'evaluation_pyramid_classif_mean.csv'
+PARAMS = {
+    'path_train_list': os.path.join(PATH_IMAGES,
+                                    'list_imgs-annot-struct_short.csv'),
+    'path_out': os.path.join(PATH_RESULTS, 'evaluation_pyramid_classif'),
+    'img_type': '2d_gray',
+    'scales': [1., 0.5, 0.25],
+    # features which are not very sensitive to the image scale
+    'features': seg_fts.FEATURES_SET_COLOR,
+    'classif': seg_clf.DEFAULT_CLASSIF_NAME,
+    'gc_regul': 1.,
+    'gc_edge_type': 'model',
+}
+
+
+def arg_parse_params(params=PARAMS):
+    """
+    SEE: https://docs.python.org/3/library/argparse.html
+    :return: {str: any}
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-list', '--path_train_list', type=str, required=False,
+                        help='path to the list of images and annotations',
+                        default=params['path_train_list'])
+    parser.add_argument('-out', '--path_out', type=str, required=False,
+                        help='path to the output directory',
+                        default=params['path_out'])
+    parser.add_argument('--img_type', type=str, required=False,
+                        default=params['img_type'], choices=TYPES_LOAD_IMAGE,
+                        help='type of image to be loaded')
+    parser.add_argument('--slic_size', type=int, required=False,
+                        default=35, help='superpixels size')
+    parser.add_argument('--slic_regul', type=float, required=False,
+                        default=0.3, help='superpixel regularization')
+    parser.add_argument('--scales', type=float, required=False, nargs='+',
+                        default=params['scales'],
+                        help='scales of the pyramid mode, 1 is full resolution')
+    arg_params = vars(parser.parse_args())
+    logging.info('ARG PARAMETERS: \n %s', repr(arg_params))
+    for k in (k for k in arg_params if 'path' in k):
+        arg_params[k] = tl_io.update_path(arg_params[k])
+        if k == 'path_out' and not os.path.isdir(arg_params[k]):
+            arg_params[k] = ''
+            continue
+        assert os.path.exists(arg_params[k]), \
+            'missing (%s) "%s"' % (k, arg_params[k])
+    params.update(arg_params)
+    return params
+
+
+def evaluate_image_scales(img, annot, classif, params):
+    """ segment image in all scales and measure time and accuracy
+
+    :param ndarray img: input image
+    :param ndarray annot: annotation
+    :param classif: trained classifier
+    :param {str: any} params:
+    :return [{str: any}]:
+    """
+    list_stats, segm_full = [], None
+    for scale in sorted(params['scales'], reverse=True):
+        t = time.time()
+        segm = seg_pipe.segment_color2d_slic_features_classif_graphcut(
+            img, classif, sp_size=params['slic_size'],
+            sp_regul=params['slic_regul'], gc_regul=params['gc_regul'],
+            dict_features=params['features'],
+            gc_edge_type=params['gc_edge_type'],
+            pyramid_scale=scale if scale < 1 else None)
+        stat = {'scale': scale, 'time [s]': time.time() - t}
+        metrics = seg_clf.compute_classif_metrics(annot.ravel(), segm.ravel())
+        stat['accuracy'] = metrics['accuracy']
+        if scale >= 1:
+            segm_full = segm
+        if segm_full is not None:
+            stat['agreement with full'] = np.mean(segm == segm_full)
+        list_stats.append(stat)
+    return list_stats
+
+
+def main(params):
+    """ train a classifier and compare full and multi-resolution segmentation
+
+    :param {str: ...} params:
+    """
+    logging.info('running...')
+
+    df_paths = pd.read_csv(params['path_train_list'], index_col=0)
+    list_imgs = [load_image(p, params['img_type'])
+                 for p in df_paths['path_image']]
+    list_annots = [load_image(p, 'segm') for p in df_paths['path_annot']]
+
+    logging.info('training classifier on %i images', len(list_imgs))
+    classif, _, _, _ = seg_pipe.train_classif_color2d_slic_features(
+        list_imgs, list_annots, sp_size=params['slic_size'],
+        sp_regul=params['slic_regul'], dict_features=params['features'],
+        clf_name=params['classif'])
+
+    list_stats = []
+    for path_img, img, annot in tqdm.tqdm(zip(df_paths['path_image'],
+                                              list_imgs, list_annots),
+                                          total=len(list_imgs),
+                                          desc='evaluate pyramid'):
+        name = os.path.splitext(os.path.basename(path_img))[0]
+        for stat in evaluate_image_scales(img, annot, classif, params):
+            stat['name'] = name
+            list_stats.append(stat)
+    df_stat = pd.DataFrame(list_stats).set_index('name')
+    df_mean = df_stat.groupby('scale').mean()
+
+    if os.path.isdir(params['path_out']):
+        df_stat.to_csv(os.path.join(params['path_out'], NAME_CSV_PYRAMID))
+        df_mean.to_csv(os.path.join(params['path_out'], NAME_CSV_PYRAMID_MEAN))
+    logging.info('STATISTIC:')
+    logging.info(df_mean)
+
+    logging.info('DONE')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    params = arg_parse_params(PARAMS)
+
+    main(params)
@@ -57,7 +57,6 @@ import segmentation.pipelines as seg_pipe
 import segmentation.labeling as seg_label
 import segmentation.descriptors as seg_fts
 import segmentation.classification as seg_clf
-import segmentation.superpixels as seg_spx
 import segmentation.graph_cuts as seg_gc
 from run_segm_slic_model_graphcut import (arg_parse_params, load_image,
                                           parse_imgs_idx_path, get_idx_name)
@@ -138,6 +137,8 @@ SEGM_PARAMS = {
     'gc_regul': 5.0,
     'gc_edge_type': 'model',
     'gc_use_trans': False,
+    # folder for caching superpixels and features across runs, None - no cache
+    'path_cache': None,
 }
 PATH_IMAGES = os.path.join(tl_data.update_path('images'),
                            'drosophila_ovary_slice')
@@ -194,16 +195,17 @@ def load_image_annot_compute_features_labels(idx_row, params,
     # duplicate gray band to be as rgb
     # if img.ndim == 2:
     #     img = np.rollaxis(np.tile(img, (3, 1, 1)), 0, 3)
-    slic = seg_spx.segment_slic_img2d(img, sp_size=params['slic_size'],
-                                      rltv_compact=params['slic_regul'])
+    slic = seg_pipe.segment_slic_img2d_cached(img, params['slic_size'],
+                                              params['slic_regul'],
+                                              params.get('path_cache'))
     img = seg_pipe.convert_img_color_space(img, params.get('clr_space', 'rgb'))
     logging.debug('computed SLIC with %i labels', slic.max())
     if show_debug_imgs:
         img_slic = segmentation.mark_boundaries(img / float(img.max()), slic,
                                                 color=(1, 0, 0), mode='subpixel')
         plt.imsave(path_out_img(params, FOLDER_SLIC, idx_name), img_slic)
-    features, ft_names = seg_fts.compute_selected_features_img2d(img, slic,
-                                                                 params['features'])
+    features, ft_names = seg_fts.compute_selected_features_img2d(
+        img, slic, params['features'], params.get('path_cache'))
 
     label_hist = seg_label.histogram_regions_labels_norm(slic, annot)
     labels = np.argmax(label_hist, axis=1)
@@ -317,11 +319,12 @@ def segment_image(imgs_idx_path, params, classif, path_out, path_visu=None,
     logging.debug('segmenting image: "%s"', path_img)
     idx_name = get_idx_name(idx, path_img)
     img = load_image(path_img, params['img_type'])
-    slic = seg_spx.segment_slic_img2d(img, sp_size=params['slic_size'],
-                                            rltv_compact=params['slic_regul'])
+    slic = seg_pipe.segment_slic_img2d_cached(img, params['slic_size'],
+                                              params['slic_regul'],
+                                              params.get('path_cache'))
     img = seg_pipe.convert_img_color_space(img, params.get('clr_space', 'rgb'))
-    features, _ = seg_fts.compute_selected_features_img2d(img, slic,
-                                                          params['features'])
+    features, _ = seg_fts.compute_selected_features_img2d(
+        img, slic, params['features'], params.get('path_cache'))
     labels = classif.predict(features)
     segm = labels[slic]
     img_seg = Image.fromarray(segm.astype(np.uint8))
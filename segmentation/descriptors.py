@@ -11,7 +11,7 @@ Copyright (C) 2014-2016 Jiri Borovec <jiri.borovec@fel.cvut.cz>
 import logging
 
 import numpy as np
-from scipy import ndimage, interpolate, optimize, spatial
+from scipy import ndimage, interpolate, optimize, spatial, fftpack
 from scipy.ndimage.filters import (gaussian_filter, gaussian_filter1d,
                                    gaussian_laplace)
 from sklearn import preprocessing
@@ -19,6 +19,8 @@ from skimage import morphology
 # from numba.decorators import jit
 # from numba import int32, int64, float32
 
+import segmentation.utils.cache as tl_cache
+
 try:
     import segmentation.features_cython as fts_cython
     # logging.debug('try to load Cython implementation')  # CRASH logger
@@ -36,6 +38,24 @@ FEATURES_SET_COLOR = {'color': ('mean', 'std', 'eng')}
 FEATURES_SET_TEXTURE = {'tLM': ('mean', 'std', 'eng')}
 FEATURES_SET_TEXTURE_SHORT = {'tLM_s': ('mean', 'std', 'eng')}
 HIST_CIRCLE_DIAGONALS = (10, 20, 30, 40, 50)
+# engines for computing filter responses, 'auto' choose per kernel
+FILTER_RESPONSE_ENGINES = ('auto', 'direct', 'separable', 'fft')
+# relative tolerance on singular values for separable filter decomposition
+FILTER_SEPARABLE_TOL = 1e-7
+# maximal number of separable components to be faster then FFT
+FILTER_SEPARABLE_MAX_RANK = 2
+# minimal kernel size where FFT convolution beats the direct one
+FILTER_FFT_MIN_SIZE = 9
+# maximal relative difference of a response engine to direct convolution
+FILTER_EQUIVALENCE_RTOL = 1e-6
+# maximal error of fast Gaussian smoothing relative to the image value range
+GAUSS_FAST_MAX_ERROR = 1e-3
+# maximal number of ray steps traced at once in batch Ray features
+RAY_CAST_BATCH_SIZE = 2 ** 21
+# ratio of costs of window cropping and FFT to prefer dense label histograms
+HIST_DENSE_COST_RATIO = 4.
+# number of histogram bins used by Cython for estimating median if it is enabled
+MEDIAN_HIST_NB_BINS = 64
 
 # Wavelets:
 # * http://www.pybytes.com/pywavelets/
@@ -132,11 +152,12 @@ def _check_color_image(image):
     return True
 
 
-def cython_img2d_color_mean(im, seg):
+def cython_img2d_color_mean(im, seg, nb_jobs=1):
     """ wrapper for fast implementation of colour features
 
     :param ndarray im: input RGB image
     :param ndarray seg: segmentation og the image
+    :param int nb_jobs: number of threads accumulating in parallel
     :return: np.array<nb_lbs, 3> matrix features per segment
 
     >>> image = np.zeros((2, 10, 3))
@@ -154,15 +175,17 @@ def cython_img2d_color_mean(im, seg):
     _check_color_image_segm(im, seg)
 
     means = fts_cython.computeColorImage2dMean(np.array(im, dtype=np.float32),
-                                               np.array(seg, dtype=np.int32))
+                                               np.array(seg, dtype=np.int32),
+                                               nb_jobs)
     return np.array(means)
 
 
-def cython_img2d_color_energy(im, seg):
+def cython_img2d_color_energy(im, seg, nb_jobs=1):
     """  wrapper for fast implementation of colour features
 
     :param ndarray im: input RGB image
     :param ndarray seg: segmentation og the image
+    :param int nb_jobs: number of threads accumulating in parallel
     :return: np.array<nb_lbs, 3> matrix features per segment
 
     >>> image = np.zeros((2, 10, 3))
@@ -180,15 +203,17 @@ def cython_img2d_color_energy(im, seg):
     _check_color_image_segm(im, seg)
 
     energy = fts_cython.computeColorImage2dEnergy(np.array(im, dtype=np.float32),
-                                                  np.array(seg, dtype=np.int32))
+                                                  np.array(seg, dtype=np.int32),
+                                                  nb_jobs)
     return np.array(energy)
 
 
-def cython_img2d_color_std(im, seg, means=None):
+def cython_img2d_color_std(im, seg, means=None, nb_jobs=1):
     """ wrapper for fast implementation of colour features
 
     :param ndarray im: input RGB image
     :param ndarray seg: segmentation og the image
+    :param int nb_jobs: number of threads accumulating in parallel
     :return: np.array<nb_lbs, 3> matrix features per segment
 
     >>> image = np.zeros((2, 10, 3))
@@ -206,14 +231,123 @@ def cython_img2d_color_std(im, seg, means=None):
     _check_color_image_segm(im, seg)
 
     if means is None:
-        means = cython_img2d_color_mean(im, seg)
+        means = cython_img2d_color_mean(im, seg, nb_jobs)
     var = fts_cython.computeColorImage2dVariance(np.array(im, dtype=np.float32),
                                                  np.array(seg, dtype=np.int32),
-                                                 np.array(means, dtype=np.float32))
+                                                 np.array(means, dtype=np.float32),
+                                                 nb_jobs)
     std = np.sqrt(var)
     return std
 
 
+def cython_label_statistic(values, seg, nb_bins=None, nb_jobs=1):
+    """ wrapper for fused implementation computing all statistics in single
+    pass over the image, the median is exact or estimated from value histograms;
+    empty labels are set as NaN the same as in the numpy implementation
+
+    :param ndarray values: image values np.array<nb_pixels, nb_channels>
+        or image of the same shape as segmentation (single channel)
+    :param ndarray seg: segmentation og the image
+    :param int nb_bins: number of histogram bins for median estimate
+        (e.g. `MEDIAN_HIST_NB_BINS`), None means the exact median
+        and 0 skips the median
+    :param int nb_jobs: number of threads accumulating in parallel
+    :return {str: ndarray}: np.array<nb_lbs, nb_channels> per statistic
+
+    >>> image = np.zeros((2, 10, 3))
+    >>> image[:, 2:6, 0] = 1
+    >>> image[:, 3:7, 1] = 3
+    >>> image[:, 4:9, 2] = 2
+    >>> segm = np.array([[0, 0, 0, 0, 0, 1, 1, 1, 1, 1],
+    ...                  [0, 0, 0, 0, 0, 1, 1, 1, 1, 1]])
+    >>> stat = cython_label_statistic(image.reshape(-1, 3), segm)
+    >>> sorted(stat.keys())
+    ['count', 'eng', 'max', 'mean', 'median', 'min', 'std']
+    >>> stat['count']
+    array([10, 10], dtype=int32)
+    >>> np.round(stat['std'], 3)
+    array([[ 0.49,  1.47,  0.8 ],
+           [ 0.4 ,  1.47,  0.8 ]])
+    >>> stat['median']
+    array([[ 1.,  0.,  0.],
+           [ 0.,  0.,  2.]])
+    >>> segm[:, 5:] = 2
+    >>> stat = cython_label_statistic(image.reshape(-1, 3), segm,
+    ...                               nb_bins=MEDIAN_HIST_NB_BINS)
+    >>> stat['median']
+    array([[  1.,   0.,   0.],
+           [ nan,  nan,  nan],
+           [  0.,   0.,   2.]])
+    >>> np.random.seed(0)
+    >>> image = 60000 + np.random.random((20, 30, 3)) * 10
+    >>> segm = np.random.randint(0, 8, (20, 30))
+    >>> stat = cython_label_statistic(image.reshape(-1, 3), segm)
+    >>> np.allclose(stat['std'], numpy_img2d_color_std(image, segm), atol=1e-4)
+    True
+    >>> np.allclose(stat['eng'], numpy_img2d_color_energy(image, segm),
+    ...             rtol=1e-9)
+    True
+    """
+    seg = np.ravel(seg)
+    values_raw = np.reshape(values, (len(seg), -1))
+    # shift values to start from zero so the single precision keeps
+    # the resolution also for data with large offset
+    offset = np.min(values_raw, axis=0).astype(np.float64)
+    values = np.empty(values_raw.shape, dtype=np.float32)
+    np.subtract(values_raw, offset, out=values, casting='unsafe')
+    logging.debug('Cython: computing fused statistic for values %s & segm %s '
+                  'with %i segments', repr(values.shape), repr(seg.shape),
+                  np.max(seg))
+    counts, means, variances, _, mins, maxs, medians = \
+        fts_cython.computeLabelStatistics(values, np.array(seg, dtype=np.int32),
+                                          np.min(values, axis=0),
+                                          np.max(values, axis=0),
+                                          nb_bins or 0, nb_jobs)
+    means = means + offset
+    stat = {'count': counts, 'mean': means, 'std': np.sqrt(variances),
+            'eng': variances + means ** 2, 'min': mins + offset,
+            'max': maxs + offset, 'median': medians + offset}
+    if nb_bins is None:
+        stat['median'] = np.array([label_segmented_median(values_raw[:, i], seg,
+                                                          len(counts))
+                                   for i in range(values_raw.shape[1])]).T
+    elif nb_bins == 0:
+        del stat['median']
+    for k in stat:
+        if k != 'count':
+            stat[k][counts == 0] = np.nan
+    return stat
+
+
+def label_segmented_median(values, labels, nb_labels=None):
+    """ compute median of values for each label using single sorting
+    of all values by label and value, empty labels are set as NaN
+
+    :param ndarray values: flatten values
+    :param ndarray labels: flatten labels of the same size as values
+    :param int nb_labels: total number of labels
+    :return: np.array<nb_lbs> vector of medians per label
+
+    >>> values = np.array([5, 1, 3, 2, 7, 4, 0])
+    >>> labels = np.array([0, 0, 0, 2, 2, 2, 2])
+    >>> label_segmented_median(values, labels)
+    array([  3.,  nan,   3.])
+    """
+    values, labels = np.ravel(values), np.ravel(labels)
+    if nb_labels is None:
+        nb_labels = np.max(labels) + 1
+    counts = np.bincount(labels, minlength=nb_labels)
+    # sort by labels and inside each label by values
+    values_sorted = values[np.lexsort((values, labels))]
+    begins = np.cumsum(counts) - counts
+    filled = counts > 0
+    idx_low = (begins + (counts - 1) // 2)[filled]
+    idx_high = (begins + counts // 2)[filled]
+    medians = np.full(nb_labels, fill_value=np.nan)
+    medians[filled] = (values_sorted[idx_low] + values_sorted[idx_high]) / 2.
+    return medians
+
+
 def numpy_img2d_color_mean(im, seg):
     """ compute color means by numpy
 
@@ -236,16 +370,12 @@ def numpy_img2d_color_mean(im, seg):
     _check_color_image_segm(im, seg)
 
     nb_labels = np.max(seg) + 1
-    means = np.zeros((nb_labels, 3))
-    counts = np.zeros(nb_labels)
-    for i in range(seg.shape[0]):
-        for j in range(seg.shape[1]):
-            lb = seg[i, j]
-            means[lb, 0] += im[i, j, 0]
-            means[lb, 1] += im[i, j, 1]
-            means[lb, 2] += im[i, j, 2]
-            counts[lb] += 1
-    means = (means / np.tile(counts, (3, 1)).T.astype(float))
+    seg_flat = np.asarray(seg).ravel()
+    counts = np.bincount(seg_flat, minlength=nb_labels).astype(float)
+    means = np.array([np.bincount(seg_flat, weights=im[:, :, i].ravel(),
+                                  minlength=nb_labels)
+                      for i in range(3)]).T
+    means = (means / np.tile(counts, (3, 1)).T)
     return means
 
 
@@ -275,14 +405,14 @@ def numpy_img2d_color_std(im, seg, means=None):
 
     nb_labels = np.max(seg) + 1
     assert len(means) >= nb_labels
-    variations = np.zeros((nb_labels, 3))
-    counts = np.zeros(nb_labels)
-    for i in range(seg.shape[0]):
-        for j in range(seg.shape[1]):
-            lb = seg[i, j]
-            variations[lb, :] += (im[i, j, :] - means[lb, :]) ** 2
-            counts[lb] += 1
-    variations = (variations / np.tile(counts, (3, 1)).T.astype(float))
+    means = np.asarray(means)
+    seg_flat = np.asarray(seg).ravel()
+    counts = np.bincount(seg_flat, minlength=nb_labels).astype(float)
+    variations = np.array([np.bincount(seg_flat, minlength=nb_labels,
+                                       weights=(im[:, :, i].ravel()
+                                                - means[seg_flat, i]) ** 2)
+                           for i in range(3)]).T
+    variations = (variations / np.tile(counts, (3, 1)).T)
     stds = np.sqrt(variations)
     return stds
 
@@ -309,16 +439,12 @@ def numpy_img2d_color_energy(im, seg):
     _check_color_image_segm(im, seg)
 
     nb_labels = np.max(seg) + 1
-    energy = np.zeros((nb_labels, 3))
-    counts = np.zeros(nb_labels)
-    for i in range(seg.shape[0]):
-        for j in range(seg.shape[1]):
-            lb = seg[i, j]
-            energy[lb, 0] += im[i, j, 0] ** 2
-            energy[lb, 1] += im[i, j, 1] ** 2
-            energy[lb, 2] += im[i, j, 2] ** 2
-            counts[lb] += 1
-    energy = (energy / np.tile(counts, (3, 1)).T.astype(float))
+    seg_flat = np.asarray(seg).ravel()
+    counts = np.bincount(seg_flat, minlength=nb_labels).astype(float)
+    energy = np.array([np.bincount(seg_flat, weights=im[:, :, i].ravel() ** 2,
+                                   minlength=nb_labels)
+                       for i in range(3)]).T
+    energy = (energy / np.tile(counts, (3, 1)).T)
     return energy
 
 
@@ -344,31 +470,19 @@ def numpy_img2d_color_median(im, seg):
     _check_color_image_segm(im, seg)
 
     nb_labels = np.max(seg) + 1
-    list_values = [([], [], []) for _ in range(nb_labels)]
-
-    for i in range(seg.shape[0]):
-        for j in range(seg.shape[1]):
-            lb = seg[i, j]
-            list_values[lb][0].append(im[i, j, 0])
-            list_values[lb][1].append(im[i, j, 1])
-            list_values[lb][2].append(im[i, j, 2])
-
-    medians = np.zeros((nb_labels, 3))
-    for i in range(nb_labels):
-        medians[i, 0] = np.median(list_values[i][0])
-        medians[i, 1] = np.median(list_values[i][1])
-        medians[i, 2] = np.median(list_values[i][2])
+    seg_flat = np.asarray(seg).ravel()
+    medians = np.array([label_segmented_median(im[:, :, i].ravel(), seg_flat,
+                                               nb_labels)
+                        for i in range(3)]).T
     return medians
 
 
-def cython_img3d_gray_mean(im, seg):
+def cython_img3d_gray_mean(im, seg, nb_jobs=1):
     """ wrapper for fast implementation of colour features
 
-    WARNING: the Z dimension is parallel and without sync,
-    multiple equal labels across Z dim may lead to not mistakes in summing
-
     :param ndarray im: input RGB image
     :param ndarray seg: segmentation og the image
+    :param int nb_jobs: number of threads accumulating in parallel
     :return: np.array<nb_lbs, 1> vector of mean colour per segment
 
     >>> image = np.zeros((2, 3, 8))
@@ -380,24 +494,25 @@ def cython_img3d_gray_mean(im, seg):
     (2, 3, 8)
     >>> cython_img3d_gray_mean(image, segm)
     array([ 0.5 ,  0.5 ,  0.75,  2.25])
+    >>> cython_img3d_gray_mean(image, segm, nb_jobs=2)
+    array([ 0.5 ,  0.5 ,  0.75,  2.25])
     """
     logging.debug('Cython: computing Gray means for image %s and segm %s with '
                   '%i segments', repr(im.shape), repr(seg.shape), np.max(seg))
     _check_gray_image_segm(im, seg)
 
     means = fts_cython.computeGrayImage3dMean(np.array(im, dtype=np.float32),
-                                              np.array(seg, dtype=np.int32))
+                                              np.array(seg, dtype=np.int32),
+                                              nb_jobs)
     return np.array(means)
 
 
-def cython_img3d_gray_energy(im, seg):
+def cython_img3d_gray_energy(im, seg, nb_jobs=1):
     """ wrapper for fast implementation of colour features
 
-    WARNING: the Z dimension is parallel and without sync,
-    multiple equal labels across Z dim may lead to not mistakes in summing
-
     :param ndarray im: input RGB image
     :param ndarray seg: segmentation og the image
+    :param int nb_jobs: number of threads accumulating in parallel
     :return:np.array<nb_lbs, 1> vector of mean colour per segment
 
     >>> image = np.zeros((2, 3, 8))
@@ -413,18 +528,17 @@ def cython_img3d_gray_energy(im, seg):
     _check_gray_image_segm(im, seg)
 
     energy = fts_cython.computeGrayImage3dEnergy(np.array(im, dtype=np.float32),
-                                                 np.array(seg, dtype=np.int32))
+                                                 np.array(seg, dtype=np.int32),
+                                                 nb_jobs)
     return np.array(energy)
 
 
-def cython_img3d_gray_std(im, seg, mean=None):
+def cython_img3d_gray_std(im, seg, mean=None, nb_jobs=1):
     """ wrapper for fast implementation of colour features
 
-    WARNING: the Z dimension is parallel and without sync,
-    multiple equal labels across Z dim may lead to not mistakes in summing
-
     :param ndarray im: input RGB image
     :param ndarray seg: segmentation og the image
+    :param int nb_jobs: number of threads accumulating in parallel
     :return:np.array<nb_lbs, 1> vector of mean colour per segment
 
     >>> image = np.zeros((2, 3, 8))
@@ -440,10 +554,11 @@ def cython_img3d_gray_std(im, seg, mean=None):
     _check_gray_image_segm(im, seg)
 
     if mean is None:
-        mean = cython_img3d_gray_mean(im, seg)
+        mean = cython_img3d_gray_mean(im, seg, nb_jobs)
     var = fts_cython.computeGrayImage3dVariance(np.array(im, dtype=np.float32),
                                                 np.array(seg, dtype=np.int32),
-                                                np.array(mean, dtype=np.float32))
+                                                np.array(mean, dtype=np.float32),
+                                                nb_jobs)
     std = np.sqrt(var)
     return std
 
@@ -467,15 +582,10 @@ def numpy_img3d_gray_mean(im, seg):
     _check_gray_image_segm(im, seg)
 
     nb_labels = np.max(seg) + 1
-    means = np.zeros(nb_labels)
-    counts = np.zeros(nb_labels)
-    for i in range(seg.shape[0]):
-        for j in range(seg.shape[1]):
-            for k in range(seg.shape[2]):
-                lb = seg[i, j, k]
-                means[lb] += im[i, j, k]
-                counts[lb] += 1
-    means = (means / counts.astype(float))
+    seg_flat = np.asarray(seg).ravel()
+    counts = np.bincount(seg_flat, minlength=nb_labels).astype(float)
+    means = np.bincount(seg_flat, weights=np.ravel(im), minlength=nb_labels)
+    means = (means / counts)
     return means
 
 
@@ -502,15 +612,12 @@ def numpy_img3d_gray_std(im, seg, means=None):
 
     nb_labels = np.max(seg) + 1
     assert len(means) >= nb_labels
-    variances = np.zeros(nb_labels)
-    counts = np.zeros(nb_labels)
-    for i in range(seg.shape[0]):
-        for j in range(seg.shape[1]):
-            for k in range(seg.shape[2]):
-                lb = seg[i, j, k]
-                variances[lb] += (im[i, j, k] - means[lb]) ** 2
-                counts[lb] += 1
-    variances = (variances / counts.astype(float))
+    means = np.asarray(means)
+    seg_flat = np.asarray(seg).ravel()
+    counts = np.bincount(seg_flat, minlength=nb_labels).astype(float)
+    variances = np.bincount(seg_flat, minlength=nb_labels,
+                            weights=(np.ravel(im) - means[seg_flat]) ** 2)
+    variances = (variances / counts)
     stds = np.sqrt(variances)
     return stds
 
@@ -534,15 +641,11 @@ def numpy_img3d_gray_energy(im, seg):
     _check_gray_image_segm(im, seg)
 
     nb_labels = np.max(seg) + 1
-    energy = np.zeros(nb_labels)
-    counts = np.zeros(nb_labels)
-    for i in range(seg.shape[0]):
-        for j in range(seg.shape[1]):
-            for k in range(seg.shape[2]):
-                lb = seg[i, j, k]
-                energy[lb] += im[i, j, k] ** 2
-                counts[lb] += 1
-    energy = (energy / counts.astype(float))
+    seg_flat = np.asarray(seg).ravel()
+    counts = np.bincount(seg_flat, minlength=nb_labels).astype(float)
+    energy = np.bincount(seg_flat, weights=np.ravel(im) ** 2,
+                         minlength=nb_labels)
+    energy = (energy / counts)
     return energy
 
 
@@ -565,28 +668,80 @@ def numpy_img3d_gray_median(im, seg):
     _check_gray_image_segm(im, seg)
 
     nb_labels = np.max(seg) + 1
-    list_values = [[] for _ in range(nb_labels)]
+    medians = label_segmented_median(np.ravel(im), np.ravel(seg), nb_labels)
+    return medians
 
-    for i in range(seg.shape[0]):
-        for j in range(seg.shape[1]):
-            for k in range(seg.shape[2]):
-                list_values[seg[i, j, k]].append(im[i, j, k])
 
-    medians = np.zeros(nb_labels)
-    for i in range(nb_labels):
-        medians[i] = np.median(list_values[i])
-    return medians
+def compute_gray_statistic_accumulators(accumulators,
+                                        list_feature_flags=('mean', 'std',
+                                                            'eng'),
+                                        ch_name='gray'):
+    """ compute descriptors from accumulated count, sum and sum of squares
+    of intensities for each segment, e.g. collected slab by slab
+
+    :param {str: ndarray} accumulators: 'count', 'sum' and 'sum2' per segment
+    :param list_feature_flags: only 'mean', 'std' and 'eng' are supported
+    :param str ch_name: name of the channel used in feature names
+    :return np.ndarray<nb_samples, nb_features>, [str]:
+
+    >>> image = np.zeros((2, 3, 8))
+    >>> image[0, :, 2:6] = 1
+    >>> image[1, :, 3:7] = 3
+    >>> segm = np.array([[[0, 0, 0, 0, 1, 1, 1, 1]] * 3,
+    ...                  [[2, 2, 2, 2, 5, 5, 5, 5]] * 3])
+    >>> accum = {'count': np.bincount(segm.ravel()),
+    ...          'sum': np.bincount(segm.ravel(), weights=image.ravel()),
+    ...          'sum2': np.bincount(segm.ravel(), weights=image.ravel() ** 2)}
+    >>> features, names = compute_gray_statistic_accumulators(accum)
+    >>> np.round(features, 3)
+    array([[ 0.5  ,  0.5  ,  0.5  ],
+           [ 0.5  ,  0.5  ,  0.5  ],
+           [ 0.75 ,  1.299,  2.25 ],
+           [ 0.   ,  0.   ,  0.   ],
+           [ 0.   ,  0.   ,  0.   ],
+           [ 2.25 ,  1.299,  6.75 ]])
+    >>> names
+    ['gray_mean', 'gray_std', 'gray_energy']
+    """
+    not_supported = [f for f in list_feature_flags
+                     if f not in ('mean', 'std', 'eng')]
+    if not_supported:
+        raise ValueError('not supported features from accumulators: %s'
+                         % repr(not_supported))
+    counts = np.asarray(accumulators['count'], dtype=float)
+    counts[counts == 0] = 1
+    mean = accumulators['sum'] / counts
+    energy = accumulators['sum2'] / counts
+
+    features, names = [], []
+    if 'mean' in list_feature_flags:
+        features.append(mean)
+        names += ['%s_mean' % ch_name]
+    if 'std' in list_feature_flags:
+        features.append(np.sqrt(np.clip(energy - mean ** 2, 0, None)))
+        names += ['%s_std' % ch_name]
+    if 'eng' in list_feature_flags:
+        features.append(energy)
+        names += ['%s_energy' % ch_name]
+    features = np.array(features).T
+    return features, names
 
 
 def compute_image3d_gray_statistic(image, segm,
                                    list_feature_flags=('mean', 'std', 'eng',
                                                        'median', 'mG'),
-                                   ch_name='gray'):
+                                   ch_name='gray', nb_jobs=1,
+                                   median_nb_bins=None):
     """ compute complete descriptors / statistic on gray (3D) images
 
     :param ndarray image:
     :param ndarray segm:
     :param list_feature_flags:
+    :param str ch_name: name of the channel used in feature names
+    :param int nb_jobs: number of threads used by Cython implementation
+    :param int median_nb_bins: estimate the median from histogram with this
+        number of bins (e.g. `MEDIAN_HIST_NB_BINS`) in Cython implementation,
+        which is faster for large images, None means the exact median
     :return np.ndarray<nb_samples, nb_features>, [str]:
 
     >>> image = np.zeros((2, 3, 8))
@@ -621,34 +776,45 @@ def compute_image3d_gray_statistic(image, segm,
     # nb_fts = image.shape[0]
     # ch_names = ['%s-ch%i' % (ch_name, i + 1) for i in range(nb_fts)]
 
+    # all basic statistics in single pass over the image
+    stat = None
+    if USE_CYTHON and any(f in list_feature_flags
+                          for f in ('mean', 'std', 'eng', 'median')):
+        nb_bins = median_nb_bins if 'median' in list_feature_flags else 0
+        stat = cython_label_statistic(image, segm, nb_bins, nb_jobs)
+        stat = {k: stat[k][:, 0] for k in stat if k != 'count'}
+
     # MEAN
     mean = None
     if 'mean' in list_feature_flags:
-        if USE_CYTHON:
-            mean = cython_img3d_gray_mean(image, segm)
+        if stat is not None:
+            mean = stat['mean']
         else:
             mean = numpy_img3d_gray_mean(image, segm)
         features.append(mean)
         names += ['%s_mean' % ch_name]
     # Standard Deviation
     if 'std' in list_feature_flags:
-        if USE_CYTHON:
-            std = cython_img3d_gray_std(image, segm, mean)
+        if stat is not None:
+            std = stat['std']
         else:
             std = numpy_img3d_gray_std(image, segm, mean)
         features.append(std)
         names += ['%s_std' % ch_name]
     # ENERGY
     if 'eng' in list_feature_flags:
-        if USE_CYTHON:
-            energy = cython_img3d_gray_energy(image, segm)
+        if stat is not None:
+            energy = stat['eng']
         else:
             energy = numpy_img3d_gray_energy(image, segm)
         features.append(energy)
         names += ['%s_energy' % ch_name]
     # MEDIAN
     if 'median' in list_feature_flags:
-        median = numpy_img3d_gray_median(image, segm)
+        if stat is not None:
+            median = stat['median']
+        else:
+            median = numpy_img3d_gray_median(image, segm)
         features.append(median)
         names += ['%s_median' % ch_name]
     # mean Gradient
@@ -657,7 +823,7 @@ def compute_image3d_gray_statistic(image, segm,
         for i in range(image.shape[0]):
             grad_matrix[i, :, :] = np.sum(np.gradient(image[i]), axis=0)
         if USE_CYTHON:
-            grad = cython_img3d_gray_mean(grad_matrix, segm)
+            grad = cython_img3d_gray_mean(grad_matrix, segm, nb_jobs)
         else:
             grad = numpy_img3d_gray_mean(grad_matrix, segm)
         features.append(grad)
@@ -672,12 +838,18 @@ def compute_image3d_gray_statistic(image, segm,
 def compute_image2d_color_statistic(image, segm,
                                     list_feature_flags=('mean', 'std', 'eng',
                                                         'median'),
-                                    ch_name='color'):
+                                    ch_name='color', nb_jobs=1,
+                                    median_nb_bins=None):
     """ compute complete descriptors / statistic on color (2D) images
 
     :param ndarray image:
     :param ndarray segm:
     :param list_feature_flags:
+    :param str ch_name: name of the channel used in feature names
+    :param int nb_jobs: number of threads used by Cython implementation
+    :param int median_nb_bins: estimate the median from histogram with this
+        number of bins (e.g. `MEDIAN_HIST_NB_BINS`) in Cython implementation,
+        which is faster for large images, None means the exact median
     :return np.ndarray<nb_samples, nb_features>, [str]:
 
     >>> image = np.zeros((2, 10, 3))
@@ -707,34 +879,45 @@ def compute_image2d_color_statistic(image, segm,
     names = []
     ch_names = ['%s-ch%i' % (ch_name, i + 1) for i in range(3)]
 
+    # all basic statistics in single pass over the image
+    stat = None
+    if USE_CYTHON and any(f in list_feature_flags
+                          for f in ('mean', 'std', 'eng', 'median')):
+        nb_bins = median_nb_bins if 'median' in list_feature_flags else 0
+        stat = cython_label_statistic(image.reshape(-1, 3), segm, nb_bins,
+                                      nb_jobs)
+
     # MEAN
     mean = None
     if 'mean' in list_feature_flags:
-        if USE_CYTHON:
-            mean = cython_img2d_color_mean(image, segm)
+        if stat is not None:
+            mean = stat['mean']
         else:
             mean = numpy_img2d_color_mean(image, segm)
         features = np.hstack((features, mean))
         names += ['%s_mean' % n for n in ch_names]
     # Standard Deviation
     if 'std' in list_feature_flags:
-        if USE_CYTHON:
-            std = cython_img2d_color_std(image, segm, mean)
+        if stat is not None:
+            std = stat['std']
         else:
             std = numpy_img2d_color_std(image, segm, mean)
         features = np.hstack((features, std))
         names += ['%s_std' % n for n in ch_names]
     # ENERGY
     if 'eng' in list_feature_flags:
-        if USE_CYTHON:
-            energy = cython_img2d_color_energy(image, segm)
+        if stat is not None:
+            energy = stat['eng']
         else:
             energy = numpy_img2d_color_energy(image, segm)
         features = np.hstack((features, energy))
         names += ['%s_energy' % n for n in ch_names]
     # Median
     if 'median' in list_feature_flags:
-        median = numpy_img2d_color_median(image, segm)
+        if stat is not None:
+            median = stat['median']
+        else:
+            median = numpy_img2d_color_median(image, segm)
         features = np.hstack((features, median))
         names += ['%s_median' % n for n in ch_names]
     # mean Gradient
@@ -835,16 +1018,143 @@ def create_filter_bank_lm_2d(radius=16, sigmas=DEFAULT_FILTERS_SIGMAS,
     return filters, names
 
 
-def compute_img_filter_response2d(im, filter_battery):
+def decompose_filter_separable(kernel, tol=FILTER_SEPARABLE_TOL):
+    """ decompose 2D kernel into sum of outer products of 1D filters using SVD,
+    the Gaussian is single product and Laplace of Gaussian is sum of two
+
+    :param ndarray kernel: 2D filter kernel
+    :param float tol: relative tolerance for neglecting singular values
+    :return [(ndarray, ndarray)]: pairs of filters along axis 0 and axis 1
+
+    >>> kernel = np.outer([1, 2, 1], [-1, 0, 1])
+    >>> comps = decompose_filter_separable(kernel)
+    >>> len(comps)
+    1
+    >>> np.allclose(np.outer(*comps[0]), kernel)
+    True
+    >>> filters, _ = create_filter_bank_lm_2d(6, SHORT_FILTERS_SIGMAS, 4)
+    >>> [len(decompose_filter_separable(fl)) for fl in filters[3]]
+    [2]
+    """
+    u, sigmas, v = np.linalg.svd(kernel)
+    if sigmas[0] <= 0:
+        return []
+    rank = int(np.sum(sigmas > tol * sigmas[0]))
+    return [(u[:, i] * sigmas[i], v[i]) for i in range(rank)]
+
+
+def _filter_response_separable(im, components):
+    """ convolve image with sum of separable components
+    with the same boundary handling as `ndimage.convolve`
+
+    :param ndarray im: 2D image
+    :param [(ndarray, ndarray)] components: 1D filters along axis 0 and 1
+    :return ndarray:
+    """
+    response = np.zeros(im.shape)
+    for fl_0, fl_1 in components:
+        resp = ndimage.convolve1d(im, fl_0, axis=0, mode='reflect')
+        response += ndimage.convolve1d(resp, fl_1, axis=1, mode='reflect')
+    return response
+
+
+def _filter_responses_fft(im, kernels):
+    """ convolve image with set of kernels by FFT sharing the image transform,
+    the image is padded by reflection as it is in `ndimage.convolve`
+
+    :param ndarray im: 2D image
+    :param [ndarray] kernels: 2D kernels with the same odd size
+    :return [ndarray]:
+    """
+    k_size = kernels[0].shape
+    pad = [(k // 2, k // 2) for k in k_size]
+    im_pad = np.pad(im, pad, mode='symmetric')
+    fft_shape = [fftpack.next_fast_len(s + k - 1)
+                 for s, k in zip(im_pad.shape, k_size)]
+    im_fft = np.fft.rfft2(im_pad, fft_shape)
+    responses = []
+    for kernel in kernels:
+        conv = np.fft.irfft2(im_fft * np.fft.rfft2(kernel, fft_shape), fft_shape)
+        # crop the part corresponding to the original image
+        responses.append(conv[k_size[0] - 1:k_size[0] - 1 + im.shape[0],
+                              k_size[1] - 1:k_size[1] - 1 + im.shape[1]])
+    return responses
+
+
+def compute_img_filter_responses(im, filter_battery, engine='auto'):
+    """ compute image responses to all filters in the battery,
+    the engine 'auto' use separable filtering for low-rank kernels
+    (Gaussian, Laplace of Gaussian, axis aligned edges) and FFT for the others
+
+    :param ndarray im: 2D image
+    :param ndarray filter_battery: np.array<nb_filters, h, w>
+    :param str engine: used engine, see `FILTER_RESPONSE_ENGINES`
+    :return ndarray: np.array<nb_filters, height, width>
+
+    >>> np.random.seed(0)
+    >>> img = np.random.random((30, 40))
+    >>> filters, _ = create_filter_bank_lm_2d(6, SHORT_FILTERS_SIGMAS, 4)
+    >>> resp = compute_img_filter_responses(img, filters[0], 'direct')
+    >>> resp.shape
+    (4, 30, 40)
+    >>> [np.allclose(compute_img_filter_responses(img, filters[0], eng), resp)
+    ...  for eng in ['auto', 'separable', 'fft']]
+    [True, True, True]
+    """
+    if engine not in FILTER_RESPONSE_ENGINES:
+        raise ValueError('not supported engine "%s"' % engine)
+    im = np.asarray(im, dtype=float)
+    responses = [None] * len(filter_battery)
+    idx_fft = []
+    for i, fl in enumerate(filter_battery):
+        if engine == 'direct':
+            responses[i] = ndimage.convolve(im, fl)
+            continue
+        if engine == 'fft':
+            idx_fft.append(i)
+            continue
+        components = decompose_filter_separable(fl)
+        if engine == 'separable' or len(components) <= FILTER_SEPARABLE_MAX_RANK:
+            responses[i] = _filter_response_separable(im, components)
+        elif min(fl.shape) >= FILTER_FFT_MIN_SIZE:
+            idx_fft.append(i)
+        else:
+            responses[i] = ndimage.convolve(im, fl)
+    if len(idx_fft) > 0:
+        resp_fft = _filter_responses_fft(im, [filter_battery[i] for i in idx_fft])
+        for i, resp in zip(idx_fft, resp_fft):
+            responses[i] = resp
+    return np.array(responses)
+
+
+def compute_img_filter_response2d(im, filter_battery, engine='auto',
+                                  check_equivalence=False):
     """ compute image filter response in 2D
 
     :param [[float]] im:
     :param [[[float]]] filter_battery:
+    :param str engine: used engine, see `FILTER_RESPONSE_ENGINES`
+    :param bool check_equivalence: compare the response with the direct
+        convolution and raise error if they differ
     :return[[float]] :
+
+    >>> np.random.seed(0)
+    >>> img = np.random.random((30, 40))
+    >>> filters, _ = create_filter_bank_lm_2d(6, SHORT_FILTERS_SIGMAS, 4)
+    >>> resp = compute_img_filter_response2d(img, filters[1],
+    ...                                      check_equivalence=True)
+    >>> resp.shape
+    (30, 40)
     """
     if filter_battery.ndim != 3:
         raise ValueError('wrong batery dim %s' % repr(filter_battery.shape))
-    responses = np.array([ndimage.convolve(im, fl) for fl in filter_battery])
+    responses = compute_img_filter_responses(im, filter_battery, engine)
+    if check_equivalence and engine != 'direct':
+        resp_direct = compute_img_filter_responses(im, filter_battery, 'direct')
+        diff = np.max(np.abs(responses - resp_direct))
+        if diff > FILTER_EQUIVALENCE_RTOL * np.max(np.abs(resp_direct)):
+            raise ValueError('engine "%s" differs from direct convolution by %e'
+                             % (engine, diff))
     if filter_battery.shape[0] > 1:
         # usually for rotational edge detectors and we tae the maximal response
         response = np.max(responses, axis=0)
@@ -853,39 +1163,126 @@ def compute_img_filter_response2d(im, filter_battery):
     return response
 
 
-def compute_img_filter_response3d(img, filter_battery):
+def compute_img_filter_response3d(img, filter_battery, engine='auto',
+                                  check_equivalence=False):
     """ compute image filter response in 3D
 
     :param ndarray img:
     :param ndarray filter_battery:
+    :param str engine: used engine, see `FILTER_RESPONSE_ENGINES`
+    :param bool check_equivalence: compare with the direct convolution
     :return:
     """
     logging.debug('compute image filter response in 3D')
     response = np.array([compute_img_filter_response2d(img[i, :, :],
-                                                       filter_battery)
+                                                       filter_battery, engine,
+                                                       check_equivalence)
                          for i in range(img.shape[0])])
     return response
 
 
-def image_subtract_gauss_smooth(img, sigma):
+def gaussian_filter_fast(img, sigma, max_error=GAUSS_FAST_MAX_ERROR,
+                         truncate=4.):
+    """ approximate Gaussian smoothing with large sigma by smoothing
+    block-averaged image and upscaling it back by linear interpolation
+
+    The downscale factor `f` is chosen from the linear interpolation error bound
+    `f^2 / 8 * max|I''|` per axis, where for Gaussian smoothed image holds
+    `max|I''| <= 0.968 / sigma^2 * (max(img) - min(img))`,
+    so the error is bounded by `max_error * (max(img) - min(img))`.
+    The block averaging variance is compensated in the low resolution sigma
+    and the image is padded by reflection as it is in `gaussian_filter`.
+
+    :param ndarray img: input image of any dimension
+    :param float sigma: standard deviation of the Gaussian
+    :param float max_error: maximal error relative to the image value range
+    :param float truncate: truncate the filter at this many sigmas
+    :return ndarray:
+
+    >>> np.random.seed(0)
+    >>> img = np.random.random((150, 200))
+    >>> img[:, 100:] += 1
+    >>> img_fast = gaussian_filter_fast(img, 50)
+    >>> img_exact = gaussian_filter(img, 50)
+    >>> err = np.max(np.abs(img_fast - img_exact)) / (img.max() - img.min())
+    >>> err < GAUSS_FAST_MAX_ERROR
+    True
+    """
+    img = np.asarray(img, dtype=float)
+    factor = int(sigma * np.sqrt(max_error / (0.121 * img.ndim)))
+    # downscale only axes which are long enough
+    axes = [i for i in range(img.ndim) if img.shape[i] >= 2 * factor]
+    if factor < 2 or len(axes) == 0:
+        return gaussian_filter(img, sigma, truncate=truncate)
+
+    img_small, pads = img, {}
+    for i in axes:
+        pads[i] = int(np.ceil(truncate * sigma / factor)) * factor
+        pad = [(0, 0)] * img.ndim
+        pad[i] = (pads[i], pads[i] + (-img.shape[i]) % factor)
+        img_small = np.pad(img_small, pad, mode='symmetric')
+        shape = img_small.shape[:i] + (img_small.shape[i] // factor, factor) \
+                + img_small.shape[i + 1:]
+        img_small = img_small.reshape(shape).mean(axis=i + 1)
+
+    sigma_small = np.sqrt(sigma ** 2 - factor ** 2 / 12.) / factor
+    for i in range(img.ndim):
+        img_small = gaussian_filter1d(img_small,
+                                      sigma_small if i in axes else sigma,
+                                      axis=i, truncate=truncate)
+
+    img_smooth = img_small
+    for i in axes:
+        # position of original pixels in coordinates of block centres
+        pos = (np.arange(img.shape[i]) + pads[i] - (factor - 1) / 2.) / factor
+        idx = np.floor(pos).astype(int)
+        weight = (pos - idx).reshape([-1 if j == i else 1
+                                      for j in range(img.ndim)])
+        img_smooth = np.take(img_smooth, idx, axis=i) * (1 - weight) \
+                     + np.take(img_smooth, idx + 1, axis=i) * weight
+    return img_smooth
+
+
+def image_subtract_gauss_smooth(img, sigma, smooth_fast=False):
     """ smoothing by fist dimension assuming the in dim 0. image is independent
 
     :param ndarray img:
     :param sigma:
+    :param bool smooth_fast: use approximation `gaussian_filter_fast`
     :return:
+
+    >>> np.random.seed(0)
+    >>> img = np.random.random((2, 100, 150))
+    >>> img_diff = image_subtract_gauss_smooth(img, 150)
+    >>> img_diff_fast = image_subtract_gauss_smooth(img, 150, smooth_fast=True)
+    >>> err = np.max(np.abs(img_diff - img_diff_fast))
+    >>> 0 < err < GAUSS_FAST_MAX_ERROR
+    True
     """
     if sigma <= 0:
         return img
     img_smooth = np.zeros(img.shape)
     for i in range(img.shape[0]):
-        img_smooth[i, :, :] = gaussian_filter(
-                                            img[i, :, :].astype(float), sigma)
+        img_smooth[i, :, :] = gaussian_smooth(img[i, :, :], sigma, smooth_fast)
     img = (img - img_smooth)
     return img
 
 
+def gaussian_smooth(img, sigma, smooth_fast=False):
+    """ Gaussian smoothing, exact or the fast approximation
+
+    :param ndarray img:
+    :param float sigma:
+    :param bool smooth_fast: use approximation `gaussian_filter_fast`
+    :return ndarray:
+    """
+    if smooth_fast:
+        return gaussian_filter_fast(img, sigma)
+    return gaussian_filter(np.asarray(img, dtype=float), sigma)
+
+
 def compute_texture_desc_lm_img3d_val(img, seg, list_feature_flags,
-                                      bank_type='normal'):
+                                      bank_type='normal', smooth_fast=False):
     """ compute texture descriptors as mean / std / ...
     on Lewen-Malik filter bank response
 
@@ -893,12 +1290,13 @@ def compute_texture_desc_lm_img3d_val(img, seg, list_feature_flags,
     :param [[[int]]] seg:
     :param [str] list_feature_flags:
     :param str bank_type: define used LM filter bank ['short', 'normal']
+    :param bool smooth_fast: fast approximation of background subtraction
     :return np.ndarray<nb_samples, nb_features>, [str]:
     """
     _check_gray_image_segm(img, seg)
 
     logging.debug('compute texture descriptors using Leung-Malik')
-    img = image_subtract_gauss_smooth(img, 150)
+    img = image_subtract_gauss_smooth(img, 150, smooth_fast)
     if bank_type == 'short':
         filters, fl_names = create_filter_bank_lm_2d(sigmas=SHORT_FILTERS_SIGMAS,
                                                      nb_orient=4)
@@ -922,13 +1320,17 @@ def compute_texture_desc_lm_img3d_val(img, seg, list_feature_flags,
 
 
 def compute_texture_desc_lm_img2d_clr(img, seg, list_feature_flags,
-                                      bank_type='normal'):
+                                      bank_type='normal', tile_size=None,
+                                      smooth_fast=False):
     """ compute texture descriptors via Lewen-Malik filter response
 
     :param ndarray img:
     :param ndarray seg:
     :param [str] list_feature_flags:
     :param str bank_type: define used LM filter bank ['short', 'normal']
+    :param int tile_size: process the image in tiles of this size to bound
+        the memory, see `compute_texture_desc_lm_img2d_clr_tiled`
+    :param bool smooth_fast: fast approximation of background subtraction
     :return np.ndarray<nb_samples, nb_features>, [str]:
 
     >>> h, w, step = 30, 20, 5
@@ -956,8 +1358,13 @@ def compute_texture_desc_lm_img2d_clr(img, seg, list_feature_flags,
      'tLM_sigma4.0-edge-ch1_mean', ..., 'tLM_sigma4.0-GaussLap2-ch3_median']
     """
     _check_color_image(img)
+    if tile_size is not None:
+        return compute_texture_desc_lm_img2d_clr_tiled(img, seg,
+                                                       list_feature_flags,
+                                                       bank_type, tile_size,
+                                                       smooth_fast)
     logging.debug('compute texture descriptors using Leung-Malik')
-    img = (img - gaussian_filter(img.astype(float), 150))
+    img = (img - gaussian_smooth(img, 150, smooth_fast))
     img_roll = np.rollaxis(img, -1, 0)
     if bank_type == 'short':
         filters, fl_names = create_filter_bank_lm_2d(sigmas=SHORT_FILTERS_SIGMAS,
@@ -981,13 +1388,133 @@ def compute_texture_desc_lm_img2d_clr(img, seg, list_feature_flags,
     return features, names
 
 
+def compute_texture_desc_lm_img2d_clr_tiled(img, seg, list_feature_flags,
+                                            bank_type='normal', tile_size=1024,
+                                            smooth_fast=False):
+    """ compute texture descriptors via Lewen-Malik filter response
+    in tiles with halo of the filter radius, so the filter responses are kept
+    only for a single tile; the per-segment sums and squared sums are
+    accumulated over all tiles and the global response norm is applied on
+    the end, which gives the same features as the whole image computation
+    (up to single precision of the tiles)
+
+    The smooth background is also subtracted per tile, smoothing the tile
+    with additional halo of the Gaussian truncation radius, so the memory
+    depends only on the tile size (but the halo makes it expensive for
+    small tiles).
+
+    NOTE: the median can not be merged over tiles so it is not supported
+
+    :param ndarray img:
+    :param ndarray seg:
+    :param [str] list_feature_flags: subset of ('mean', 'std', 'eng')
+    :param str bank_type: define used LM filter bank ['short', 'normal']
+    :param int tile_size: size of the tile (without the halo)
+    :param bool smooth_fast: fast approximation of background subtraction
+    :return np.ndarray<nb_samples, nb_features>, [str]:
+
+    >>> h, w, step = 40, 30, 5
+    >>> np.random.seed(0)
+    >>> seg = np.arange(h * w // step ** 2).reshape(h // step, w // step)
+    >>> seg = np.repeat(np.repeat(seg, step, axis=0), step, axis=1)
+    >>> img = np.random.random((h, w, 3))
+    >>> flags = ['mean', 'std', 'eng']
+    >>> fts, names = compute_texture_desc_lm_img2d_clr(img, seg, flags,
+    ...                                                bank_type='short')
+    >>> fts_tiled, names_tiled = compute_texture_desc_lm_img2d_clr_tiled(
+    ...                       img, seg, flags, bank_type='short', tile_size=16)
+    >>> fts_tiled.shape
+    (48, 135)
+    >>> names == names_tiled, np.allclose(fts, fts_tiled, atol=1e-5)
+    (True, True)
+    """
+    _check_color_image(img)
+    _check_color_image_segm(img, seg)
+    if any(f not in ('mean', 'std', 'eng') for f in list_feature_flags):
+        raise ValueError('tiled texture features support only mean, std and '
+                         'eng, not %s' % repr(list_feature_flags))
+    logging.debug('compute texture descriptors using Leung-Malik in tiles')
+    # the same as in `gaussian_filter` with default truncation to 4 sigmas
+    sigma_bg = 150
+    halo_bg = int(4 * sigma_bg + 0.5)
+    if bank_type == 'short':
+        filters, fl_names = create_filter_bank_lm_2d(sigmas=SHORT_FILTERS_SIGMAS,
+                                                     nb_orient=4)
+    else:
+        filters, fl_names = create_filter_bank_lm_2d()
+    halo = max(max(fl.shape[1:]) for fl in filters) // 2
+
+    nb_labels = np.max(seg) + 1
+    counts = np.bincount(seg.ravel(), minlength=nb_labels).astype(float)
+    sums = np.zeros((len(filters), nb_labels, img.shape[2]))
+    sums_2 = np.zeros((len(filters), nb_labels, img.shape[2]))
+    norms_2 = np.zeros(len(filters))
+    height, width = seg.shape
+    for i in range(0, height, tile_size):
+        for j in range(0, width, tile_size):
+            # tile extended by halo clipped on the image border
+            i_begin, i_end = max(0, i - halo), min(height, i + tile_size + halo)
+            j_begin, j_end = max(0, j - halo), min(width, j + tile_size + halo)
+            core = (slice(i - i_begin, min(height, i + tile_size) - i_begin),
+                    slice(j - j_begin, min(width, j + tile_size) - j_begin))
+            seg_tile = seg[i:i + tile_size, j:j + tile_size].ravel()
+            # subtract background smoothed on the tile with the Gaussian halo
+            i_bg, j_bg = max(0, i_begin - halo_bg), max(0, j_begin - halo_bg)
+            img_bg = np.asarray(img[i_bg:min(height, i_end + halo_bg),
+                                    j_bg:min(width, j_end + halo_bg)],
+                                dtype=np.float32)
+            img_bg = gaussian_smooth(img_bg, sigma_bg, smooth_fast)
+            img_tile = np.asarray(img[i_begin:i_end, j_begin:j_end],
+                                  dtype=np.float32)
+            img_tile -= img_bg[i_begin - i_bg:i_end - i_bg,
+                               j_begin - j_bg:j_end - j_bg]
+            del img_bg
+            for k, fl_battery in enumerate(filters):
+                for ch in range(img.shape[2]):
+                    response = compute_img_filter_response2d(
+                        img_tile[:, :, ch], fl_battery)
+                    response = response[core].ravel()
+                    sums[k, :, ch] += np.bincount(seg_tile, weights=response,
+                                                  minlength=nb_labels)
+                    sums_2[k, :, ch] += np.bincount(seg_tile,
+                                                    weights=response ** 2,
+                                                    minlength=nb_labels)
+                    norms_2[k] += np.sum(response ** 2)
+
+    counts[counts == 0] = np.nan
+    features, names = [], []
+    ch_names = ['ch%i' % (i + 1) for i in range(img.shape[2])]
+    for k, fl_name in enumerate(fl_names):
+        # the same norm of responses as in the whole image computation
+        norm = np.sqrt(norms_2[k])
+        coef = (np.log(1 + norm) / 0.03) / norm
+        mean = sums[k] / counts[:, np.newaxis]
+        energy = sums_2[k] / counts[:, np.newaxis]
+        if 'mean' in list_feature_flags:
+            features.append(coef * mean)
+            names += ['%s-%s_mean' % (fl_name, n) for n in ch_names]
+        if 'std' in list_feature_flags:
+            features.append(coef * np.sqrt(np.clip(energy - mean ** 2, 0, None)))
+            names += ['%s-%s_std' % (fl_name, n) for n in ch_names]
+        if 'eng' in list_feature_flags:
+            features.append(coef ** 2 * energy)
+            names += ['%s-%s_energy' % (fl_name, n) for n in ch_names]
+    features = np.nan_to_num(np.concatenate(tuple(features), axis=1))
+    names = ['tLM_%s' % n for n in names]
+    assert features.shape[1] == len(names)
+    return features, names
+
+
 def compute_selected_features_gray3d(img, segments,
-                                     dict_feature_flags=FEATURES_SET_COLOR):
+                                     dict_feature_flags=FEATURES_SET_COLOR,
+                                     smooth_fast=False):
     """ compute selected features on gray 3D image
 
     :param ndarray img:
     :param ndarray segments:
     :param {str: [str]} dict_feature_flags:
+    :param bool smooth_fast: fast approximation of background subtraction
+        for texture features, see `gaussian_filter_fast`
     :return np.ndarray<nb_samples, nb_features>, [str]:
 
     >>> np.random.seed(0)
@@ -1009,6 +1536,10 @@ def compute_selected_features_gray3d(img, segments,
     (4, 45)
     >>> names  # doctest: +ELLIPSIS +NORMALIZE_WHITESPACE
     ['tLM_sigma1.4-edge_mean', ..., 'tLM_sigma4.0-GaussLap2_energy']
+    >>> fts_fast, _ = compute_selected_features_gray3d(img, slic,
+    ...                   {'tLM_s': ['mean', 'std', 'eng']}, smooth_fast=True)
+    >>> fts_fast.shape
+    (4, 45)
 
     """
     _check_gray_image_segm(img, segments)
@@ -1022,13 +1553,14 @@ def compute_selected_features_gray3d(img, segments,
         names += n
     if 'tLM' in dict_feature_flags:
         fts, n = compute_texture_desc_lm_img3d_val(img, segments,
-                                                dict_feature_flags['tLM'])
+                                                   dict_feature_flags['tLM'],
+                                                   smooth_fast=smooth_fast)
         features.append(fts)
         names += n
     elif 'tLM_s' in dict_feature_flags:
         fts, n = compute_texture_desc_lm_img3d_val(img, segments,
                                                    dict_feature_flags['tLM_s'],
-                                                   'short')
+                                                   'short', smooth_fast)
         features.append(fts)
         names += n
     if len(features) == 0:
@@ -1040,12 +1572,15 @@ def compute_selected_features_gray3d(img, segments,
 
 
 def compute_selected_features_gray2d(img, segments,
-                                     dict_features_flags=FEATURES_SET_ALL):
+                                     dict_features_flags=FEATURES_SET_ALL,
+                                     smooth_fast=False):
     """
 
     :param ndarray img:
     :param ndarray segments:
     :param dict_features_flags:
+    :param bool smooth_fast: fast approximation of background subtraction
+        for texture features, see `gaussian_filter_fast`
     :return np.ndarray<nb_samples, nb_features>, [str]:
 
     >>> image = np.zeros((2, 10))
@@ -1072,18 +1607,23 @@ def compute_selected_features_gray2d(img, segments,
 
     features, names = compute_selected_features_gray3d(img[np.newaxis, ...],
                                                        segments[np.newaxis, ...],
-                                                       dict_features_flags)
+                                                       dict_features_flags,
+                                                       smooth_fast)
     assert features.shape[1] == len(names)
     return features, names
 
 
 def compute_selected_features_color2d(img, segments,
-                                      dict_feature_flags=FEATURES_SET_ALL):
+                                      dict_feature_flags=FEATURES_SET_ALL,
+                                      tile_size=None, smooth_fast=False):
     """ compute selected features color2d
 
     :param ndarray img:
     :param ndarray segments:
     :param dict_feature_flags:
+    :param int tile_size: compute texture features in tiles of given size
+    :param bool smooth_fast: fast approximation of background subtraction
+        for texture features, see `gaussian_filter_fast`
     :return np.ndarray<nb_samples, nb_features>, [str]:
 
     >>> image = np.zeros((2, 10, 3))
@@ -1117,13 +1657,16 @@ def compute_selected_features_color2d(img, segments,
         names += n
     if 'tLM' in dict_feature_flags:
         fts, n = compute_texture_desc_lm_img2d_clr(img, segments,
-                                                   dict_feature_flags['tLM'])
+                                                   dict_feature_flags['tLM'],
+                                                   tile_size=tile_size,
+                                                   smooth_fast=smooth_fast)
         features = np.concatenate((features, fts), axis=1)
         names += n
     elif 'tLM_s' in dict_feature_flags:
         fts, n = compute_texture_desc_lm_img2d_clr(img, segments,
                                                    dict_feature_flags['tLM_s'],
-                                                   'short')
+                                                   'short', tile_size,
+                                                   smooth_fast)
         features = np.concatenate((features, fts), axis=1)
         names += n
     if len(features) == 0:
@@ -1133,15 +1676,138 @@ def compute_selected_features_color2d(img, segments,
 
 
 def compute_selected_features_img2d(image, segm,
-                                    dict_features_flags=FEATURES_SET_COLOR):
+                                    dict_features_flags=FEATURES_SET_COLOR,
+                                    path_cache=None, smooth_fast=False):
+    """ compute selected features for gray or color 2D image,
+    the features may be cached on disk by the image and segmentation content
+
+    :param ndarray image: gray or color image
+    :param ndarray segm: segmentation / superpixels
+    :param {str: [str]} dict_features_flags: selected features
+    :param str path_cache: path to the cache folder, None means no cache
+    :param bool smooth_fast: fast approximation of background subtraction
+        for texture features, see `gaussian_filter_fast`
+    :return np.ndarray<nb_samples, nb_features>, [str]:
+
+    >>> import shutil
+    >>> np.random.seed(0)
+    >>> image = np.random.random((20, 30, 3))
+    >>> segm = np.repeat(np.arange(6), 100).reshape(20, 30)
+    >>> fts, names = compute_selected_features_img2d(image, segm,
+    ...                                              path_cache='./sample-cache')
+    >>> fts_cache, names_cache = compute_selected_features_img2d(
+    ...                            image, segm, path_cache='./sample-cache')
+    >>> np.array_equal(fts, fts_cache), names == names_cache
+    (True, True)
+    >>> shutil.rmtree('./sample-cache')
+    """
+    key = None
+    if path_cache is not None:
+        key = tl_cache.compute_cache_key(image, segm, name='features_img2d',
+                                         features=dict_features_flags,
+                                         smooth_fast=smooth_fast)
+        data = tl_cache.cache_load(path_cache, key)
+        if data is not None:
+            return np.array(data['features'], dtype=float), \
+                   data['names'].tolist()
+
     if image.ndim == 3 and image.shape[2] == 3:
-        return compute_selected_features_color2d(image, segm,
-                                                 dict_features_flags)
+        features, names = compute_selected_features_color2d(
+            image, segm, dict_features_flags, smooth_fast=smooth_fast)
     elif image.ndim == 2:
-        return compute_selected_features_gray2d(image, segm,
-                                                dict_features_flags)
+        features, names = compute_selected_features_gray2d(
+            image, segm, dict_features_flags, smooth_fast)
     else:
         logging.error('invalid image size - %s', repr(image.shape))
+        return None
+
+    if key is not None:
+        data = tl_cache.cache_save(path_cache, key, {'features': features,
+                                                     'names': np.array(names)})
+        # return the same values as would be loaded from cache
+        features = np.array(data['features'], dtype=float)
+    return features, names
+
+
+def compute_selected_features_img2d_reuse(image, segm, features_prev,
+                                          lut_prev,
+                                          dict_features_flags=FEATURES_SET_COLOR,
+                                          smooth_fast=False):
+    """ compute selected features for gray or color 2D image in a stack where
+    the features of superpixels unchanged from the previous image are reused,
+    see `segmentation.superpixels.segment_slic_img2d_warm`
+
+    NOTE: only the colour statistic is local for each superpixel, so it is
+    computed just for changed superpixels; the texture features are normalised
+    over the whole image and they are always recomputed
+
+    :param ndarray image: gray or color image
+    :param ndarray segm: segmentation / superpixels
+    :param ndarray features_prev: features of previous superpixels
+    :param ndarray lut_prev: index of the same superpixel in previous
+        segmentation for each superpixel or -1 if it has changed
+    :param {str: [str]} dict_features_flags: selected features
+    :param bool smooth_fast: fast approximation of background subtraction
+        for texture features, see `gaussian_filter_fast`
+    :return np.ndarray<nb_samples, nb_features>, [str]:
+
+    >>> np.random.seed(0)
+    >>> image = np.random.random((20, 30, 3))
+    >>> segm = np.repeat(np.arange(6), 100).reshape(20, 30)
+    >>> fts, names = compute_selected_features_img2d(image, segm)
+    >>> image[-3:] = 0.5
+    >>> segm = (segm + 3) % 6
+    >>> lut = np.array([3, 4, -1, 0, 1, 2])
+    >>> fts_reuse, names_reuse = compute_selected_features_img2d_reuse(
+    ...                                 image, segm, fts, lut)
+    >>> fts_new, _ = compute_selected_features_img2d(image, segm)
+    >>> np.allclose(fts_reuse, fts_new), names == names_reuse
+    (True, True)
+    >>> fts_reuse, _ = compute_selected_features_img2d_reuse(
+    ...                     image, segm, fts, lut, {'tLM_s': ['mean']})
+    >>> fts_reuse.shape
+    (6, 45)
+    """
+    lut_prev = np.asarray(lut_prev)
+    assert len(lut_prev) == np.max(segm) + 1, \
+        'lut (%i) does not match segmentation (%i)' \
+        % (len(lut_prev), np.max(segm) + 1)
+    if features_prev is None or np.all(lut_prev < 0) \
+            or 'color' not in dict_features_flags:
+        return compute_selected_features_img2d(image, segm, dict_features_flags,
+                                               smooth_fast=smooth_fast)
+
+    changed = lut_prev < 0
+    # at least one superpixel has to be computed to get the feature names
+    if not np.any(changed[segm]):
+        changed[segm.flat[0]] = True
+    nb_changed = np.sum(changed)
+    logging.debug('computing colour features for %i of %i superpixels',
+                  nb_changed, len(changed))
+    # changed superpixels in the bounding box, the others as a dummy label
+    lut_crop = np.full(len(changed), nb_changed)
+    lut_crop[changed] = np.arange(nb_changed)
+    rows, cols = np.nonzero(changed[segm])
+    crop = (slice(rows.min(), rows.max() + 1),
+            slice(cols.min(), cols.max() + 1))
+    fts_crop, names = compute_selected_features_img2d(
+        image[crop], lut_crop[segm[crop]], {'color': dict_features_flags['color']})
+    nb_fts = fts_crop.shape[1]
+    features = np.zeros((len(changed), nb_fts))
+    # the last changed superpixels may miss in the crop if they are empty
+    idx_changed = np.where(changed)[0]
+    idx_changed = idx_changed[lut_crop[idx_changed] < len(fts_crop)]
+    features[idx_changed] = fts_crop[lut_crop[idx_changed]]
+    features[~changed] = np.asarray(features_prev)[lut_prev[~changed], :nb_fts]
+
+    dict_others = {k: dict_features_flags[k] for k in dict_features_flags
+                   if k != 'color'}
+    if len(dict_others) > 0:
+        fts_others, names_others = compute_selected_features_img2d(
+            image, segm, dict_others, smooth_fast=smooth_fast)
+        features = np.concatenate((features, fts_others), axis=1)
+        names += names_others
+    return features, names
 
 
 def extend_segm_by_struct_elem(segm, struc_elem):
@@ -1171,14 +1837,18 @@ def extend_segm_by_struct_elem(segm, struc_elem):
 
 def compute_label_histograms_positions(segm, list_positions,
                                        diameters=HIST_CIRCLE_DIAGONALS,
-                                       nb_labels=None):
+                                       nb_labels=None, dense=None):
     """ compute the histogram features doe consecutive growing diameter
     of inter circle neighbouring around given points in the segmentation
 
+    The dense mode computes per-label disk sums for whole image by convolution
+    and samples them, which is much faster for many positions or large disks.
+
     :param ndarray segm: np.array<height, width>
     :param list_positions:  [(int, int)]
     :param diameters: [int]
     :param nb_labels: int
+    :param bool dense: use convolution, None choose by estimated cost
     :return: np.array<nb_samples, nb_features>, [str]
 
 
@@ -1199,6 +1869,10 @@ def compute_label_histograms_positions(segm, list_positions,
            [ 0.  ,  0.2 ,  0.8 ,  0.  ,  0.62,  0.38,  0.22,  0.75,  0.03],
            [ 0.2 ,  0.8 ,  0.  ,  0.5 ,  0.5 ,  0.  ,  0.31,  0.22,  0.14],
            [ 0.  ,  0.8 ,  0.2 ,  0.12,  0.62,  0.25,  0.42,  0.39,  0.14]])
+    >>> hists_dense, _ = compute_label_histograms_positions(
+    ...     segm, points, [1, 2, 4], 3, dense=True)
+    >>> np.allclose(hists, hists_dense)
+    True
     """
     pos_dim = np.asarray(list_positions).shape[1]
     assert (segm.ndim - pos_dim) in (0, 1)
@@ -1211,40 +1885,127 @@ def compute_label_histograms_positions(segm, list_positions,
         else:
             logging.error('estimate nb labels failed')
 
+    if dense is None:
+        # compare the cost of cropping windows with convolving whole image
+        size_windows = len(list_positions) * nb_labels \
+            * sum((2 * d + 1) ** 2 for d in diameters)
+        size_fft = np.prod([s + 2 * max(diameters) for s in segm.shape[:2]])
+        dense = size_windows > HIST_DENSE_COST_RATIO * size_fft \
+            * nb_labels * (len(diameters) + 1)
+
+    if dense:
+        logging.debug('compute circular histogram by convolution')
+        hists = compute_label_disk_sums_dense(segm, list_positions,
+                                              diameters, nb_labels)
+    else:
+        hists = compute_label_disk_sums_windows(segm, list_positions,
+                                                diameters, nb_labels)
+
+    # subtract the inner disk and normalise by the annulus area
+    areas = np.array([np.sum(morphology.disk(d)) for d in diameters])
+    norms = np.diff(np.hstack(([0], areas)))
+    assert np.all(norms > 0)
+    hists_inner = np.concatenate((np.zeros_like(hists[:, :1]),
+                                  hists[:, :-1]), axis=1)
+    pos_hists = (hists - hists_inner) / norms[np.newaxis, :, np.newaxis]
+    pos_hists = pos_hists.reshape(len(list_positions), -1)
+
+    feature_names = ['hist-d_%i-lb_%i' % (d, lb)
+                     for d in diameters for lb in range(nb_labels)]
+    assert pos_hists.shape[1] == len(feature_names)
+    return pos_hists, feature_names
+
+
+def compute_label_disk_sums_windows(segm, list_positions, diameters,
+                                    nb_labels):
+    """ compute label histograms in growing disks around each position
+    by cropping windows from extended segmentation
+
+    :param ndarray segm: np.array<height, width> or np.array<height, width, nb_labels>
+    :param [(int, int)] list_positions: positions
+    :param [int] diameters: disk sizes
+    :param int nb_labels: number of labels
+    :return ndarray: np.array<nb_positions, nb_diameters, nb_labels>
+
+    >>> segm = np.zeros((10, 10), dtype=int)
+    >>> segm[1:9, 2:8] = 1
+    >>> compute_label_disk_sums_windows(segm, [[3, 3], [0, 9]], [1, 2], 2)
+    array([[[  0.,   5.],
+            [  1.,  12.]],
+    <BLANKLINE>
+           [[  3.,   0.],
+            [  6.,   0.]]])
+    """
     logging.debug('prepare extended segm. and struc. elements')
     list_struct_elems = [morphology.disk(d) for d in diameters]
     list_segm_extend = [extend_segm_by_struct_elem(segm, sel)
                         for sel in list_struct_elems]
 
-    pos_hists = list()
+    hists = np.zeros((len(list_positions), len(diameters), nb_labels))
     logging.debug('compute circular histogram')
-    # for each postion compute features
-    for pos in list_positions:
-        hist_pos = list()
-        hist_last = np.zeros(nb_labels)
-        sel_last = np.zeros(1)
-        for segm_extend, sel in zip(list_segm_extend, list_struct_elems):
-            norm = np.sum(sel) - np.sum(sel_last)
-            assert norm > 0
-            # hist_new = segm_convol[diam, :, pos[1], pos[0]]
+    # for each position compute features
+    for i, pos in enumerate(list_positions):
+        for j, (segm_extend, sel) in enumerate(zip(list_segm_extend,
+                                                   list_struct_elems)):
             if segm_extend.ndim == len(pos):
-                hist = compute_label_hist_segm(segm_extend, pos,
-                                               sel, nb_labels)
+                hists[i, j] = compute_label_hist_segm(segm_extend, pos,
+                                                      sel, nb_labels)
             else:
-                hist = compute_label_hist_proba(segm_extend, pos, sel)
-            # logging.debug('diff: %s last: %s new: %s',
-            # repr((hist - hist_last).tolist()), repr(hist_last.tolist()),
-            # repr(hist.tolist()))
-            hist_pos += ((hist - hist_last) / norm).tolist()
-            hist_last = hist
-            sel_last = sel
-        pos_hists.append(hist_pos)
+                hists[i, j] = compute_label_hist_proba(segm_extend, pos, sel)
+    return hists
 
-    feature_names = ['hist-d_%i-lb_%i' % (d, lb)
-                     for d in diameters for lb in range(nb_labels)]
-    pos_hists = np.array(pos_hists)
-    assert pos_hists.shape[1] == len(feature_names)
-    return np.array(pos_hists), feature_names
+
+def compute_label_disk_sums_dense(segm, list_positions, diameters, nb_labels):
+    """ compute label histograms in growing disks around each position
+    by convolving each label layer with the disks via FFT, the transform
+    of each layer is computed only once and shared by all diameters
+
+    :param ndarray segm: np.array<height, width> or np.array<height, width, nb_labels>
+    :param [(int, int)] list_positions: positions
+    :param [int] diameters: disk sizes
+    :param int nb_labels: number of labels
+    :return ndarray: np.array<nb_positions, nb_diameters, nb_labels>
+
+    >>> segm = np.zeros((10, 10), dtype=int)
+    >>> segm[1:9, 2:8] = 1
+    >>> compute_label_disk_sums_dense(segm, [[3, 3], [0, 9]], [1, 2], 2)
+    array([[[  0.,   5.],
+            [  1.,  12.]],
+    <BLANKLINE>
+           [[  3.,   0.],
+            [  6.,   0.]]])
+    >>> proba = np.rollaxis(np.array([segm == 0, segm == 1]), 0, 3)
+    >>> np.round(compute_label_disk_sums_dense(proba * 0.5, [[3, 3]], [1, 2], 2), 2)
+    array([[[ 0. ,  2.5],
+            [ 0.5,  6. ]]])
+    """
+    positions = np.asarray(list_positions).astype(int)
+    assert positions.shape[1] == 2, 'only 2D positions are supported'
+    assert segm.ndim in (2, 3)
+    img_shape = segm.shape[:2]
+    assert np.all(positions >= 0) and np.all(positions < img_shape), \
+        'positions has to lie inside the image'
+    d_max = max(diameters)
+    # zero padding avoids the cyclic wrapping of FFT convolution
+    fft_shape = [fftpack.next_fast_len(s + 2 * d_max) for s in img_shape]
+    disks_fft = [np.fft.rfft2(morphology.disk(d), fft_shape)
+                 for d in diameters]
+
+    hists = np.zeros((len(positions), len(diameters), nb_labels))
+    for lb in range(nb_labels):
+        if segm.ndim == 2:
+            layer = (segm == lb).astype(float)
+        else:
+            layer = segm[..., lb].astype(float)
+        layer_fft = np.fft.rfft2(layer, fft_shape)
+        for j, (d, disk_fft) in enumerate(zip(diameters, disks_fft)):
+            conv = np.fft.irfft2(layer_fft * disk_fft, fft_shape)
+            # the full convolution is shifted by the disk radius
+            hists[:, j, lb] = conv[positions[:, 0] + d, positions[:, 1] + d]
+    if segm.ndim == 2:
+        # hard labels give integer counts
+        hists = np.round(hists)
+    return hists
 
 
 def compute_label_hist_segm(segm, position, struc_elem, nb_labels):
@@ -1297,7 +2058,7 @@ def compute_label_hist_proba(segm, position, struc_elem):
     :return: [float]
     """
     assert segm.ndim == (len(position) + 1)
-    position = map(int, position)
+    position = [int(p) for p in position]
     # take selection around point with size of struc element
     segm_select = segm[position[0]:position[0] + struc_elem.shape[0],
                        position[1]:position[1] + struc_elem.shape[1], :]
@@ -1308,20 +2069,6 @@ def compute_label_hist_proba(segm, position, struc_elem):
     return hist
 
 
-# def compute_conv_segm_hist(segm, diameters, nb_labels):
-#     logging.debug('compute convolution images for %i labels and %s diams',
-#                   nb_labels, repr(diameters))
-#     segm_convol = np.empty((len(diameters), nb_labels)).tolist()
-#     for lb in range(nb_labels):
-#         seg_lb = (segm == lb)
-#         for i, diam in enumerate(diameters):
-#             sel = morphology.disk(diam)
-#             segm_convol[i][lb] = signal.convolve2d(seg_lb, sel)
-#     # Ttodo, roll axis,  subtract diameters,  normalise
-#     logging.error('not finished yet')
-#     return None
-
-
 def compute_ray_features_segm_2d_OLD(seg_binary, position, angle_step=5.,
                                      smooth_coef=0, edge='up'):
     """ USES WHOLE IMAGE ROTATION SO IT IS VERY SLOW
@@ -1407,6 +2154,88 @@ def compute_ray_features_segm_2d_OLD(seg_binary, position, angle_step=5.,
     return np.array(ray_dist)
 
 
+def compute_ray_features_segm_2d_batch(seg_binary, positions, angle_step=5.,
+                                       edge='up'):
+    """ compute raw Ray features for all positions and angles at once,
+    the rays are traced together by blocks of steps (cumulative sums of
+    the ray directions) and the finished rays are dropped
+
+    :param ndarray seg_binary: np.array<height, width>
+    :param [(int, int)] positions: starting points of the rays
+    :param float angle_step: angular step between rays
+    :param str edge: pointing to the up of down edge o
+    :return ndarray: np.array<nb_positions, nb_angles> distance to the edge,
+        -1 if the edge was not found
+
+    >>> seg_empty = np.zeros((100, 150), dtype=bool)
+    >>> compute_ray_features_segm_2d_batch(seg_empty, [(50, 75)], 90)
+    array([[-1, -1, -1, -1]])
+    >>> seg = np.ones((100, 150), dtype=bool)
+    >>> seg[20:80, 30:120] = False
+    >>> compute_ray_features_segm_2d_batch(seg, [(50, 75), (30, 50), (5, 5)], 90)
+    array([[45, 30, 46, 31],
+           [70, 50, 21, 11],
+           [ 0,  0,  0,  0]])
+    >>> compute_ray_features_segm_2d_batch(~seg, [(50, 75)], 90, edge='down')
+    array([[45, 30, 46, 31]])
+    """
+    seg_binary = np.asarray(seg_binary).astype(bool)
+    height, width = seg_binary.shape
+    positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+    angles = np.deg2rad(np.arange(0, 360, angle_step))
+    grads = np.array([np.sin(angles), np.cos(angles)]).T
+    grads /= np.abs(grads).max(axis=1)[:, np.newaxis]
+    ray_dist = - np.ones((len(positions), len(angles)), dtype=int)
+
+    # in case the position is inside the border lable
+    idx = positions.astype(int)
+    labels_position = seg_binary[idx[:, 0], idx[:, 1]]
+    if edge == 'up':
+        ray_dist[labels_position] = 0
+    rect_diag = int(np.sqrt(height ** 2 + width ** 2))
+
+    # all rays which are still traced
+    ray_pos, ray_ang = [i.ravel() for i in np.meshgrid(
+        range(len(positions)), range(len(angles)), indexing='ij')]
+    if edge == 'up':
+        ray_pos, ray_ang = ray_pos[~labels_position[ray_pos]], \
+                           ray_ang[~labels_position[ray_pos]]
+    current = positions[ray_pos]
+    last = labels_position[ray_pos]
+    nb_done, nb_steps = 0, 8
+    while len(ray_pos) > 0 and nb_done < rect_diag:
+        # most of rays stop early, so the block of steps is growing
+        nb_steps = int(np.clip(min(2 * nb_steps,
+                                   RAY_CAST_BATCH_SIZE // len(ray_pos)),
+                               1, rect_diag - nb_done))
+        steps = np.repeat(grads[ray_ang][:, np.newaxis, :], nb_steps, axis=1)
+        # cumulative sum gives the same rounding as stepping one by one
+        trace = np.cumsum(np.concatenate([current[:, np.newaxis, :], steps],
+                                         axis=1), axis=1)[:, 1:, :]
+        inside = (trace[..., 0] >= 0) & (trace[..., 0] < height) \
+                 & (trace[..., 1] >= 0) & (trace[..., 1] < width)
+        idx = trace.astype(int)
+        actual = seg_binary[np.clip(idx[..., 0], 0, height - 1),
+                            np.clip(idx[..., 1], 0, width - 1)]
+        if edge == 'up':
+            hit = inside & actual
+        else:
+            previous = np.hstack([last[:, np.newaxis], actual[:, :-1]])
+            hit = inside & previous & ~actual
+        stop = hit | ~inside
+        stopped = np.any(stop, axis=1)
+        first = np.argmax(stop, axis=1)
+        found = stopped & hit[np.arange(len(first)), first]
+        pts = trace[found, first[found]]
+        ray_dist[ray_pos[found], ray_ang[found]] = np.sqrt(
+            np.sum((pts - positions[ray_pos[found]]) ** 2, axis=1))
+
+        current, last = trace[~stopped, -1], actual[~stopped, -1]
+        ray_pos, ray_ang = ray_pos[~stopped], ray_ang[~stopped]
+        nb_done += nb_steps
+    return ray_dist
+
+
 def compute_ray_features_segm_2d(seg_binary, position, angle_step=5.,
                                  smooth_coef=0, edge='up'):
     """ compute ray features vector , shift them to be startig from larges
@@ -1435,36 +2264,8 @@ def compute_ray_features_segm_2d(seg_binary, position, angle_step=5.,
     >>> compute_ray_features_segm_2d(seg, (40, 60), 20).tolist()
     [54, 57, 58, 56, 50, 43, 36, 31, 26, 24, 22, 22, 23, 25, 29, 34, 40, 47]
     """
-    seg_binary = seg_binary.astype(bool)
-    # nb_steps = 360 / angle_step
-    angles = np.arange(0, 360, angle_step)
-    ray_dist = np.array([-1] * len(angles))
-
-    # in case the position is inside the border lable
-    label_position = seg_binary[int(position[0]), int(position[1])]
-    if bool(label_position) and edge == 'up':
-        return ray_dist * 0
-    rect_diag = int(np.sqrt(seg_binary.shape[0] ** 2 +
-                            seg_binary.shape[1] ** 2))
-
-    for i, ang in enumerate(angles):
-        pos = np.array(position, dtype=float)
-        rad = np.deg2rad(ang)
-        grad = np.array([np.sin(rad), np.cos(rad)])
-        grad /= np.abs(grad).max()
-        last = seg_binary[int(position[0]), int(position[1])]
-        for _ in range(rect_diag):
-            pos += grad
-            if pos[0] < 0 or pos[0] >= seg_binary.shape[0] \
-                    or pos[1] < 0 or pos[1] >= seg_binary.shape[1]:
-                break
-            actual = seg_binary[int(pos[0]), int(pos[1])]
-            if (edge == 'up' and actual) \
-                    or (edge == 'down' and last and not actual):
-                ray_dist[i] = np.sqrt((pos[0] - position[0]) ** 2
-                                      + (pos[1] - position[1]) ** 2)
-                break
-            last = actual
+    ray_dist = compute_ray_features_segm_2d_batch(seg_binary, [position],
+                                                  angle_step, edge)[0]
 
     if smooth_coef is not None and smooth_coef > 0:
         ray_dist = gaussian_filter1d(ray_dist, smooth_coef)
@@ -1563,10 +2364,11 @@ def compute_ray_features_positions(segm, list_positions, angle_step=5.,
         seg_binary = morphology.opening(seg_binary, morphology.disk(segm_open))
 
     pos_rays, pos_shift = list(), list()
-    for pos in list_positions:
-        # logging.debug('position %s', repr(pos))
-        ray_dist = compute_ray_features_segm_2d(seg_binary, pos, angle_step,
-                                                smooth_ray, edge)
+    rays_dist = compute_ray_features_segm_2d_batch(seg_binary, list_positions,
+                                                   angle_step, edge)
+    for ray_dist in rays_dist:
+        if smooth_ray is not None and smooth_ray > 0:
+            ray_dist = gaussian_filter1d(ray_dist, smooth_ray)
         if shifting:
             ray_dist, shift = shift_ray_features(ray_dist)
         else:
@@ -1698,18 +2500,29 @@ def reduce_close_points(points, dist_thr):
            [0, 2]])
     >>> reduce_close_points(np.ones((10, 2)), 2)
     array([[ 1.,  1.]])
+    >>> np.random.seed(0)
+    >>> points = np.random.random((500, 2)) * 100
+    >>> len(reduce_close_points(points, 5))
+    150
     """
     assert len(points) > 2
-
-    dist = spatial.distance.cdist(points, points, metric='euclidean')
-    for i in range(len(points)):
-        dist[i, i] = np.Inf
-
-    while np.min(dist) < dist_thr and len(points) > 0:
-        coord = np.unravel_index(dist.argmin(), dist.shape)
-        max_coord = max(coord)
-        points = np.delete(points, max_coord, axis=0)
-        dist = np.delete(dist, max_coord, axis=0)
-        dist = np.delete(dist, max_coord, axis=1)
+    points = np.asarray(points)
+
+    # removing a point does not change distances among the others so merging
+    # the closest pairs first is the same as repeated search in full matrix
+    tree = spatial.cKDTree(points)
+    pairs = tree.query_pairs(dist_thr, output_type='ndarray')
+    dists = np.sqrt(np.sum((points[pairs[:, 0]] - points[pairs[:, 1]]) ** 2,
+                           axis=1))
+    pairs, dists = pairs[dists < dist_thr], dists[dists < dist_thr]
+    pairs = np.sort(pairs, axis=1)
+    # the ties are resolved by pair indexes as by the argmin over matrix
+    order = np.lexsort((pairs[:, 1], pairs[:, 0], dists))
+
+    mask_keep = np.ones(len(points), dtype=bool)
+    for i, j in pairs[order]:
+        if mask_keep[i] and mask_keep[j]:
+            mask_keep[j] = False
+    points = points[mask_keep]
 
     return points
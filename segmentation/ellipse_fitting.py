@@ -364,15 +364,15 @@ def prepare_boundary_points_ray_join(seg, centers, close_points=5,
     """
     seg_bg, seg_fg = split_segm_background_foreground(seg, sel_bg, sel_fg)
 
+    rays_bg = seg_fts.compute_ray_features_segm_2d_batch(seg_bg, centers)
+    rays_fc = seg_fts.compute_ray_features_segm_2d_batch(seg_fg, centers,
+                                                         edge='down')
     points_centers = []
-    for center in centers:
-        ray_bg = seg_fts.compute_ray_features_segm_2d(seg_bg, center)
+    for center, ray_bg, ray_fc in zip(centers, rays_bg, rays_fc):
         ray_bg[ray_bg < min_diam] = min_diam
         points_bg = seg_fts.reconstruct_ray_features_2d(center, ray_bg)
         points_bg = seg_fts.reduce_close_points(points_bg, close_points)
 
-        ray_fc = seg_fts.compute_ray_features_segm_2d(seg_fg, center,
-                                                      edge='down')
         ray_fc[ray_fc < min_diam] = min_diam
         points_fc = seg_fts.reconstruct_ray_features_2d(center, ray_fc)
         points_fc = seg_fts.reduce_close_points(points_fc, close_points)
@@ -455,13 +455,11 @@ def prepare_boundary_points_ray_edge(seg, centers, close_points=5,
     """
     seg_bg, seg_fc = split_segm_background_foreground(seg, sel_bg, sel_fg)
 
+    rays_bg = seg_fts.compute_ray_features_segm_2d_batch(seg_bg, centers)
+    rays_fc = seg_fts.compute_ray_features_segm_2d_batch(seg_fc, centers,
+                                                         edge='down')
     points_centers = []
-    for center in centers:
-        ray_bg = seg_fts.compute_ray_features_segm_2d(seg_bg, center)
-
-        ray_fc = seg_fts.compute_ray_features_segm_2d(seg_fc, center,
-                                                      edge='down')
-
+    for center, ray_bg, ray_fc in zip(centers, rays_bg, rays_fc):
         # replace not found (-1) by large values
         rays = np.array([ray_bg, ray_fc], dtype=float)
         rays[rays < 0] = np.inf
@@ -501,13 +499,11 @@ def prepare_boundary_points_ray_mean(seg, centers, close_points=5,
     """
     seg_bg, seg_fc = split_segm_background_foreground(seg, sel_bg, sel_fg)
 
+    rays_bg = seg_fts.compute_ray_features_segm_2d_batch(seg_bg, centers)
+    rays_fc = seg_fts.compute_ray_features_segm_2d_batch(seg_fc, centers,
+                                                         edge='down')
     points_centers = []
-    for center in centers:
-        ray_bg = seg_fts.compute_ray_features_segm_2d(seg_bg, center)
-
-        ray_fc = seg_fts.compute_ray_features_segm_2d(seg_fc, center,
-                                                      edge='down')
-
+    for center, ray_bg, ray_fc in zip(centers, rays_bg, rays_fc):
         # replace not found (-1) by large values
         rays = np.array([ray_bg, ray_fc], dtype=float)
         rays[rays < 0] = np.inf
@@ -554,8 +550,8 @@ def prepare_boundary_points_ray_dist(seg, centers, close_points=1,
     seg_bg, _ = split_segm_background_foreground(seg, sel_bg, sel_fg)
 
     points = np.array((0, np.asarray(centers).shape[1]))
-    for center in centers:
-        ray = seg_fts.compute_ray_features_segm_2d(seg_bg, center)
+    rays = seg_fts.compute_ray_features_segm_2d_batch(seg_bg, centers)
+    for center, ray in zip(centers, rays):
         points_bg = seg_fts.reconstruct_ray_features_2d(center, ray, 0)
         points_bg = seg_fts.reduce_close_points(points_bg, close_points)
 
@@ -572,13 +568,14 @@ def prepare_boundary_points_ray_dist(seg, centers, close_points=1,
 
 
 def filter_boundary_points(segm, slic):
-    slic_centers = np.array(seg_spx.superpixel_centers(slic)).astype(int)
+    graph = seg_spx.get_superpixel_graph(slic)
+    slic_centers = np.array(graph.centers).astype(int)
     labels = segm[slic_centers[:, 0], slic_centers[:, 1]]
 
-    vertices, edges = seg_spx.make_graph_segm_connect2d_conn4(slic)
+    edges = graph.edges
     nb_labels = labels.max() + 1
 
-    neighbour_labels = np.zeros((len(vertices), nb_labels))
+    neighbour_labels = np.zeros((graph.nb_segments, nb_labels))
     for e1, e2 in edges:
         # print e1, labels[e2], e2, labels[e1]
         neighbour_labels[e1, labels[e2]] += 1
@@ -4,7 +4,7 @@ Copyright (C) 2014-2016 Jiri Borovec <jiri.borovec@fel.cvut.cz>
 """
 
 cimport cython
-from cython.parallel import prange
+from cython.parallel import prange, threadid
 import numpy as np
 cimport numpy as np
 
@@ -68,7 +68,6 @@ def normColorFeatures(int[:, :] seg,
         for y in range(h):
             count[seg[x,y]] += 1
     # features = features / count
-    # for z in prange(3, nogil=True):
     for z in range(3):
         for i in range(nb_segments):
             if count[i] > 0:
@@ -76,130 +75,334 @@ def normColorFeatures(int[:, :] seg,
     return features
 
 
+def reduceThreadFeatures(partial, counts):
+    """ sum the per-thread accumulators and normalise them by label counts
+
+    :param partial: np.array<nb_jobs, nb_segments, ...> partial sums
+    :param counts: np.array<nb_jobs, nb_segments> partial label counts
+    :return: np.array<nb_segments, ...>
+    """
+    features = np.sum(partial, axis=0)
+    count = np.sum(counts, axis=0)
+    filled = count > 0
+    shape = (-1,) + (1,) * (features.ndim - 1)
+    features[filled] = features[filled] / count[filled].reshape(shape)
+    return features
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
 def computeColorImage2dMean(float[:, :, :] img,
-                            int[:, :] seg):
+                            int[:, :] seg,
+                            int nb_jobs=1):
     cdef:
         int nb_segments = np.max(seg) + 1
-        double[:, :] features = np.zeros([nb_segments, 3], dtype=np.float64)
+        int nb_threads = max(1, nb_jobs)
+        double[:, :, :] features = np.zeros([nb_threads, nb_segments, 3],
+                                            dtype=np.float64)
+        int[:, :] count = np.zeros([nb_threads, nb_segments], dtype=np.int32)
         int w = seg.shape[0]
         int h = seg.shape[1]
-        int z, x, y, i, id
-    # for z in prange(3, nogil=True):
-    for z in range(3):
-        for x in range(w):
-            for y in range(h):
-                features[seg[x,y], z] += img[x, y, z]
-    # features = features / count
-    features = normColorFeatures(seg, features)
-    return features
+        int z, x, y, t, id
+    for x in prange(w, nogil=True, num_threads=nb_threads, schedule='static'):
+        t = threadid()
+        for y in range(h):
+            id = seg[x, y]
+            count[t, id] += 1
+            for z in range(3):
+                features[t, id, z] += img[x, y, z]
+    return reduceThreadFeatures(np.asarray(features), np.asarray(count))
 
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
 def computeColorImage2dEnergy(float[:, :, :] img,
-                              int[:, :] seg):
+                              int[:, :] seg,
+                              int nb_jobs=1):
     cdef:
         int nb_segments = np.max(seg) + 1
-        double[:, :] features = np.zeros([nb_segments, 3], dtype=np.float64)
+        int nb_threads = max(1, nb_jobs)
+        double[:, :, :] features = np.zeros([nb_threads, nb_segments, 3],
+                                            dtype=np.float64)
+        int[:, :] count = np.zeros([nb_threads, nb_segments], dtype=np.int32)
         float val
         int w = seg.shape[0]
         int h = seg.shape[1]
-        int z, x, y, i, id
-    for z in prange(3, nogil=True):
-        for x in range(w):
-            for y in range(h):
+        int z, x, y, t, id
+    for x in prange(w, nogil=True, num_threads=nb_threads, schedule='static'):
+        t = threadid()
+        for y in range(h):
+            id = seg[x, y]
+            count[t, id] += 1
+            for z in range(3):
                 val = img[x, y, z]
-                features[seg[x,y], z] += val * val
-    # features = features / count
-    features = normColorFeatures(seg, features)
-    return features
+                features[t, id, z] += val * val
+    return reduceThreadFeatures(np.asarray(features), np.asarray(count))
 
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
 def computeColorImage2dVariance(float[:, :, :] img,
                                 int[:, :] seg,
-                                float[:, :] mean):
+                                float[:, :] mean,
+                                int nb_jobs=1):
     cdef:
         int nb_segments = np.max(seg) + 1
-        double[:, :] features = np.zeros([nb_segments, 3], dtype=np.float64)
+        int nb_threads = max(1, nb_jobs)
+        double[:, :, :] features = np.zeros([nb_threads, nb_segments, 3],
+                                            dtype=np.float64)
+        int[:, :] count = np.zeros([nb_threads, nb_segments], dtype=np.int32)
         int w = seg.shape[0]
         int h = seg.shape[1]
-        int z, x, y, i, id
+        int z, x, y, t, id
         float v
-    for z in prange(3, nogil=True):
-        for x in range(w):
-            for y in range(h):
-                v = img[x, y, z] - mean[seg[x,y], z]
-                features[seg[x,y], z] += v * v
-    # features = features / count
-    features = normColorFeatures(seg, features)
-    return features
+    for x in prange(w, nogil=True, num_threads=nb_threads, schedule='static'):
+        t = threadid()
+        for y in range(h):
+            id = seg[x, y]
+            count[t, id] += 1
+            for z in range(3):
+                v = img[x, y, z] - mean[id, z]
+                features[t, id, z] += v * v
+    return reduceThreadFeatures(np.asarray(features), np.asarray(count))
 
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
 def computeGrayImage3dMean(float[:, :, :] img,
-                           int[:, :, :] seg):
+                           int[:, :, :] seg,
+                           int nb_jobs=1):
     cdef:
         int nb_segments = np.max(seg) + 1
-        double[:] features = np.zeros(nb_segments, dtype=np.float64)
-        int[:] count = np.zeros(nb_segments, dtype=np.int32)
+        int nb_threads = max(1, nb_jobs)
+        double[:, :] features = np.zeros([nb_threads, nb_segments],
+                                         dtype=np.float64)
+        int[:, :] count = np.zeros([nb_threads, nb_segments], dtype=np.int32)
         int d = seg.shape[0]
         int w = seg.shape[1]
         int h = seg.shape[2]
-        int z, x, y, i, id
-    for z in prange(d, nogil=True):
-        for x in range(w):
-            for y in range(h):
-                id = seg[z, x, y]
-                count[id] += 1
-                features[id] += img[z, x, y]
-    for i in prange(nb_segments, nogil=True):
-        if count[i] > 0:
-            features[i] = features[i] / count[i]
-    # features = features / count
-    return features
+        int k, z, x, y, t, id
+    # iterate over all rows in the volume so also thin stacks are split well
+    for k in prange(d * w, nogil=True, num_threads=nb_threads,
+                    schedule='static'):
+        t = threadid()
+        z = k // w
+        x = k % w
+        for y in range(h):
+            id = seg[z, x, y]
+            count[t, id] += 1
+            features[t, id] += img[z, x, y]
+    return reduceThreadFeatures(np.asarray(features), np.asarray(count))
 
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
 def computeGrayImage3dEnergy(float[:, :, :] img,
-                             int[:, :, :] seg):
+                             int[:, :, :] seg,
+                             int nb_jobs=1):
     cdef:
-        int nb_segments = np.max(seg) +1
-        double[:] features = np.zeros(nb_segments, dtype=np.float64)
-        int[:] count = np.zeros(nb_segments, dtype=np.int32)
+        int nb_segments = np.max(seg) + 1
+        int nb_threads = max(1, nb_jobs)
+        double[:, :] features = np.zeros([nb_threads, nb_segments],
+                                         dtype=np.float64)
+        int[:, :] count = np.zeros([nb_threads, nb_segments], dtype=np.int32)
         int d = seg.shape[0]
         int w = seg.shape[1]
         int h = seg.shape[2]
-        int z, x, y, i, id
-    for z in prange(d, nogil=True):
-        for x in range(w):
-            for y in range(h):
-                id = seg[z, x, y]
-                count[id] += 1
-                features[id] += img[z, x, y] * img[z, x, y]
-    for i in prange(nb_segments, nogil=True):
-        if count[i] > 0:
-            features[i] = features[i] / count[i]
-    # features = features / count
-    return features
+        int k, z, x, y, t, id
+    for k in prange(d * w, nogil=True, num_threads=nb_threads,
+                    schedule='static'):
+        t = threadid()
+        z = k // w
+        x = k % w
+        for y in range(h):
+            id = seg[z, x, y]
+            count[t, id] += 1
+            features[t, id] += img[z, x, y] * img[z, x, y]
+    return reduceThreadFeatures(np.asarray(features), np.asarray(count))
 
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
 def computeGrayImage3dVariance(float[:, :, :] img,
                                int[:, :, :] seg,
-                               float[:] mean):
+                               float[:] mean,
+                               int nb_jobs=1):
     cdef:
-        int nb_segments = np.max(seg) +1
-        double[:] features = np.zeros(nb_segments, dtype=np.float64)
-        int[:] count = np.zeros(nb_segments, dtype=np.int32)
+        int nb_segments = np.max(seg) + 1
+        int nb_threads = max(1, nb_jobs)
+        double[:, :] features = np.zeros([nb_threads, nb_segments],
+                                         dtype=np.float64)
+        int[:, :] count = np.zeros([nb_threads, nb_segments], dtype=np.int32)
         int d = seg.shape[0]
         int w = seg.shape[1]
         int h = seg.shape[2]
-        int z, x, y, i, id
+        int k, z, x, y, t, id
         float v
-    for z in prange(d, nogil=True):
-        for x in range(w):
-            for y in range(h):
-                id = seg[z,x,y]
-                count[id] += 1
-                v = img[z, x, y] - mean[id]
-                features[id] += v * v
-    for i in prange(nb_segments, nogil=True):
-        if count[i] > 0:
-            features[i] = features[i] / count[i]
-    # features = features / count
-    return features
+    for k in prange(d * w, nogil=True, num_threads=nb_threads,
+                    schedule='static'):
+        t = threadid()
+        z = k // w
+        x = k % w
+        for y in range(h):
+            id = seg[z, x, y]
+            count[t, id] += 1
+            v = img[z, x, y] - mean[id]
+            features[t, id] += v * v
+    return reduceThreadFeatures(np.asarray(features), np.asarray(count))
+
+
+cdef double estimateRankValue(int[:] hist, float[:] hist_min, float[:] hist_max,
+                              int rank) nogil:
+    """ estimate value of given rank from histogram, inside the bin the value
+    is interpolated between the smallest and largest value falling to the bin
+    """
+    cdef:
+        int b, cum = 0
+        double pos
+    for b in range(hist.shape[0]):
+        if cum + hist[b] > rank:
+            if hist[b] > 1:
+                pos = (rank - cum) / <double> (hist[b] - 1)
+            else:
+                pos = 0.
+            return hist_min[b] + pos * (hist_max[b] - hist_min[b])
+        cum += hist[b]
+    return 0.
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def computeLabelStatistics(float[:, :] values,
+                           int[:] seg,
+                           float[:] val_min,
+                           float[:] val_max,
+                           int nb_bins=64,
+                           int nb_jobs=1):
+    """ compute all statistics in single pass over the image accumulating
+    count, sum, sum of squares, min/max and histogram for each label and channel,
+    the variance is accumulated in second pass as squared deviations from
+    the label mean which is numerically stable also for large offsets
+
+    :param values: image values flattened to np.array<nb_pixels, nb_channels>
+    :param seg: segmentation flattened to np.array<nb_pixels>
+    :param val_min: minimal value for each channel (histogram range)
+    :param val_max: maximal value for each channel (histogram range)
+    :param nb_bins: number of histogram bins for estimating median,
+        zero skips the histograms and the medians are returned as zeros
+    :param nb_jobs: number of threads, each thread accumulates a range
+        of pixels to its own accumulators which are reduced afterwards
+    :return: counts, means, variances, energies, minimums, maximums, medians
+        where all except counts are np.array<nb_segments, nb_channels>
+    """
+    cdef:
+        int nb_segments = np.max(seg) + 1
+        Py_ssize_t nb_pixels = values.shape[0]
+        int nb_channels = values.shape[1]
+        int nb_threads = max(1, nb_jobs)
+        int nb_hist = max(1, nb_bins)
+        int[:, :] t_count = np.zeros([nb_threads, nb_segments], dtype=np.int32)
+        double[:, :, :] t_sums = np.zeros([nb_threads, nb_segments, nb_channels],
+                                          dtype=np.float64)
+        double[:, :, :] t_sums_2 = np.zeros([nb_threads, nb_segments,
+                                             nb_channels], dtype=np.float64)
+        double[:, :, :] t_mins = np.zeros([nb_threads, nb_segments, nb_channels],
+                                          dtype=np.float64)
+        double[:, :, :] t_maxs = np.zeros([nb_threads, nb_segments, nb_channels],
+                                          dtype=np.float64)
+        int[:, :, :, :] t_hist = np.zeros([nb_threads, nb_segments, nb_channels,
+                                           nb_hist], dtype=np.int32)
+        float[:, :, :, :] t_hist_min = np.zeros([nb_threads, nb_segments,
+                                                 nb_channels, nb_hist],
+                                                dtype=np.float32)
+        float[:, :, :, :] t_hist_max = np.zeros([nb_threads, nb_segments,
+                                                 nb_channels, nb_hist],
+                                                dtype=np.float32)
+        double[:] scale = np.zeros(nb_channels, dtype=np.float64)
+        Py_ssize_t i
+        int z, lb, b, t
+        float v
+        double dev
+    for z in range(nb_channels):
+        if val_max[z] > val_min[z]:
+            scale[z] = nb_bins / (val_max[z] - val_min[z])
+
+    for i in prange(nb_pixels, nogil=True, num_threads=nb_threads,
+                    schedule='static'):
+        t = threadid()
+        lb = seg[i]
+        t_count[t, lb] += 1
+        for z in range(nb_channels):
+            v = values[i, z]
+            t_sums[t, lb, z] += v
+            t_sums_2[t, lb, z] += <double> v * v
+            if t_count[t, lb] == 1 or v < t_mins[t, lb, z]:
+                t_mins[t, lb, z] = v
+            if t_count[t, lb] == 1 or v > t_maxs[t, lb, z]:
+                t_maxs[t, lb, z] = v
+            if nb_bins <= 0:
+                continue
+            b = <int> ((v - val_min[z]) * scale[z])
+            if b >= nb_bins:
+                b = nb_bins - 1
+            elif b < 0:
+                b = 0
+            if t_hist[t, lb, z, b] == 0 or v < t_hist_min[t, lb, z, b]:
+                t_hist_min[t, lb, z, b] = v
+            if t_hist[t, lb, z, b] == 0 or v > t_hist_max[t, lb, z, b]:
+                t_hist_max[t, lb, z, b] = v
+            t_hist[t, lb, z, b] += 1
+
+    # reduce the per-thread accumulators, skipping the empty ones
+    counts_t = np.asarray(t_count)
+    filled = (counts_t > 0)[:, :, np.newaxis]
+    hist_t = np.asarray(t_hist)
+    cdef:
+        int[:] count = counts_t.sum(axis=0).astype(np.int32)
+        double[:, :] sums = np.asarray(t_sums).sum(axis=0)
+        double[:, :] sums_2 = np.asarray(t_sums_2).sum(axis=0)
+        double[:, :] mins = np.where(filled, t_mins, np.inf).min(axis=0)
+        double[:, :] maxs = np.where(filled, t_maxs, -np.inf).max(axis=0)
+        double[:, :] medians = np.zeros([nb_segments, nb_channels],
+                                        dtype=np.float64)
+        int[:, :, :] hist = hist_t.sum(axis=0).astype(np.int32)
+        float[:, :, :] hist_min = np.where(hist_t > 0, t_hist_min, np.inf) \
+            .min(axis=0).astype(np.float32)
+        float[:, :, :] hist_max = np.where(hist_t > 0, t_hist_max, -np.inf) \
+            .max(axis=0).astype(np.float32)
+    del hist_t
+    counts = np.asarray(count)
+    np.asarray(mins)[counts == 0] = 0
+    np.asarray(maxs)[counts == 0] = 0
+    norm = np.clip(counts, 1, None)[:, np.newaxis].astype(np.float64)
+    means = np.asarray(sums) / norm
+    energies = np.asarray(sums_2) / norm
+
+    # second pass, squared deviations from the mean reusing thread sums
+    cdef:
+        double[:, :] means_view = means
+        double[:, :, :] t_devs_2 = t_sums
+    np.asarray(t_devs_2)[:] = 0
+    for i in prange(nb_pixels, nogil=True, num_threads=nb_threads,
+                    schedule='static'):
+        t = threadid()
+        lb = seg[i]
+        for z in range(nb_channels):
+            dev = values[i, z] - means_view[lb, z]
+            t_devs_2[t, lb, z] += dev * dev
+    variances = np.asarray(t_devs_2).sum(axis=0) / norm
+
+    if nb_bins > 0:
+        for lb in prange(nb_segments, nogil=True, num_threads=nb_threads,
+                         schedule='static'):
+            if count[lb] > 0:
+                for z in range(nb_channels):
+                    medians[lb, z] = (
+                        estimateRankValue(hist[lb, z], hist_min[lb, z],
+                                          hist_max[lb, z], (count[lb] - 1) // 2)
+                        + estimateRankValue(hist[lb, z], hist_min[lb, z],
+                                            hist_max[lb, z], count[lb] // 2)
+                    ) / 2.
+
+    return counts, means, variances, energies, np.asarray(mins), \
+           np.asarray(maxs), np.asarray(medians)
@@ -16,6 +16,8 @@ import segmentation.descriptors as seg_fts
 
 DEFAULT_GC_ITERATIONS = 25
 COEF_INT_CONVERSION = 1e6
+# edge types whose weights are normalised by spatial distance of superpixels
+EDGE_TYPES_SPATIAL_NORM = ('model', 'features', 'color', 'spatial')
 DEBUG_NB_SHOW_SAMPLES = 15
 
 
@@ -156,25 +158,38 @@ def estim_class_model_kmeans(features, nb_classes, init_type='k-means++'):
     return gmm
 
 
-def get_vertexes_edges(segments):
+def get_vertexes_edges(segments, return_lengths=False,
+                       return_adjacency=False):
     """ wrapper - get list of vertexes edges for 2D / 3D images
 
-    :param ndarray segments:
-    :return:
+    :param segments: ndarray or SuperpixelGraph
+    :param bool return_lengths: return also shared boundary length per edge
+    :param bool return_adjacency: return also CSR adjacency matrix
+    :return ndarray, ndarray: vertices, np.array<nb_edges, 2>
+
+    >>> segments = np.array([[0] * 3 + [1] * 5, [2] * 4 + [3] * 4])
+    >>> _, edges, lengths = get_vertexes_edges(segments, return_lengths=True)
+    >>> edges.tolist(), lengths.tolist()
+    ([[0, 1], [0, 2], [1, 2], [1, 3], [2, 3]], [1, 3, 1, 4, 1])
+    >>> graph = seg_spx.SuperpixelGraph(segments)
+    >>> get_vertexes_edges(graph)[1] is graph.edges
+    True
     """
-    if segments.ndim == 3:
-        vertices, edges = seg_spx.make_graph_segm_connect3d_conn6(segments)
-    elif segments.ndim == 2:
-        vertices, edges = seg_spx.make_graph_segm_connect2d_conn4(segments)
-    else:
+    if seg_spx.get_segments(segments).ndim not in (2, 3):
         return None, None
-    return vertices, edges
+    graph = seg_spx.get_superpixel_graph(segments)
+    outputs = [np.flatnonzero(graph.sizes), graph.edges]
+    if return_lengths:
+        outputs.append(graph.boundary_lengths)
+    if return_adjacency:
+        outputs.append(graph.adjacency)
+    return tuple(outputs)
 
 
 def compute_spatial_dist(centres, edges, relative=False):
     """ compute spatial distance between all neighbouring segments
 
-    :param [[int, int]] centres: superpixel centres
+    :param ndarray centres: superpixel centres np.array<nb_segments, ndim>
     :param [[int, int]] edges:
     :param bool relative: normalise the distances to mean distance
     :return:
@@ -191,12 +206,8 @@ def compute_spatial_dist(centres, edges, relative=False):
     assert np.max(edges) < len(centres), \
         'max vertex %i exceed size of centres %i'\
         % (np.max(edges), len(centres))
-    ndim = np.max([len(c) for c in centres if c is not None])
-    # replace empy segments by a empty vector
-    for i, c in enumerate(centres):
-        if c is None or len(c) == 0:
-            centres[i] = [np.NaN] * ndim
-    centres = np.nan_to_num(centres)
+    # the empty segments have NaN centre
+    centres = np.nan_to_num(np.asarray(centres, dtype=float))
 
     vertex_1 = centres[np.asarray(edges)[:, 0]]
     vertex_2 = centres[np.asarray(edges)[:, 1]]
@@ -417,13 +428,15 @@ def insert_gc_debug_images(dict_debug_imgs, segments, graph_labels, unary_cost,
     """ wrapper for placing intermediate variable to a dictionary """
     if dict_debug_imgs is None:
         return
+    graph = seg_spx.get_superpixel_graph(segments)
+    segments = graph.segments
     dict_debug_imgs['segments'] = segments
     dict_debug_imgs['edges'] = edges
     dict_debug_imgs['edge_weights'] = edge_weights
     dict_debug_imgs['imgs_unary_cost'] = \
         tl_visu.draw_graphcut_unary_cost_segments(segments, unary_cost)
     img = dict_debug_imgs.get('slic_mean', None)
-    list_centres = seg_spx.superpixel_centers(segments)
+    list_centres = graph.centers
     dict_debug_imgs['img_graph_edges'] = \
         tl_visu.draw_graphcut_weighted_edges(segments, list_centres, edges,
                                              edge_weights, img_bg=img)
@@ -437,7 +450,7 @@ def compute_edge_weights(segments, image=None, features=None, proba=None,
     pp 32, http://www.coe.utah.edu/~cs7640/readings/graph_cuts_intro.pdf
     exp(- norm value diff) * (geom dist vertex)**-1
 
-    :param ndarry segments: superpixels
+    :param segments: superpixels as ndarray or SuperpixelGraph
     :param ndarry image: input image
     :param ndarry features: features for each segment (superpixel)
     :param ndarry proba: probability of each superpixel and class
@@ -474,11 +487,28 @@ def compute_edge_weights(segments, image=None, features=None, proba=None,
     [0.0, 0.028, 1.122, 0.038, 0.117, 0.688, 0.487, 1.152, 0.282]
     """
     logging.debug('extraction segment connectivity...')
-    _, edges = get_vertexes_edges(segments)
-    # convert variables
-    edges = np.array(edges, dtype=np.int32)
-    logging.debug('graph edges %s', repr(edges.shape))
+    graph = seg_spx.get_superpixel_graph(segments)
+    logging.debug('graph edges %s', repr(graph.edges.shape))
+    edge_weights = _compute_edge_weights_raw(graph, image, features, proba,
+                                             edge_type)
+    if edge_type in EDGE_TYPES_SPATIAL_NORM:
+        spatial = compute_spatial_dist(graph.centers, graph.edges,
+                                       relative=True)
+        edge_weights /= spatial
+    return graph.edges, edge_weights
 
+
+def _compute_edge_weights_raw(graph, image, features, proba, edge_type):
+    """ compute edge weights without normalisation by spatial distance
+
+    :param SuperpixelGraph graph:
+    :param ndarry image: input image
+    :param ndarry features: features for each segment (superpixel)
+    :param ndarry proba: probability of each superpixel and class
+    :param str edge_type: edge type, see `compute_edge_weights`
+    :return ndarray: weights np.array<nb_edges>
+    """
+    segments, edges = graph.segments, graph.edges
     if edge_type.startswith('model'):
         assert proba is not None
         metric = edge_type.split('_')[-1] if '_' in edge_type else 'lT'
@@ -507,12 +537,135 @@ def compute_edge_weights(segments, image=None, features=None, proba=None,
     else:
         edge_weights = np.ones(len(edges))
 
-    edge_weights = np.array(edge_weights, dtype=float)
-    if edge_type in ['model', 'features', 'color', 'spatial']:
-        centres = seg_spx.superpixel_centers(segments)
-        spatial = compute_spatial_dist(centres, edges, relative=True)
-        edge_weights /= spatial
-    return edges, edge_weights
+    return np.array(edge_weights, dtype=float)
+
+
+class GraphCutProblem(object):
+    """
+    GraphCut on superpixels prepared once per image, the graph edges,
+    spatial distances, edge weights for each edge type and unary costs
+    are computed lazily only once and reused for all solved settings,
+    e.g. while sweeping the regularisation.
+
+    Example
+    -------
+    >>> np.random.seed(0)
+    >>> segments = np.array([[0] * 3 + [1] * 3 + [2] * 3 + [3] * 3 + [4] * 3,
+    ...                      [5] * 3 + [6] * 3 + [7] * 3 + [8] * 3 + [9] * 3])
+    >>> proba = np.array([[0] * 6 + [1] * 4, [1] * 6 + [0] * 4], dtype=float).T
+    >>> proba += np.random.random(proba.shape) / 2.
+    >>> gc = GraphCutProblem(segments, proba)
+    >>> gc.solve(gc_regul=0., edge_type='')
+    array([1, 1, 1, 1, 1, 1, 0, 0, 0, 0], dtype=int32)
+    >>> list_labels = gc.solve_sweep([(0., '', 1.), (1., 'spatial', 1.),
+    ...                               (10., 'spatial', 1.)])
+    >>> np.array(list_labels)
+    array([[1, 1, 1, 1, 1, 1, 0, 0, 0, 0],
+           [1, 1, 0, 0, 0, 1, 1, 0, 0, 0],
+           [1, 1, 1, 1, 1, 1, 1, 1, 1, 1]], dtype=int32)
+    >>> sorted(gc._edge_weights.keys())
+    ['', 'spatial']
+    """
+    def __init__(self, segments, proba, image=None, features=None):
+        """
+
+        :param segments: superpixels as ndarray or SuperpixelGraph
+        :param ndarray proba: probabilities that each feature belongs
+            to each class
+        :param ndarry image: input image, required for 'color' edges
+        :param ndarry features: features for each superpixel,
+            required for 'features' edges
+        """
+        self.graph = seg_spx.get_superpixel_graph(segments)
+        self.proba = proba
+        self.image = image
+        self.features = features
+        self._unary_cost = None
+        self._spatial_dist = None
+        self._edge_weights = {}
+
+    @property
+    def edges(self):
+        """ edges between neighbouring superpixels
+
+        :return ndarray: np.array<nb_edges, 2>
+        """
+        return self.graph.edges
+
+    @property
+    def unary_cost(self):
+        """ unary cost, see `compute_unary_cost`
+
+        :return ndarray: np.array<nb_segments, nb_classes>
+        """
+        if self._unary_cost is None:
+            self._unary_cost = compute_unary_cost(self.proba)
+        return self._unary_cost
+
+    @property
+    def spatial_dist(self):
+        """ relative spatial distance between neighbouring superpixels
+
+        :return ndarray: np.array<nb_edges>
+        """
+        if self._spatial_dist is None:
+            self._spatial_dist = compute_spatial_dist(self.graph.centers,
+                                                      self.edges, relative=True)
+        return self._spatial_dist
+
+    def edge_weights(self, edge_type='model'):
+        """ edge weights for given edge type, see `compute_edge_weights`
+
+        :param str edge_type: edge type
+        :return ndarray: np.array<nb_edges>
+        """
+        if edge_type not in self._edge_weights:
+            weights = _compute_edge_weights_raw(self.graph, self.image,
+                                                self.features, self.proba,
+                                                edge_type)
+            if edge_type in EDGE_TYPES_SPATIAL_NORM:
+                weights /= self.spatial_dist
+            self._edge_weights[edge_type] = weights
+        return self._edge_weights[edge_type]
+
+    def solve(self, gc_regul=1., edge_type='model', edge_cost=1.,
+              init_labels=None):
+        """ run GraphCut with given setting
+
+        :param gc_regul: regularisation for GraphCut
+        :param str edge_type: edge type
+        :param float edge_cost: multiplier of edge weights
+        :param ndarray init_labels: initial labeling, by default the most
+            probable class for each superpixel
+        :return ndarray: labelling by resulting classes
+        """
+        edge_weights = self.edge_weights(edge_type) * edge_cost
+        pairwise_cost = compute_pairwise_cost(gc_regul, self.proba.shape)
+        logging.debug('graph pairwise coefs: \n%s', repr(pairwise_cost))
+        if init_labels is None:
+            init_labels = np.argmax(self.proba, axis=1)
+        logging.debug('perform GraphCut')
+        graph_labels = cut_general_graph(self.edges, edge_weights,
+                                         self.unary_cost, pairwise_cost,
+                                         algorithm='expansion',
+                                         init_labels=init_labels, n_iter=9999)
+        return graph_labels
+
+    def solve_sweep(self, list_settings):
+        """ run GraphCut for a list of settings, each solving is warm-started
+        from the labeling of the previous one so it is recommended to order
+        the settings by increasing regularisation
+
+        :param [(any, str, float)] list_settings: list of settings as
+            (gc_regul, edge_type, edge_cost)
+        :return [ndarray]: labeling for each setting
+        """
+        list_labels, labels = [], None
+        for gc_regul, edge_type, edge_cost in list_settings:
+            labels = self.solve(gc_regul, edge_type, edge_cost,
+                                init_labels=labels)
+            list_labels.append(labels)
+        return list_labels
 
 
 def segment_graph_cut_general(segments, proba, image=None, features=None,
@@ -521,7 +674,8 @@ def segment_graph_cut_general(segments, proba, image=None, features=None,
     """ segment the image segmented via superpixels and estimated features
 
     :param ndarray features: features sor each instance
-    :param ndarray segments: segmentation mapping each pixel into a class
+    :param segments: segmentation mapping each pixel into a class,
+        ndarray or SuperpixelGraph
     :param ndarray proba: probabilities that each feature belongs to each class
     :param gc_regul: regularisation for GrphCut
     :param {} dict_debug_imgs:
@@ -565,27 +719,12 @@ def segment_graph_cut_general(segments, proba, image=None, features=None,
      'imgs_unary_cost', 'segments']
     """
     logging.debug('convert variables and run GraphCut on created graph.')
+    gc_problem = GraphCutProblem(segments, proba, image, features)
+    graph_labels = gc_problem.solve(gc_regul, edge_type, edge_cost)
 
-    edges, edge_weights = compute_edge_weights(segments, image, features,
-                                               proba, edge_type)
-    edge_weights *= edge_cost
-    logging.debug('graph edges weights %s', repr(edge_weights.shape))
-
-    unary_cost = compute_unary_cost(proba)
-    logging.debug('graph unaries potentials: %s', repr(unary_cost.shape))
-    pairwise_cost = compute_pairwise_cost(gc_regul, proba.shape)
-    logging.debug('graph pairwise coefs: \n%s', repr(pairwise_cost))
-
-    labels = np.argmax(proba, axis=1)
-    # run GraphCut
-    logging.debug('perform GraphCut')
-    graph_labels = cut_general_graph(edges, edge_weights, unary_cost,
-                                     pairwise_cost, algorithm='expansion',
-                                     # down_weight_factor=np.abs(unary_cost).max()
-                                     init_labels=labels, n_iter=9999)
-
-    insert_gc_debug_images(dict_debug_imgs, segments, graph_labels,
-                           compute_unary_cost(proba), edges, edge_weights)
+    insert_gc_debug_images(dict_debug_imgs, gc_problem.graph, graph_labels,
+                           gc_problem.unary_cost, gc_problem.edges,
+                           gc_problem.edge_weights(edge_type) * edge_cost)
     return graph_labels
 
 
@@ -620,9 +759,9 @@ def count_label_transitions_connected_segments(dict_slics, dict_labels,
         nb_labels = np.max(uq_labels) + 1
     transitions = np.zeros((nb_labels, nb_labels))
     for name in dict_slics:
-        assert (np.max(dict_slics[name]) + 1) == len(dict_labels[name])
-        _, edges = get_vertexes_edges(dict_slics[name])
-        label_edges = np.asarray(dict_labels[name])[np.asarray(edges)]
+        graph = seg_spx.get_superpixel_graph(dict_slics[name])
+        assert graph.nb_segments == len(dict_labels[name])
+        label_edges = np.asarray(dict_labels[name])[graph.edges]
         for lb1, lb2 in label_edges.tolist():
             transitions[lb1, lb2] += 1
             transitions[lb2, lb1] += 1
@@ -9,7 +9,9 @@ import multiprocessing as mproc
 from functools import partial
 
 import numpy as np
+from scipy import ndimage
 import skimage.color as sk_color
+import skimage.filters as sk_filters
 from sklearn import preprocessing, mixture, decomposition
 
 import segmentation.graph_cuts as seg_gc
@@ -17,6 +19,8 @@ import segmentation.superpixels as seg_sp
 import segmentation.descriptors as seg_fts
 import segmentation.labeling as seg_lbs
 import segmentation.classification as seg_clf
+import segmentation.utils.cache as tl_cache
+import segmentation.utils.drawing as tl_visu
 
 CLASSIF_PARAMS = {'method': 'kNN', 'nb': 10}
 FTS_SET_SIMPLE = seg_fts.FEATURES_SET_COLOR
@@ -24,6 +28,16 @@ CLASSIF_NAME = seg_clf.DEFAULT_CLASSIF_NAME
 CLUSTER_METHOD = seg_clf.DEFAULT_CLUSTERING
 CROSS_VAL_LEAVE_OUT = 2
 NB_THREADS = max(1, int(mproc.cpu_count() * 0.6))
+# size of tiles in superpixels for refining class boundaries in full resolution
+PYRAMID_REFINE_TILE = 8
+# if the refining tiles cover larger fraction of image, run full resolution
+PYRAMID_MAX_REFINE = 0.6
+# downscaling factor for fast detection of foreground regions
+ROI_SCALE = 0.125
+# padding of foreground regions in pixels
+ROI_PADDING = 50
+# foreground regions smaller than this fraction of image are dropped
+ROI_MIN_SIZE = 0.001
 
 DICT_CONVERT_COLOR = {
     'hsv': sk_color.rgb2hsv,
@@ -55,7 +69,8 @@ def pipe_color2d_slic_features_gmm_graphcut(image, nb_classes=3,
                                             proba_type='GMM',
                                             gc_edge_type='model_lT',
                                             pca_coef=None,
-                                            dict_debug_imgs=None):
+                                            dict_debug_imgs=None,
+                                            smooth_fast=False):
     """ complete pipe-line for segmentation using superpixels, extracting features
     and graphCut segmentation
 
@@ -71,6 +86,8 @@ def pipe_color2d_slic_features_gmm_graphcut(image, nb_classes=3,
     :param str gc_edge_type:
     :param float pca_coef: range (0, 1) or None
     :param dict_debug_imgs: {str: ...}
+    :param bool smooth_fast: fast approximation of background subtraction
+        for texture features, see `seg_fts.gaussian_filter_fast`
     :return [[int]]: segmentation matrix maping each pixel into a class
 
     >>> np.random.seed(0)
@@ -83,7 +100,8 @@ def pipe_color2d_slic_features_gmm_graphcut(image, nb_classes=3,
     logging.info('PIPELINE Superpixels-Features-GMM-GraphCut')
     slic, features = compute_color2d_superpixels_features(image, clr_space,
                                                           sp_size, sp_regul,
-                                                          dict_features)
+                                                          dict_features,
+                                                          smooth_fast=smooth_fast)
 
     if dict_debug_imgs is not None:
         if image.ndim == 2:  # duplicate channels to be like RGB
@@ -116,7 +134,7 @@ def estim_model_classes_group(list_images, nb_classes=4, clr_space='rgb',
                               sp_size=30, sp_regul=0.2,
                               dict_features=FTS_SET_SIMPLE,
                               pca_coef=None, proba_type='GMM',
-                              nb_jobs=NB_THREADS):
+                              nb_jobs=NB_THREADS, smooth_fast=False):
     """ estimate a model from sequence of input images and return it as result
 
     :param [ndarray] list_images:
@@ -129,6 +147,8 @@ def estim_model_classes_group(list_images, nb_classes=4, clr_space='rgb',
     :param float pca_coef: range (0, 1) or None
     :param str proba_type:
     :param int nb_jobs:
+    :param bool smooth_fast: fast approximation of background subtraction
+        for texture features, see `seg_fts.gaussian_filter_fast`
     :return:
     """
     list_slic, list_features = list(), list()
@@ -137,7 +157,8 @@ def estim_model_classes_group(list_images, nb_classes=4, clr_space='rgb',
     wrapper_compute = partial(compute_color2d_superpixels_features,
                               sp_size=sp_size, sp_regul=sp_regul,
                               dict_features=dict_features,
-                              clr_space=clr_space, fts_norm=False)
+                              clr_space=clr_space, fts_norm=False,
+                              smooth_fast=smooth_fast)
     for slic, features in mproc_pool.imap_unordered(wrapper_compute,
                                                     list_images):
         list_slic.append(slic)
@@ -174,7 +195,8 @@ def segment_color2d_slic_features_model_graphcut(img, scaler, pca, model,
                                                  gc_regul=1.,
                                                  dict_features=FTS_SET_SIMPLE,
                                                  gc_edge_type='model',
-                                                 dict_debug_imgs=None):
+                                                 dict_debug_imgs=None,
+                                                 smooth_fast=False):
     """ complete pipe-line for segmentation using superpixels, extracting features
     and graphCut segmentation
 
@@ -188,6 +210,8 @@ def segment_color2d_slic_features_model_graphcut(img, scaler, pca, model,
     :param str gc_edge_type: select the GC edge type
     :param float pca_coef: range (0, 1) or None
     :param dict_debug_imgs: {str: ...}
+    :param bool smooth_fast: fast approximation of background subtraction
+        for texture features, see `seg_fts.gaussian_filter_fast`
     :return [[int]]: segmentation matrix mapping each pixel into a class
 
     >>> np.random.seed(0)
@@ -202,7 +226,8 @@ def segment_color2d_slic_features_model_graphcut(img, scaler, pca, model,
     slic, features = compute_color2d_superpixels_features(img, clr_space,
                                                           sp_size, sp_regul,
                                                           dict_features,
-                                                          fts_norm=False)
+                                                          fts_norm=False,
+                                                          smooth_fast=smooth_fast)
 
     if dict_debug_imgs is not None:
         if img.ndim == 2:  # duplicate channels to be like RGB
@@ -229,10 +254,158 @@ def segment_color2d_slic_features_model_graphcut(img, scaler, pca, model,
     return segm
 
 
+def _merge_overlapping_bboxes(bboxes):
+    """ merge overlapping bounding boxes until all of them are disjoint
+
+    :param [(int, int, int, int)] bboxes: boxes as (row_begin, col_begin,
+        row_end, col_end)
+    :return [(int, int, int, int)]:
+
+    >>> _merge_overlapping_bboxes([(0, 0, 5, 5), (3, 3, 8, 8), (10, 0, 12, 2)])
+    [(0, 0, 8, 8), (10, 0, 12, 2)]
+    """
+    bboxes = [tuple(bb) for bb in bboxes]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(bboxes)):
+            for j in range(i + 1, len(bboxes)):
+                bb1, bb2 = bboxes[i], bboxes[j]
+                if bb1[0] < bb2[2] and bb2[0] < bb1[2] \
+                        and bb1[1] < bb2[3] and bb2[1] < bb1[3]:
+                    bboxes[i] = (min(bb1[0], bb2[0]), min(bb1[1], bb2[1]),
+                                 max(bb1[2], bb2[2]), max(bb1[3], bb2[3]))
+                    del bboxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return bboxes
+
+
+def estimate_foreground_bboxes(image, scale=ROI_SCALE, padding=ROI_PADDING,
+                               min_size=ROI_MIN_SIZE):
+    """ detect bounding boxes of foreground regions by Otsu thresholding
+    of downscaled image, the foreground is the class which is less present
+    on the image border; overlapping padded boxes are merged
+
+    :param ndarray image: gray or color image
+    :param float scale: downscaling factor for the detection
+    :param int padding: padding of each region in pixels
+    :param float min_size: minimal region size as fraction of image
+    :return [(int, int, int, int)]: boxes as (row_begin, col_begin,
+        row_end, col_end) in full resolution
+
+    >>> image = np.zeros((200, 300))
+    >>> image[20:60, 30:80] = 1
+    >>> image[120:180, 200:260] = 1
+    >>> estimate_foreground_bboxes(image, scale=0.25, padding=10)
+    [(10, 18, 70, 90), (110, 190, 190, 270)]
+    >>> estimate_foreground_bboxes(1 - image, scale=0.25, padding=10)
+    [(10, 18, 70, 90), (110, 190, 190, 270)]
+    >>> estimate_foreground_bboxes(np.zeros((20, 30)))
+    []
+    """
+    img = np.asarray(image, dtype=float)
+    if img.ndim == 3:
+        img = np.mean(img, axis=2)
+    # downscale by averaging blocks
+    step = max(1, int(round(1. / scale)))
+    height, width = (img.shape[0] // step) * step, (img.shape[1] // step) * step
+    img_small = img[:height, :width].reshape(height // step, step,
+                                             width // step, step).mean(axis=(1, 3))
+    if img_small.size == 0 or img_small.min() == img_small.max():
+        return []
+    mask = img_small > sk_filters.threshold_otsu(img_small)
+    border = np.concatenate((mask[0], mask[-1], mask[:, 0], mask[:, -1]))
+    if np.mean(border) > 0.5:
+        mask = ~mask
+
+    regions, _ = ndimage.label(mask)
+    sizes = np.bincount(regions.ravel())
+    bboxes = []
+    for lb, slices in enumerate(ndimage.find_objects(regions)):
+        if slices is None or sizes[lb + 1] < min_size * mask.size:
+            continue
+        bboxes.append((max(0, slices[0].start * step - padding),
+                       max(0, slices[1].start * step - padding),
+                       min(img.shape[0], slices[0].stop * step + padding),
+                       min(img.shape[1], slices[1].stop * step + padding)))
+    return _merge_overlapping_bboxes(bboxes)
+
+
+def segment_foreground_rois(image, fn_segment, bg_label=0, scale=ROI_SCALE,
+                            padding=ROI_PADDING):
+    """ run the segmentation only in padded crops of foreground regions
+    and paste the results in full size segmentation with constant background
+
+    NOTE: the segmentation has to give the same labels for the same classes
+    in all crops, e.g. by a trained classifier or a fixed model
+
+    :param ndarray image: gray or color image
+    :param fn_segment: segmentation function taking an image crop
+    :param int bg_label: label for pixels outside of the foreground regions
+    :param float scale: downscaling factor for the foreground detection
+    :param int padding: padding of each region in pixels
+    :return ndarray: segmentation
+
+    >>> np.random.seed(0)
+    >>> seg_fts.USE_CYTHON = False
+    >>> image = np.random.random((200, 300, 3)) / 10.
+    >>> image[20:100, 30:130] += 0.8
+    >>> image[20:100, 80:130, 1] -= 0.4
+    >>> annot = np.zeros(image.shape[:2], dtype=int)
+    >>> annot[20:100, 30:80] = 1
+    >>> annot[20:100, 80:130] = 2
+    >>> clf, _, _, _ = train_classif_color2d_slic_features([image], [annot])
+    >>> fn_segment = partial(segment_color2d_slic_features_classif_graphcut,
+    ...                      classif=clf)
+    >>> segm = segment_foreground_rois(image, fn_segment)
+    >>> segm.shape
+    (200, 300)
+    >>> float(np.mean(segm == fn_segment(image))) > 0.95
+    True
+    """
+    bboxes = estimate_foreground_bboxes(image, scale, padding)
+    segm = np.full(image.shape[:2], bg_label, dtype=int)
+    for r_begin, c_begin, r_end, c_end in bboxes:
+        segm[r_begin:r_end, c_begin:c_end] = \
+            fn_segment(image[r_begin:r_end, c_begin:c_end])
+    logging.debug('segmented %i foreground regions covering %f of image',
+                  len(bboxes), np.sum([(bb[2] - bb[0]) * (bb[3] - bb[1])
+                                       for bb in bboxes]) / float(segm.size))
+    return segm
+
+
+def segment_slic_img2d_cached(image, sp_size, sp_regul, path_cache=None):
+    """ compute SLIC superpixels or load them from cache if they were computed
+    for the same image and parameters before
+
+    :param ndarray image: input image
+    :param int sp_size: initial size of a superpixel(meaning edge lenght)
+    :param float sp_regul: regularisation in range(0;1)
+    :param str path_cache: path to the cache folder, None means no cache
+    :return ndarray: superpixels
+    """
+    if path_cache is None:
+        return seg_sp.segment_slic_img2d(image, sp_size=sp_size,
+                                         rltv_compact=sp_regul)
+    key = tl_cache.compute_cache_key(image, name='slic_img2d',
+                                     sp_size=sp_size, sp_regul=sp_regul)
+    data = tl_cache.cache_load(path_cache, key)
+    if data is None:
+        slic = seg_sp.segment_slic_img2d(image, sp_size=sp_size,
+                                         rltv_compact=sp_regul)
+        data = tl_cache.cache_save(path_cache, key,
+                                   {'slic': slic.astype(np.int32)})
+    return np.array(data['slic'])
+
+
 def compute_color2d_superpixels_features(image, clr_space='rgb',
                                          sp_size=30, sp_regul=0.2,
                                          dict_features=FTS_SET_SIMPLE,
-                                         fts_norm=True):
+                                         fts_norm=True, path_cache=None,
+                                         smooth_fast=False):
     """ segment image into superpixels and estimate features per superpixel
 
     :param ndarray image: input RGB image
@@ -242,18 +415,23 @@ def compute_color2d_superpixels_features(image, clr_space='rgb',
            and "1" nearly square segments
     :param {str: [str]} dict_features: list of features to be extracted
     :param bool fts_norm: weather nomalise features
+    :param str path_cache: path to cache folder for superpixels and features,
+        None means that all is computed again
+    :param bool smooth_fast: fast approximation of background subtraction
+        for texture features, see `seg_fts.gaussian_filter_fast`
     :return [[int]], [[floats]]: superpixels and related of features
     """
     assert sp_regul > 0., 'slic. regularisation must be positive'
     logging.debug('run Superpixel clustering.')
-    slic = seg_sp.segment_slic_img2d(image, sp_size=sp_size,
-                                     rltv_compact=sp_regul)
+    slic = segment_slic_img2d_cached(image, sp_size, sp_regul, path_cache)
     # plt.figure(), plt.imshow(slic)
 
     logging.debug('extract slic/superpixels features.')
     image = convert_img_color_space(image, clr_space)
     features, _ = seg_fts.compute_selected_features_img2d(image, slic,
-                                                          dict_features)
+                                                          dict_features,
+                                                          path_cache,
+                                                          smooth_fast)
     logging.debug('list of features RAW: %s', repr(features.shape))
     features[np.isnan(features)] = 0
 
@@ -266,13 +444,17 @@ def compute_color2d_superpixels_features(image, clr_space='rgb',
 
 def wrapper_compute_color2d_slic_features_labels(img_annot, clr_space,
                                                  sp_size, sp_regul,
-                                                 dict_features, label_purity):
+                                                 dict_features, label_purity,
+                                                 path_cache=None,
+                                                 smooth_fast=False):
     img, annot = img_annot
     assert img.shape[:2] == annot.shape[:2]
     slic, features = compute_color2d_superpixels_features(img, clr_space,
                                                           sp_size, sp_regul,
                                                           dict_features,
-                                                          fts_norm=False)
+                                                          fts_norm=False,
+                                                          path_cache=path_cache,
+                                                          smooth_fast=smooth_fast)
     neg_label = np.max(annot) + 1 if np.sum(annot < 0) > 0 else None
     if neg_label is not None:
         annot[annot < 0] = neg_label
@@ -293,7 +475,8 @@ def train_classif_color2d_slic_features(list_images, list_annots, clr_space='rgb
                                         clf_name=CLASSIF_NAME, label_purity=0.9,
                                         feature_balance='unique',
                                         pca_coef=None, nb_classif_search=1,
-                                        nb_jobs=1):
+                                        nb_jobs=1, path_cache=None,
+                                        smooth_fast=False):
     """ train classifier on list of annotated images
 
     :param [ndarray] list_images:
@@ -309,6 +492,9 @@ def train_classif_color2d_slic_features(list_images, list_annots, clr_space='rgb
     :param float pca_coef: select PCA coef or None
     :param int nb_classif_search: number of tries for hyper-parameters seach
     :param int nb_jobs: parallelism
+    :param str path_cache: path to cache folder for superpixels and features
+    :param bool smooth_fast: fast approximation of background subtraction
+        for texture features, see `seg_fts.gaussian_filter_fast`
     :return:
     """
     logging.info('TRAIN Superpixels-Features-Classifier')
@@ -321,7 +507,8 @@ def train_classif_color2d_slic_features(list_images, list_annots, clr_space='rgb
     wrapper_compute = partial(wrapper_compute_color2d_slic_features_labels,
                               clr_space=clr_space, sp_size=sp_size,
                               sp_regul=sp_regul, dict_features=dict_features,
-                              label_purity=label_purity)
+                              label_purity=label_purity,
+                              path_cache=path_cache, smooth_fast=smooth_fast)
     list_imgs_annot = zip(list_images,  list_annots)
     for slic, fts, lbs in mproc_pool.imap_unordered(wrapper_compute,
                                                     list_imgs_annot):
@@ -379,7 +566,10 @@ def segment_color2d_slic_features_classif_graphcut(image, classif,
                                                    gc_regul=1.,
                                                    dict_features=FTS_SET_SIMPLE,
                                                    gc_edge_type='model',
-                                                   dict_debug_imgs=None):
+                                                   dict_debug_imgs=None,
+                                                   path_cache=None,
+                                                   pyramid_scale=None,
+                                                   smooth_fast=False):
     """ take trained classifier and apply it on new images
 
     :param ndarray image: input image
@@ -392,6 +582,12 @@ def segment_color2d_slic_features_classif_graphcut(image, classif,
     :param gc_regul: regularisation for GC
     :param str gc_edge_type: select the GC edge type
     :param dict_debug_imgs:
+    :param str path_cache: path to cache folder for superpixels and features
+    :param float pyramid_scale: segment downscaled image and refine only
+        class boundaries in full resolution, None means full resolution,
+        see `segment_color2d_slic_features_classif_graphcut_pyramid`
+    :param bool smooth_fast: fast approximation of background subtraction
+        for texture features, see `seg_fts.gaussian_filter_fast`
     :return:
 
     >>> np.random.seed(0)
@@ -404,13 +600,40 @@ def segment_color2d_slic_features_classif_graphcut(image, classif,
     >>> segm = segment_color2d_slic_features_classif_graphcut(image, clf)
     >>> segm.shape
     (125, 150)
+    >>> segm = segment_color2d_slic_features_classif_graphcut(
+    ...                                         image, clf, pyramid_scale=0.5)
+    >>> segm.shape
+    (125, 150)
     """
     logging.info('SEGMENTATION Superpixels-Features-Classifier-GraphCut')
+    if pyramid_scale is not None and pyramid_scale < 1:
+        return segment_color2d_slic_features_classif_graphcut_pyramid(
+            image, classif, pyramid_scale, clr_space, sp_size, sp_regul,
+            gc_regul, dict_features, gc_edge_type,
+            dict_debug_imgs=dict_debug_imgs, path_cache=path_cache,
+            smooth_fast=smooth_fast)
     slic, features = compute_color2d_superpixels_features(image, clr_space,
                                                           sp_size, sp_regul,
                                                           dict_features,
-                                                          fts_norm=False)
+                                                          fts_norm=False,
+                                                          path_cache=path_cache,
+                                                          smooth_fast=smooth_fast)
+    graph_labels = _classif_graphcut_superpixels(image, slic, features, classif,
+                                                 gc_regul, gc_edge_type,
+                                                 dict_debug_imgs)
+    segm = graph_labels[slic]
+    # relabel according classif classes
+    segm = classif.classes_[segm]
+    return segm
+
 
+def _classif_graphcut_superpixels(image, slic, features, classif, gc_regul=1.,
+                                  gc_edge_type='model', dict_debug_imgs=None):
+    """ classify superpixels and regularise them by GraphCut,
+    see `segment_color2d_slic_features_classif_graphcut`
+
+    :return ndarray: index of class per superpixel
+    """
     proba = classif.predict_proba(features)
 
     if dict_debug_imgs is not None:
@@ -420,18 +643,191 @@ def segment_color2d_slic_features_classif_graphcut(image, classif,
         dict_debug_imgs['slic'] = slic
         dict_debug_imgs['slic_mean'] = sk_color.label2rgb(slic, image, kind='avg')
 
+    if len(np.unique(slic)) < 2:  # there are no edges for GraphCut
+        return np.argmax(proba, axis=1)
+
     graph_labels = seg_gc.segment_graph_cut_general(slic, proba, image, features,
                                                     gc_regul, gc_edge_type,
                                                     dict_debug_imgs=dict_debug_imgs)
-    segm = graph_labels[slic]
+    return np.asarray(graph_labels)
+
+
+def segment_color2d_slic_features_classif_graphcut_pyramid(
+        image, classif, pyramid_scale=0.5, clr_space='rgb', sp_size=30,
+        sp_regul=0.2, gc_regul=1., dict_features=FTS_SET_SIMPLE,
+        gc_edge_type='model', tile_size=PYRAMID_REFINE_TILE,
+        dict_debug_imgs=None, path_cache=None, smooth_fast=False):
+    """ apply trained classifier on downscaled image and refine in full
+    resolution only the superpixels touching a boundary between classes
+
+    The image is segmented with proportionally smaller superpixels,
+    the superpixels are upscaled back by nearest neighbour and
+    the superpixels with a neighbour of different class are segmented again
+    in full resolution in tiles, where only the tiles containing these
+    superpixels are processed. If these tiles cover most of the image,
+    the whole image is segmented in full resolution instead.
+
+    NOTE: the features should not depend much on the image scale (e.g. colour
+    statistic) otherwise the classifier in lower resolution is less accurate
+
+    NOTE: the debug images are drawn in full resolution from superpixels
+    of the downscaled image combined with the refined ones, but the graph
+    variables ('segments', 'edges' and 'edge_weights') and the unary costs
+    are from the downscaled GraphCut; only the downscaled stage is cached
+
+    :param ndarray image: input image
+    :param classif: trained classifier
+    :param float pyramid_scale: scale of the downscaled image in range (0, 1)
+    :param str clr_space: chose the color space
+    :param int sp_size: initial size of a superpixel(meaning edge lenght)
+    :param float sp_regul: regularisation in range(0;1)
+    :param float gc_regul: regularisation for GC
+    :param {str: [str]} dict_features: list of features to be extracted
+    :param str gc_edge_type: select the GC edge type
+    :param int tile_size: size of refining tiles in number of superpixels
+    :param dict_debug_imgs: {str: ...}
+    :param str path_cache: path to cache folder for superpixels and features
+    :param bool smooth_fast: fast approximation of background subtraction
+        for texture features, see `seg_fts.gaussian_filter_fast`
+    :return ndarray: segmentation
+
+    >>> np.random.seed(0)
+    >>> seg_fts.USE_CYTHON = False
+    >>> image = np.random.random((200, 300, 3)) / 2.
+    >>> image[:, 150:] += 0.5
+    >>> annot = np.zeros(image.shape[:2], dtype=int)
+    >>> annot[:, 150:] = 1
+    >>> clf, _, _, _ = train_classif_color2d_slic_features([image], [annot])
+    >>> segm = segment_color2d_slic_features_classif_graphcut_pyramid(
+    ...                         image, clf, 0.5, sp_size=20, tile_size=1)
+    >>> segm.shape
+    (200, 300)
+    >>> float(np.mean(segm == annot)) > 0.95
+    True
+    >>> dict_debug = {}
+    >>> segm = segment_color2d_slic_features_classif_graphcut_pyramid(
+    ...         image, clf, 0.5, sp_size=20, tile_size=1,
+    ...         dict_debug_imgs=dict_debug)
+    >>> dict_debug['slic'].shape, dict_debug['img_graph_segm'].shape
+    ((200, 300), (200, 300, 3))
+    """
+    assert 0 < pyramid_scale <= 1, 'scale has to be in range (0, 1>'
+    image = np.asarray(image)
+    zoom = (pyramid_scale, pyramid_scale) + (1,) * (image.ndim - 2)
+    img_small = ndimage.zoom(image, zoom, order=1)
+    sp_size_small = max(2, int(round(sp_size * pyramid_scale)))
+    slic_small, features = compute_color2d_superpixels_features(
+        img_small, clr_space, sp_size_small, sp_regul, dict_features,
+        fts_norm=False, path_cache=path_cache, smooth_fast=smooth_fast)
+    labels_small = _classif_graphcut_superpixels(img_small, slic_small,
+                                                 features, classif, gc_regul,
+                                                 gc_edge_type, dict_debug_imgs)
+
+    # upscale the superpixels by nearest neighbour
+    height, width = image.shape[:2]
+    idx_rows = (np.arange(height) * slic_small.shape[0]) // height
+    idx_cols = (np.arange(width) * slic_small.shape[1]) // width
+    slic = slic_small[idx_rows[:, np.newaxis], idx_cols[np.newaxis, :]]
+    segm = labels_small[slic]
+
+    # superpixels having a neighbour with different class
+    edges = seg_sp.get_superpixel_graph(slic_small).edges
+    edges = edges[labels_small[edges[:, 0]] != labels_small[edges[:, 1]]]
+    on_boundary = np.zeros(len(labels_small), dtype=bool)
+    on_boundary[edges.ravel()] = True
+    mask_refine = on_boundary[slic]
+    logging.debug('refining %i of %i superpixels in full resolution',
+                  np.sum(on_boundary), len(on_boundary))
+
+    step = tile_size * sp_size
+    tiles = [(i, j) for i in range(0, height, step)
+             for j in range(0, width, step)
+             if np.any(mask_refine[i:i + step, j:j + step])]
+    if len(tiles) * step ** 2 > PYRAMID_MAX_REFINE * height * width:
+        logging.debug('refining %i tiles is too expensive, use full resolution',
+                      len(tiles))
+        if dict_debug_imgs is not None:
+            dict_debug_imgs.clear()
+        return segment_color2d_slic_features_classif_graphcut(
+            image, classif, clr_space, sp_size, sp_regul, gc_regul,
+            dict_features, gc_edge_type, dict_debug_imgs=dict_debug_imgs,
+            path_cache=path_cache, smooth_fast=smooth_fast)
+
+    # refine in tiles extended by a superpixel on each side, the superpixels
+    # in all tiles are computed on the image scaled by the global range
+    img_range = (np.min(image), np.max(image))
+    image_clr = convert_img_color_space(image, clr_space)
+    # full resolution superpixels with the refined ones for debug images
+    slic_debug = slic.copy() if dict_debug_imgs is not None else None
+    nb_debug = slic.max() + 1
+    for i, j in tiles:
+        i_begin, j_begin = max(0, i - sp_size), max(0, j - sp_size)
+        tile = (slice(i_begin, min(height, i + step + sp_size)),
+                slice(j_begin, min(width, j + step + sp_size)))
+        slic_tile = seg_sp.segment_slic_img2d(image[tile], sp_size,
+                                              sp_regul, img_range=img_range)
+        features, _ = seg_fts.compute_selected_features_img2d(
+            image_clr[tile], slic_tile, dict_features, smooth_fast=smooth_fast)
+        features[np.isnan(features)] = 0
+        labels_tile = _classif_graphcut_superpixels(
+            image[tile], slic_tile, features, classif, gc_regul,
+            gc_edge_type)
+        core = (slice(i - i_begin, i - i_begin + step),
+                slice(j - j_begin, j - j_begin + step))
+        segm_core = segm[i:i + step, j:j + step]
+        mask_core = mask_refine[i:i + step, j:j + step]
+        segm_core[mask_core] = labels_tile[slic_tile[core]][mask_core]
+        if slic_debug is not None:
+            slic_core = slic_debug[i:i + step, j:j + step]
+            slic_core[mask_core] = slic_tile[core][mask_core] + nb_debug
+            nb_debug += slic_tile.max() + 1
+
+    if dict_debug_imgs is not None:
+        _fill_pyramid_debug_images(dict_debug_imgs, image, slic_debug, segm,
+                                   (idx_rows, idx_cols))
     # relabel according classif classes
-    segm = classif.classes_[segm]
-    return segm
+    return classif.classes_[segm]
+
+
+def _fill_pyramid_debug_images(dict_debug_imgs, image, slic, segm, indexes):
+    """ upscale the debug images from downscaled GraphCut by nearest
+    neighbour and draw the superpixels and the result in full resolution,
+    see `segment_color2d_slic_features_classif_graphcut_pyramid`
+
+    :param dict_debug_imgs: {str: ...}
+    :param ndarray image: input image in full resolution
+    :param ndarray slic: combined superpixels in full resolution
+    :param ndarray segm: segmentation in full resolution
+    :param (ndarray, ndarray) indexes: rows and columns in downscaled image
+        for each row and column of the full resolution image
+    """
+    idx_rows, idx_cols = indexes
+
+    def upscale(img):
+        return img[idx_rows[:, np.newaxis], idx_cols[np.newaxis, :]]
+
+    if 'imgs_unary_cost' in dict_debug_imgs:
+        dict_debug_imgs['imgs_unary_cost'] = [
+            upscale(img) for img in dict_debug_imgs['imgs_unary_cost']]
+    if 'img_graph_edges' in dict_debug_imgs:
+        dict_debug_imgs['img_graph_edges'] = \
+            upscale(dict_debug_imgs['img_graph_edges'])
+    # sequential labels of the combined superpixels
+    _, slic = np.unique(slic, return_inverse=True)
+    slic = slic.reshape(segm.shape)
+    if image.ndim == 2:  # duplicate channels to be like RGB
+        image = np.rollaxis(np.tile(image, (3, 1, 1)), 0, 3)
+    dict_debug_imgs['image'] = image
+    dict_debug_imgs['slic'] = slic
+    dict_debug_imgs['slic_mean'] = sk_color.label2rgb(slic, image, kind='avg')
+    dict_debug_imgs['img_graph_segm'] = \
+        tl_visu.draw_color_labeling(segm, np.arange(segm.max() + 1))
 
 
 def pipe_gray3d_slic_features_gmm_graphcut(image, nb_classes=4, spacing=(12, 1, 1),
                                            sp_size=15, sp_regul=0.2, gc_regul=0.1,
-                                           dict_features=FTS_SET_SIMPLE):
+                                           dict_features=FTS_SET_SIMPLE,
+                                           slab_size=None, smooth_fast=False):
     """ complete pipe-line for segmentation using superpixels, extracting features
     and graphCut segmentation
 
@@ -442,6 +838,10 @@ def pipe_gray3d_slic_features_gmm_graphcut(image, nb_classes=4, spacing=(12, 1,
     :param int nb_classes: number of classes to be segmented(indexing from 0)
     :param (int, int, int) spacing:
     :param float gc_regul: regularisation for GC
+    :param int slab_size: compute supervoxels and color features slab-wise
+        with given number of slices, the image may be memory-mapped
+    :param bool smooth_fast: fast approximation of background subtraction
+        for texture features, see `seg_fts.gaussian_filter_fast`
     :return [[int]]: segmentation matrix maping each pixel into a class
 
     >>> np.random.seed(0)
@@ -450,14 +850,31 @@ def pipe_gray3d_slic_features_gmm_graphcut(image, nb_classes=4, spacing=(12, 1,
     >>> segm = pipe_gray3d_slic_features_gmm_graphcut(image)
     >>> segm.shape
     (5, 125, 150)
+    >>> segm = pipe_gray3d_slic_features_gmm_graphcut(image, slab_size=2)
+    >>> segm.shape
+    (5, 125, 150)
     """
     logging.info('PIPELINE Superpixels-Features-GraphCut')
-    slic = seg_sp.segment_slic_img3d_gray(image, sp_size=sp_size,
-                                          rltv_compact=sp_regul, space=spacing)
-    # plt.imshow(segments)
-    logging.info('extract segments/superpixels features.')
-    # f = features.computeColourMean(image, segments)
-    features, _ = seg_fts.compute_selected_features_gray3d(image, slic, dict_features)
+    if slab_size is not None:
+        if list(dict_features.keys()) != ['color']:
+            raise ValueError('slab-wise features support only "color", not %s'
+                             % repr(dict_features))
+        slic, accum = seg_sp.segment_slic_img3d_gray_slabs(
+            image, sp_size=sp_size, rltv_compact=sp_regul, space=spacing,
+            slab_size=slab_size)
+        logging.info('compute segments/superpixels features from accumulators.')
+        features, _ = seg_fts.compute_gray_statistic_accumulators(
+            accum, dict_features['color'])
+    else:
+        slic = seg_sp.segment_slic_img3d_gray(image, sp_size=sp_size,
+                                              rltv_compact=sp_regul,
+                                              space=spacing)
+        # plt.imshow(segments)
+        logging.info('extract segments/superpixels features.')
+        # f = features.computeColourMean(image, segments)
+        features, _ = seg_fts.compute_selected_features_gray3d(image, slic,
+                                                               dict_features,
+                                                               smooth_fast)
     # merge features together
     logging.debug('list of features RAW: %s', repr(features.shape))
     features[np.isnan(features)] = 0
@@ -10,7 +10,7 @@ import os
 import logging
 
 import numpy as np
-from scipy import stats, ndimage, interpolate
+from scipy import stats, ndimage, sparse
 from sklearn import cluster, mixture
 from skimage import morphology
 from gco import cut_general_graph, cut_grid_graph
@@ -21,6 +21,16 @@ import segmentation.descriptors as seg_fts
 import segmentation.superpixels as seg_spx
 
 GC_REPLACE_INF = 1e5
+# scaling of float costs to integers as it is done inside GCO, so the pixel
+# GraphCut with integer costs gives the same result as with float costs
+GC_INT_SCALE_UNARY = 1e5
+GC_INT_SCALE_EDGE = 1e3
+GC_INT_SCALE_PAIRWISE = 1e2
+# integer unary cost forbidding other labels on pixels fixed in a window,
+# it has to be below the GCO limit for a single energy term 1e7
+GC_INT_FIXED_COST = int(9e6)
+# radius of object window as shape mean plus this multiple of shape STD
+WINDOW_NB_STD = 3.
 MIN_SHAPE_PROB = 1e-2
 RG2SP_THRESHOLDS = {
     'centre': 30,
@@ -39,7 +49,7 @@ def object_segmentation_graphcut_slic(slic, segm, centres,
                                       dict_debug_imgs=None):
     """ object segmentation using Graph Cut directly on super-pixel level
 
-    :param ndarray slic: superpixel pre-segmentation
+    :param slic: superpixel pre-segmentation, ndarray or SuperpixelGraph
     :param ndarray segm: input structure segmentation
     :param [(int, int)] centres: superpixel centres
     :param [float] labels_fg_prob: weight for particular label belongs to FG
@@ -63,6 +73,8 @@ def object_segmentation_graphcut_slic(slic, segm, centres,
     array([0, 0, 0, 0, 0, 1, 1, 1, 1, 0], dtype=int32)
     """
     assert np.min(labels_fg_prob) < 1, 'non label can ce strictly 1'
+    graph = seg_spx.get_superpixel_graph(slic)
+    slic = graph.segments
     label_hist = seg_lb.histogram_regions_labels_norm(slic, segm)
     labels = np.argmax(label_hist, axis=1)
 
@@ -73,7 +85,7 @@ def object_segmentation_graphcut_slic(slic, segm, centres,
 
     assert len(centres) > 0, 'at least one center has to be given'
     centres = [np.round(c).astype(int) for c in centres]
-    slic_points = seg_spx.superpixel_centers(slic)
+    slic_points = graph.centers
 
     proba = np.ones((len(labels), len(centres) + 1))
     proba[:, 0] = labels_bg_prob[labels]
@@ -92,8 +104,8 @@ def object_segmentation_graphcut_slic(slic, segm, centres,
             cum = 1. - cdf + 1e-9
             shape[:, i + 1] = cum[dist.astype(int)]
 
-    _, edges = seg_gc.get_vertexes_edges(slic)
-    edges = np.array(edges)
+    # copy, the edges may be changed below
+    edges = np.array(graph.edges)
 
     unary_cost = - np.log(proba) - coef_shape * np.log(shape)
     for i, pos in enumerate(centres):
@@ -114,8 +126,7 @@ def object_segmentation_graphcut_slic(slic, segm, centres,
         vertex_2 = proba_fg[edges[:, 1]]
         dist = np.abs(vertex_1 - vertex_2)
         edge_weights = np.exp(- dist / (2 * np.std(dist) ** 2))
-        slic_centres = seg_spx.superpixel_centers(slic)
-        spatial_dist = seg_gc.compute_spatial_dist(slic_centres, edges,
+        spatial_dist = seg_gc.compute_spatial_dist(graph.centers, edges,
                                                    relative=True)
         edge_weights /= spatial_dist
     else:
@@ -140,13 +151,44 @@ def object_segmentation_graphcut_slic(slic, segm, centres,
     return graph_labels
 
 
+def compute_shape_prior_pixels(shape_2d, centre, shape_mean_std=(50., 10.)):
+    """ compute the shape prior as complementary CDF of the distance
+    from the object centre, the distances are computed with broadcasting
+
+    :param (int, int) shape_2d: image size
+    :param (int, int) centre: object centre
+    :param shape_mean_std: mean and STD of the object radius
+    :return ndarray: prior np.array<height, width>
+
+    >>> prior = compute_shape_prior_pixels((5, 7), (2, 3), (2., 1.))
+    >>> np.round(prior, 2)
+    array([[ 0.16,  0.5 ,  0.5 ,  0.5 ,  0.5 ,  0.5 ,  0.16],
+           [ 0.16,  0.5 ,  0.84,  0.84,  0.84,  0.5 ,  0.16],
+           [ 0.16,  0.5 ,  0.84,  0.98,  0.84,  0.5 ,  0.16],
+           [ 0.16,  0.5 ,  0.84,  0.84,  0.84,  0.5 ,  0.16],
+           [ 0.16,  0.5 ,  0.5 ,  0.5 ,  0.5 ,  0.5 ,  0.16]])
+    """
+    shape_mean, shape_std = shape_mean_std
+    diff_x2 = (np.arange(shape_2d[0]) - centre[0])[:, np.newaxis] ** 2
+    diff_y2 = (np.arange(shape_2d[1]) - centre[1])[np.newaxis, :] ** 2
+    dist = np.sqrt(diff_x2 + diff_y2).astype(int)
+    cdf = stats.norm.cdf(range(int(np.max(dist) + 1)), shape_mean, shape_std)
+    cum = 1. - cdf + 1e-9
+    return cum[dist]
+
+
 def object_segmentation_graphcut_pixels(segm, centres,
                                         labels_fg_prob=(0.1, 0.9),
                                         gc_regul=1, seed_size=0, coef_shape=0.,
                                         shape_mean_std=(50., 10.),
+                                        memory_lean=False,
                                         dict_debug_imgs=None):
     """ object segmentation using Graph Cut directly on pixel level
 
+    In the memory lean mode the unary costs are assembled label by label
+    directly into an integer volume which is passed to GraphCut without
+    any float intermediate volumes, the result is the same.
+
     :param ndarray slic: superpixel pre-segmentation
     :param ndarray segm: input structure segmentation
     :param [(int, int)] centres: superpixel centres
@@ -155,6 +197,7 @@ def object_segmentation_graphcut_pixels(segm, centres,
     :param int seed_size: create circular neighoing around initaial centre
     :param float coef_shape: set the weight of shape prior
     :param shape_mean_std: mean and STD for shape prior
+    :param bool memory_lean: build the unary costs in place as integers
     :param {} dict_debug_imgs: dictionary with some intermediate results
     :return [[int]]:
 
@@ -177,6 +220,20 @@ def object_segmentation_graphcut_pixels(segm, centres,
            [0, 0, 0, 0, 0, 0, 2, 2, 2, 2],
            [0, 0, 0, 0, 0, 2, 2, 2, 2, 2],
            [0, 0, 0, 0, 0, 0, 0, 0, 0, 0]], dtype=int32)
+    >>> dict_debug = {}
+    >>> object_segmentation_graphcut_pixels(segm, centres, gc_regul=.5,
+    ...                                     coef_shape=0.5, memory_lean=True,
+    ...                                     dict_debug_imgs=dict_debug)
+    array([[0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
+           [1, 1, 1, 1, 1, 0, 0, 0, 0, 0],
+           [1, 1, 1, 1, 0, 0, 0, 0, 0, 0],
+           [0, 0, 0, 0, 0, 0, 2, 2, 2, 2],
+           [0, 0, 0, 0, 0, 2, 2, 2, 2, 2],
+           [0, 0, 0, 0, 0, 0, 0, 0, 0, 0]], dtype=int32)
+    >>> dict_debug['unary_imgs'][0].dtype
+    dtype('float64')
+    >>> dict_debug['memory_peak']
+    3360
     """
     assert np.min(labels_fg_prob) < 1, 'non label can ce strictly 1'
     assert segm.max() <= len(labels_fg_prob), \
@@ -188,50 +245,257 @@ def object_segmentation_graphcut_pixels(segm, centres,
     assert len(centres) > 0, 'at least one center has to be given'
     centres = [np.round(c).astype(int) for c in centres]
 
-    proba = np.ones((height, width, len(centres) + 1))
-    proba[:, :, 0] = labels_bg_prob[segm]
-    for i in range(len(centres)):
-        proba[:, :, i + 1] = labels_fg_prob[segm]
+    if memory_lean:
+        unary, memory_peak = _compute_unary_pixels_lean(
+            segm, centres, labels_fg_prob, coef_shape, shape_mean_std)
+    else:
+        proba = np.ones((height, width, len(centres) + 1))
+        proba[:, :, 0] = labels_bg_prob[segm]
+        for i in range(len(centres)):
+            proba[:, :, i + 1] = labels_fg_prob[segm]
 
-    shape = np.ones((height, width, len(centres) + 1))
-    if coef_shape > 0:
-        shape_mean, shape_std = shape_mean_std
-        shape[:, :, 0] = labels_bg_prob[segm]
-        grid_y, grid_x = np.meshgrid(range(width), range(height))
-        for i, centre in enumerate(centres):
-            diff_x2 = (grid_x - centre[0]) ** 2
-            diff_y2 = (grid_y - centre[1]) ** 2
-            dist = np.sqrt(diff_x2 + diff_y2)
-            cdf = stats.norm.cdf(range(int(np.max(dist) + 1)),
-                                 shape_mean, shape_std)
-            cum = 1. - cdf + 1e-9
-            shape[:, :, i + 1] = cum[dist.astype(int)]
+        shape = np.ones((height, width, len(centres) + 1))
+        if coef_shape > 0:
+            shape[:, :, 0] = labels_bg_prob[segm]
+            for i, centre in enumerate(centres):
+                shape[:, :, i + 1] = compute_shape_prior_pixels(
+                    segm.shape, centre, shape_mean_std)
 
-    unary =  - np.log(proba) - coef_shape * np.log(shape)
-    for i, pos in enumerate(centres):
-        if seed_size > 0:
-            mask = np.zeros(segm.shape, dtype=bool)
-            selem = morphology.disk(seed_size)
-            mask[pos[0] - seed_size:pos[0] + seed_size + 1,
-                 pos[1] - seed_size:pos[1] + seed_size + 1] = selem
-            mask = np.logical_and(mask, segm > 0)
-            unary[mask.astype(bool), i + 1] = 0
-        else:
-            unary[pos[0], pos[1], i + 1] = 0
-        # unary[pos[0], pos[1], 0] = np.Inf
+        unary = - np.log(proba) - coef_shape * np.log(shape)
+        # proba, shape, unary and temporary for the shape term
+        memory_peak = proba.nbytes * 4
+        # GCO converts the float unary to integers
+        memory_peak += unary.size * np.dtype(np.intc).itemsize
+    _set_seeds_unary_pixels(unary, segm, centres, seed_size)
 
-    pairwise = (1 - np.eye(proba.shape[-1])) * gc_regul
+    pairwise = (1 - np.eye(unary.shape[-1])) * gc_regul
 
     cost_v = np.ones((height - 1, width)) * 1.
     cost_h = np.ones((height, width - 1)) * 1.
+    if memory_lean:
+        pairwise = (pairwise * GC_INT_SCALE_PAIRWISE).astype(np.intc)
+        cost_v = (cost_v * GC_INT_SCALE_EDGE).astype(np.intc)
+        cost_h = (cost_h * GC_INT_SCALE_EDGE).astype(np.intc)
+    logging.debug('pixel GraphCut allocates about %i MB for unary costs',
+                  memory_peak / 1024 ** 2)
     labels = cut_grid_graph(unary, pairwise, cost_v, cost_h, n_iter=999)
     segm_obj = labels.reshape(*segm.shape)
 
     if dict_debug_imgs is not None:
         list_unary_imgs = []
         for i in range(unary.shape[-1]):
-            list_unary_imgs.append(unary[:, :, i])
+            img_unary = unary[:, :, i]
+            if memory_lean:
+                img_unary = img_unary / GC_INT_SCALE_UNARY
+            list_unary_imgs.append(img_unary)
         dict_debug_imgs['unary_imgs'] = list_unary_imgs
+        dict_debug_imgs['memory_peak'] = memory_peak
+    return segm_obj
+
+
+def _compute_unary_pixels_lean(segm, centres, labels_fg_prob, coef_shape,
+                               shape_mean_std):
+    """ assemble the pixel unary costs label by label directly into
+    an integer volume scaled as GCO does for float costs
+
+    :param ndarray segm: input structure segmentation
+    :param [(int, int)] centres: object centres
+    :param ndarray labels_fg_prob: foreground probability for each label
+    :param float coef_shape: set the weight of shape prior
+    :param shape_mean_std: mean and STD for shape prior
+    :return ndarray, int: unary cost np.array<height, width, nb_centres + 1>
+        and estimated peak allocation in bytes
+    """
+    labels_bg_prob = 1. - labels_fg_prob
+    unary = np.empty(segm.shape + (len(centres) + 1,), dtype=np.intc)
+    # background does not depend on the centres
+    cost = - np.log(labels_bg_prob[segm])
+    if coef_shape > 0:
+        cost -= coef_shape * np.log(labels_bg_prob[segm])
+    cost *= GC_INT_SCALE_UNARY
+    unary[:, :, 0] = cost
+    cost_fg = - np.log(labels_fg_prob[segm])
+    for i, centre in enumerate(centres):
+        cost[:] = cost_fg
+        if coef_shape > 0:
+            prior = compute_shape_prior_pixels(segm.shape, centre,
+                                               shape_mean_std)
+            cost -= coef_shape * np.log(prior)
+        cost *= GC_INT_SCALE_UNARY
+        unary[:, :, i + 1] = cost
+    # unary, GCO copy of it and few temporary images
+    memory_peak = unary.nbytes * 2 + cost.nbytes * 4
+    return unary, memory_peak
+
+
+def _set_seeds_unary_pixels(unary, segm, centres, seed_size):
+    """ set zero cost of object label in the seed around each centre,
+    the seeds are cropped by the image and centres outside are skipped
+
+    :param ndarray unary: unary cost np.array<height, width, nb_centres + 1>
+    :param ndarray segm: input structure segmentation
+    :param [(int, int)] centres: object centres
+    :param int seed_size: radius of the seed, 0 for single pixel
+    """
+    height, width = segm.shape
+    selem = morphology.disk(seed_size).astype(bool)
+    for i, pos in enumerate(centres):
+        if not (0 <= pos[0] < height and 0 <= pos[1] < width):
+            continue
+        if seed_size == 0:
+            unary[pos[0], pos[1], i + 1] = 0
+            continue
+        r_begin, c_begin = pos[0] - seed_size, pos[1] - seed_size
+        r_end, c_end = pos[0] + seed_size + 1, pos[1] + seed_size + 1
+        mask = selem[max(0, -r_begin):selem.shape[0] - max(0, r_end - height),
+                     max(0, -c_begin):selem.shape[1] - max(0, c_end - width)]
+        r_begin, c_begin = max(0, r_begin), max(0, c_begin)
+        mask = np.logical_and(mask, segm[r_begin:r_begin + mask.shape[0],
+                                         c_begin:c_begin + mask.shape[1]] > 0)
+        unary[r_begin:r_begin + mask.shape[0],
+              c_begin:c_begin + mask.shape[1], i + 1][mask] = 0
+
+
+def _graphcut_pixels_window(segm, centres, idx_centres, bbox, labels_fg_prob,
+                            gc_regul, seed_size, coef_shape, shape_mean_std,
+                            segm_fixed=None):
+    """ pixel GraphCut in an image window with only selected objects
+
+    :param ndarray segm: input structure segmentation
+    :param [(int, int)] centres: all object centres
+    :param [int] idx_centres: indexes of objects competing in the window
+    :param (int, int, int, int) bbox: window as (row_begin, col_begin,
+        row_end, col_end)
+    :param ndarray labels_fg_prob: foreground probability for each label
+    :param float gc_regul: regularisation for GC
+    :param int seed_size: radius of the seed around centres
+    :param float coef_shape: set the weight of shape prior
+    :param shape_mean_std: mean and STD for shape prior
+    :param ndarray segm_fixed: labels of fixed pixels in the window,
+        negative for free pixels
+    :return ndarray: labels in the window, 0 for background
+        and index of centre plus one for objects
+    """
+    r_begin, c_begin, r_end, c_end = bbox
+    segm_win = segm[r_begin:r_end, c_begin:c_end]
+    centres_win = [np.asarray(centres[i]) - (r_begin, c_begin)
+                   for i in idx_centres]
+    unary, _ = _compute_unary_pixels_lean(segm_win, centres_win,
+                                          labels_fg_prob, coef_shape,
+                                          shape_mean_std)
+    _set_seeds_unary_pixels(unary, segm_win, centres_win, seed_size)
+    lut = np.array([0] + [i + 1 for i in idx_centres])
+    if segm_fixed is not None:
+        lut_inv = np.zeros(len(centres) + 1, dtype=int)
+        lut_inv[lut] = np.arange(len(lut))
+        rows, cols = np.nonzero(segm_fixed >= 0)
+        unary[rows, cols] = GC_INT_FIXED_COST
+        unary[rows, cols, lut_inv[segm_fixed[rows, cols]]] = 0
+
+    pairwise = (1 - np.eye(len(lut))) * gc_regul * GC_INT_SCALE_PAIRWISE
+    height, width = segm_win.shape
+    cost_v = np.full((height - 1, width), GC_INT_SCALE_EDGE, dtype=np.intc)
+    cost_h = np.full((height, width - 1), GC_INT_SCALE_EDGE, dtype=np.intc)
+    labels = cut_grid_graph(unary, pairwise.astype(np.intc), cost_v, cost_h,
+                            n_iter=999)
+    return lut[labels.reshape(segm_win.shape)]
+
+
+def object_segmentation_graphcut_pixels_windows(segm, centres,
+                                                labels_fg_prob=(0.1, 0.9),
+                                                gc_regul=1, seed_size=0,
+                                                coef_shape=0.,
+                                                shape_mean_std=(50., 10.),
+                                                nb_std=WINDOW_NB_STD):
+    """ object segmentation using pixel Graph Cut decomposed into windows,
+    each object is segmented against background in its window sized by
+    the shape prior and the pixels covered by several windows are resolved
+    by a final GraphCut with all involved objects
+
+    The cost grows with the number of objects instead of image size times
+    the number of objects, the objects larger than the window are cropped.
+
+    :param ndarray segm: input structure segmentation
+    :param [(int, int)] centres: object centres
+    :param [float] labels_fg_prob: set how much particular label belongs to foreground
+    :param float gc_regul: regularisation for GC
+    :param int seed_size: create circular neighoing around initaial centre
+    :param float coef_shape: set the weight of shape prior
+    :param shape_mean_std: mean and STD for shape prior
+    :param float nb_std: window radius as shape mean plus multiple of STD
+    :return [[int]]:
+
+    >>> segm = np.zeros((60, 80), dtype=int)
+    >>> segm[5:25, 5:30] = 1
+    >>> segm[20:55, 25:45] = 1
+    >>> segm[30:50, 55:75] = 1
+    >>> centres = [(15, 15), (40, 35), (40, 65)]
+    >>> segm_obj = object_segmentation_graphcut_pixels_windows(
+    ...     segm, centres, gc_regul=0.5, coef_shape=0.5,
+    ...     shape_mean_std=(10., 2.))
+    >>> segm_obj[::5, ::5]
+    array([[0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
+           [0, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
+           [0, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
+           [0, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
+           [0, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
+           [0, 0, 0, 0, 0, 1, 2, 2, 2, 0, 0, 0, 0, 0, 0, 0],
+           [0, 0, 0, 0, 0, 2, 2, 2, 2, 0, 0, 3, 3, 3, 3, 0],
+           [0, 0, 0, 0, 0, 2, 2, 2, 2, 0, 0, 3, 3, 3, 3, 0],
+           [0, 0, 0, 0, 0, 2, 2, 2, 2, 0, 0, 3, 3, 3, 3, 0],
+           [0, 0, 0, 0, 0, 2, 2, 2, 2, 0, 0, 3, 3, 3, 3, 0],
+           [0, 0, 0, 0, 0, 2, 2, 2, 2, 0, 0, 0, 0, 0, 0, 0],
+           [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]], dtype=int32)
+    >>> segm_full = object_segmentation_graphcut_pixels(
+    ...     segm, centres, gc_regul=0.5, coef_shape=0.5,
+    ...     shape_mean_std=(10., 2.))
+    >>> float(np.mean(segm_obj == segm_full)) > 0.95
+    True
+    """
+    assert np.min(labels_fg_prob) < 1, 'non label can ce strictly 1'
+    assert segm.max() <= len(labels_fg_prob), \
+        'table of label proba is shorter then the nb of labels in segmentation'
+    height, width = segm.shape
+    labels_fg_prob = np.array(labels_fg_prob)
+    assert len(centres) > 0, 'at least one center has to be given'
+    centres = [np.round(c).astype(int) for c in centres]
+    params = dict(labels_fg_prob=labels_fg_prob, gc_regul=gc_regul,
+                  seed_size=seed_size, coef_shape=coef_shape,
+                  shape_mean_std=shape_mean_std)
+
+    radius = int(np.ceil(shape_mean_std[0] + nb_std * shape_mean_std[1]))
+    bboxes = [(max(0, c[0] - radius), max(0, c[1] - radius),
+               min(height, c[0] + radius + 1), min(width, c[1] + radius + 1))
+              for c in centres]
+    segm_obj = np.zeros(segm.shape, dtype=np.int32)
+    coverage = np.zeros(segm.shape, dtype=int)
+    for i, bbox in enumerate(bboxes):
+        if bbox[2] - bbox[0] < 2 or bbox[3] - bbox[1] < 2:
+            continue
+        labels = _graphcut_pixels_window(segm, centres, [i], bbox, **params)
+        win = (slice(bbox[0], bbox[2]), slice(bbox[1], bbox[3]))
+        segm_obj[win][labels > 0] = labels[labels > 0]
+        coverage[win] += 1
+
+    # resolve pixels where the objects competes
+    overlaps, _ = ndimage.label(coverage > 1)
+    for i, slices in enumerate(ndimage.find_objects(overlaps)):
+        bbox = (max(0, slices[0].start - 1), max(0, slices[1].start - 1),
+                min(height, slices[0].stop + 1), min(width, slices[1].stop + 1))
+        win = (slice(bbox[0], bbox[2]), slice(bbox[1], bbox[3]))
+        mask_free = overlaps[win] == i + 1
+        segm_fixed = segm_obj[win].copy()
+        segm_fixed[mask_free] = -1
+        idx_centres = [j for j, bb in enumerate(bboxes)
+                       if bb[0] < bbox[2] and bbox[0] < bb[2]
+                       and bb[1] < bbox[3] and bbox[1] < bb[3]]
+        idx_centres = sorted(set(idx_centres)
+                             | set(segm_fixed[segm_fixed > 0] - 1))
+        labels = _graphcut_pixels_window(segm, centres, idx_centres, bbox,
+                                         segm_fixed=segm_fixed, **params)
+        segm_obj[win][mask_free] = labels[mask_free]
+    logging.debug('pixel GraphCut in %i windows and %i overlaps',
+                  len(bboxes), overlaps.max())
     return segm_obj
 
 
@@ -605,34 +869,61 @@ def compute_shape_prior_table_cdf(point, cum_distribution, centre,
     >>> compute_cdf([2, 3], chist, centre, angle_shift=270) # doctest: +ELLIPSIS
     0.891...
     """
-    if not isinstance(cum_distribution, np.ndarray):
-        cum_distribution = np.array(cum_distribution)
+    prior = compute_shape_prior_table_cdf_points([point], cum_distribution,
+                                                 centre, angle_shift)
+    return prior[0]
+
+
+def compute_shape_prior_table_cdf_points(points, cum_distribution, centre,
+                                         angle_shift=0):
+    """ compute shape prior for a set of points based on centre, rotation
+    shift and cumulative histogram, using bilinear interpolation
+    in the (angle, distance) table with periodic angle
+
+    :param [(int, int)] points: set of points
+    :param (int, int) centre: center of model
+    :param [[float]] cum_distribution: cumulative histogram
+    :param float angle_shift: rotation of the model
+    :return ndarray: prior for each point
+
+    >>> chist = [[1.0, 1.0, 0.8, 0.7, 0.6, 0.5, 0.3, 0.0, 0.0],
+    ...          [1.0, 1.0, 0.9, 0.8, 0.7, 0.3, 0.2, 0.2, 0.0],
+    ...          [1.0, 1.0, 1.0, 0.7, 0.6, 0.5, 0.3, 0.1, 0.1],
+    ...          [1.0, 1.0, 0.6, 0.5, 0.4, 0.3, 0.2, 0.0, 0.0]]
+    >>> points = [[1, 1], [10, 10], [2, 3], [-3, -2], [3, -2]]
+    >>> np.round(compute_shape_prior_table_cdf_points(points, chist, (1, 1)), 2)
+    array([ 1.  ,  0.  ,  0.81,  0.38,  0.68])
+    """
+    cum_distribution = np.asarray(cum_distribution, dtype=float)
     angle_step = 360. / cum_distribution.shape[0]
+    # append the first angle to the end for periodic interpolation
     cum_distribution = np.vstack((cum_distribution, cum_distribution[0]))
 
-    dx = point[0] - centre[0]
-    dy = point[1] - centre[1]
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    dx = points[:, 0] - centre[0]
+    dy = points[:, 1] - centre[1]
     dist = np.sqrt(dx ** 2 + dy ** 2)
 
     angle = np.rad2deg(np.arctan2(dy, dx))
     angle = ((2 * 360) + 90 - angle - angle_shift) % 360
     angle_norm = angle / angle_step
 
-    if dist >= (cum_distribution.shape[1] - 1):
-        return cum_distribution[int(round(angle_norm)), -1]
-
-    a0 = int(np.floor(angle_norm))
-    assert a0 < (cum_distribution.shape[0] - 1), \
-        'angle %i is larger then size %i' % (a0, cum_distribution.shape[0])
-    d0 = int(np.floor(dist))
-    assert d0 < (cum_distribution.shape[1] - 1), \
-        'distance %i is larger then size %i' % (d0, cum_distribution.shape[1])
-    interp = interpolate.interp2d(np.array([[a0, a0 + 1], [a0, a0 + 1]]).T,
-                                  np.array([[d0, d0 + 1], [d0, d0 + 1]]),
-                                  cum_distribution[a0:a0 + 2, d0:d0 + 2],
-                                  kind='linear')
-    prior = interp(angle_norm, dist)[0]
-    # prior = interp(a0, a0)[0]
+    prior = np.empty(len(points))
+    far = dist >= (cum_distribution.shape[1] - 1)
+    prior[far] = cum_distribution[np.round(angle_norm[far]).astype(int), -1]
+
+    near = ~far
+    angle_norm, dist = angle_norm[near], dist[near]
+    a0 = np.floor(angle_norm).astype(int)
+    d0 = np.floor(dist).astype(int)
+    assert np.all(a0 < (cum_distribution.shape[0] - 1)), \
+        'angle %i is larger then size %i' \
+        % (np.max(a0), cum_distribution.shape[0])
+    w_a, w_d = angle_norm - a0, dist - d0
+    prior[near] = cum_distribution[a0, d0] * (1 - w_a) * (1 - w_d) \
+        + cum_distribution[a0 + 1, d0] * w_a * (1 - w_d) \
+        + cum_distribution[a0, d0 + 1] * (1 - w_a) * w_d \
+        + cum_distribution[a0 + 1, d0 + 1] * w_a * w_d
     return prior
 
 
@@ -776,8 +1067,9 @@ def compute_update_shape_costs_points_table_cdf(lut_shape_cost, points, labels,
            [ 0.   ,  0.374]])
     """
     assert len(points) == len(labels)
-    if selected_idx is None:
-        selected_idx = list(range(len(points)))
+    points = np.asarray(points)
+    selected_idx = np.arange(len(points)) if selected_idx is None \
+        else np.asarray(selected_idx, dtype=int)
     model, cdf = shape_chist
     # segm_obj = labels[slic]
     for i, centre in enumerate(centres):
@@ -812,10 +1104,8 @@ def compute_update_shape_costs_points_table_cdf(lut_shape_cost, points, labels,
             shifts[i] = shift
 
         shape_proba = np.zeros(len(points))
-        for j in selected_idx:
-            shape_proba[j] = compute_shape_prior_table_cdf(
-                                points[j], cdf, centres[i], shifts[i])
-
+        shape_proba[selected_idx] = compute_shape_prior_table_cdf_points(
+            points[selected_idx], cdf, centres[i], shifts[i])
         lut_shape_cost[:, i + 1] = - np.log(shape_proba + MIN_SHAPE_PROB)
 
     lut_shape_cost[np.isinf(lut_shape_cost)] = GC_REPLACE_INF
@@ -830,7 +1120,7 @@ def compute_update_shape_costs_points_close_mean_cdf(lut_shape_cost, slic,
     set of points and cumulative histogram representing the shape model
 
     :param lut_shape_cost: look-up-table for shape cost for GC
-    :param ndarray slic: superpixel segmentation
+    :param slic: superpixel segmentation, ndarray or SuperpixelGraph
     :param [[int, int]] points: subsample space, points = superpixel centres
     :param [int] labels: labels for points to be assigned to an object
     :param [[int, int]] init_centres: initial centre position for compute
@@ -887,9 +1177,10 @@ def compute_update_shape_costs_points_close_mean_cdf(lut_shape_cost, slic,
            [ 0.   ,  4.605]])
     """
     assert len(points) == len(labels)
-    if selected_idx is None:
-        selected_idx = range(len(points))
-    segm_obj = labels[slic]
+    points = np.asarray(points)
+    selected_idx = np.arange(len(points)) if selected_idx is None \
+        else np.asarray(selected_idx, dtype=int)
+    segm_obj = labels[seg_spx.get_segments(slic)]
     model, list_mean_cdf = shape_model_cdfs
     _, list_cdfs = zip(*list_mean_cdf)
     angle_step = 360 / len(list_cdfs[0])
@@ -940,9 +1231,8 @@ def compute_update_shape_costs_points_close_mean_cdf(lut_shape_cost, slic,
             cdist[:, :cdf.shape[1]] += weights[j] * cdf
 
         shape_proba = np.zeros(len(points))
-        for j in selected_idx:
-            shape_proba[j] = compute_shape_prior_table_cdf(
-                                points[j], cdist, centres[i], shifts[i])
+        shape_proba[selected_idx] = compute_shape_prior_table_cdf_points(
+            points[selected_idx], cdist, centres[i], shifts[i])
         lut_shape_cost[:, i + 1] = - np.log(shape_proba + MIN_SHAPE_PROB)
 
     lut_shape_cost[np.isinf(lut_shape_cost)] = GC_REPLACE_INF
@@ -952,13 +1242,14 @@ def compute_update_shape_costs_points_close_mean_cdf(lut_shape_cost, slic,
 def compute_data_costs_points(slic, slic_labels, centres, labels, prob_fg_labels):
     """ compute Look up Table ro date term costs
 
-    :param nadarray slic: superpixel segmentation
+    :param slic: superpixel segmentation, ndarray or SuperpixelGraph
     :param [int] slic_labels: label for each superpixel
     :param [[int, int]] centres: actual centre postion
     :param [int] labels: labels for points to be assigned to an object
     :param [float] prob_fg_labels: weight for particular label belongs to FG
     :return:
     """
+    slic = seg_spx.get_segments(slic)
     data_proba = np.empty((len(labels), len(centres) + 1))
     data_proba[:, 0] = 1. - prob_fg_labels[slic_labels]
     for i, centre in enumerate(centres):
@@ -978,7 +1269,7 @@ def update_shape_costs_points(lut_shape_cost, slic, points, labels, init_centres
     set of points and shape model
 
     :param lut_shape_cost: look-up-table for shape cost for GC
-    :param nadarray slic: superpixel segmentation
+    :param slic: superpixel segmentation, ndarray or SuperpixelGraph
     :param [[int, int]] points: subsample space, points = superpixel centres
     :param [int] labels: labels for points to be assigned to an object
     :param [[int, int]] init_centres: initial centre position for compute
@@ -1022,8 +1313,26 @@ def compute_pairwise_penalty(edges, labels, prob_bg_fg=0.05, prob_fg1_fg2=0.01):
     array([ 0.        ,  2.99573227,  2.99573227,  4.60517019,  0.        ])
     """
     edges_labeled = labels[edges]
-    is_diff = (edges_labeled[:, 0] != edges_labeled[:, 1])
-    is_bg = np.logical_or(edges_labeled[:, 0] == 0, edges_labeled[:, 1] == 0)
+    return compute_label_pair_penalty(edges_labeled[:, 0], edges_labeled[:, 1],
+                                      prob_bg_fg, prob_fg1_fg2)
+
+
+def compute_label_pair_penalty(labels_1, labels_2, prob_bg_fg=0.05,
+                               prob_fg1_fg2=0.01):
+    """ compute cost of pairs of neighboring labels
+
+    :param [int] labels_1: labels of first vertexes
+    :param [int] labels_2: labels of second vertexes
+    :param float prob_bg_fg: penalty between background and foreground
+    :param float prob_fg1_fg2: penaly between two different foreground classes
+    :return ndarray:
+
+    >>> compute_label_pair_penalty(np.array([0, 0, 1, 2]),
+    ...                            np.array([0, 1, 1, 1]), 0.05, 0.01)
+    array([ 0.        ,  2.99573227,  0.        ,  4.60517019])
+    """
+    is_diff = (labels_1 != labels_2)
+    is_bg = np.logical_or(labels_1 == 0, labels_2 == 0)
     is_bg = np.logical_and(is_diff, is_bg)
     costs = - np.log(prob_fg1_fg2) * is_diff
     costs[is_bg] = - np.log(prob_bg_fg)
@@ -1047,8 +1356,8 @@ def get_neighboring_candidates(slic_neighbours, labels, object_idx,
     [1]
     """
     neighbours = []
-    for l_idx in np.array(slic_neighbours)[labels == object_idx]:
-        neighbours += l_idx
+    for idx in np.where(np.asarray(labels) == object_idx)[0]:
+        neighbours += list(slic_neighbours[idx])
     neighbours = np.unique(neighbours)
     if use_other_obj:
         neighbours = [lb for lb in neighbours if labels[lb] != object_idx]
@@ -1070,6 +1379,76 @@ def compute_energy(labels, lut_data_cost, lut_shape_cost, slic_weights, edges,
     return energy
 
 
+def compute_energy_changes(labels, candidates, candidate_labels, lut_data_cost,
+                           lut_shape_cost, slic_weights, adjacency, coef_shape,
+                           coef_pairwise, prob_label_trans):
+    """ compute the energy decrease for relabeling each candidate separately,
+    only the unary terms of the candidate and its incident edges are used
+
+    :param [int] labels: labels for each superpixel
+    :param [int] candidates: superpixels to be relabeled
+    :param [int] candidate_labels: new label for each candidate
+    :param ndarray lut_data_cost: look-up-table for data cost
+    :param ndarray lut_shape_cost: look-up-table for shape cost
+    :param [float] slic_weights: weight for each superpixel
+    :param csr_matrix adjacency: adjacency of superpixels
+    :param float coef_shape: weight for shape prior
+    :param float coef_pairwise: setting for pairwise cost
+    :param (float, float) prob_label_trans:
+    :return ndarray: energy change (before - after) for each candidate
+
+    >>> slic = np.array([[0, 0, 1, 1, 2], [3, 3, 4, 5, 5], [6, 7, 7, 8, 8]])
+    >>> graph = seg_spx.SuperpixelGraph(slic)
+    >>> np.random.seed(0)
+    >>> lut_data = np.random.random((9, 3))
+    >>> lut_shape = np.random.random((9, 3))
+    >>> labels = np.array([0, 1, 1, 0, 1, 2, 0, 2, 2])
+    >>> params = (lut_data, lut_shape, graph.sizes)
+    >>> changes = compute_energy_changes(labels, [0, 4, 6], [1, 2, 2],
+    ...     *(params + (graph.adjacency, 2., 1., (0.1, 0.01))))
+    >>> energy = compute_energy(labels, *(params + (graph.edges, 2., 1.,
+    ...                                              (0.1, 0.01))))
+    >>> energies_new = []
+    >>> for lb, lb_new in [(0, 1), (4, 2), (6, 2)]:
+    ...     labels_new = labels.copy()
+    ...     labels_new[lb] = lb_new
+    ...     energies_new.append(compute_energy(labels_new, *(params + (
+    ...         graph.edges, 2., 1., (0.1, 0.01)))))
+    >>> np.round(changes, 6)
+    array([ 1.358531,  5.304683,  0.882962])
+    >>> np.allclose(changes, energy - np.array(energies_new), rtol=0, atol=1e-9)
+    True
+    """
+    candidates = np.asarray(candidates, dtype=int)
+    labels_new = np.asarray(candidate_labels, dtype=int)
+    labels_old = labels[candidates]
+    weights = np.asarray(slic_weights)[candidates]
+    cost_old = lut_data_cost[candidates, labels_old] \
+        + coef_shape * lut_shape_cost[candidates, labels_old]
+    cost_new = lut_data_cost[candidates, labels_new] \
+        + coef_shape * lut_shape_cost[candidates, labels_new]
+    changes = weights * cost_old - weights * cost_new
+    if coef_pairwise > 0:
+        # gather neighbours of all candidates from CSR structure
+        begins = adjacency.indptr[candidates]
+        counts = adjacency.indptr[candidates + 1] - begins
+        idx_cand = np.repeat(np.arange(len(candidates)), counts)
+        offsets = np.arange(np.sum(counts)) \
+            - np.repeat(np.cumsum(counts) - counts, counts)
+        labels_near = labels[adjacency.indices[np.repeat(begins, counts)
+                                               + offsets]]
+        pairwise_old = compute_label_pair_penalty(
+            labels_old[idx_cand], labels_near, *prob_label_trans)
+        pairwise_new = compute_label_pair_penalty(
+            labels_new[idx_cand], labels_near, *prob_label_trans)
+        for costs in (pairwise_old, pairwise_new):
+            costs[np.isinf(costs)] = GC_REPLACE_INF
+        changes += coef_pairwise * np.bincount(
+            idx_cand, weights=pairwise_old - pairwise_new,
+            minlength=len(candidates))
+    return changes
+
+
 def region_growing_shape_slic_greedy(segm, slic, centres, shape_model,
                                      shape_type='cdf', prob_fg_labels=(.1, .9),
                                      coef_shape=1, coef_pairwise=1,
@@ -1081,7 +1460,7 @@ def region_growing_shape_slic_greedy(segm, slic, centres, shape_model,
     it uses the Greedy strategy and set some stopping criterion
 
     :param ndarray segm: initial structure segmentation
-    :param ndarray slic: superpixel segmentation
+    :param slic: superpixel segmentation, ndarray or SuperpixelGraph
     :param [(int, int)] centres: list of initial centres
     :param shape_model: represent the shape prior and histograms
     :param str shape_type: identification of used shape model
@@ -1197,17 +1576,18 @@ def region_growing_shape_slic_greedy(segm, slic, centres, shape_model,
            [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
            [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]])
     """
+    graph = seg_spx.get_superpixel_graph(slic)
+    slic = graph.segments
     assert segm.shape == slic.shape, 'dims of segm %s and slic %s not match' \
                                      % (repr(segm.shape),  repr(slic.shape))
-    slic_points = seg_spx.superpixel_centers(slic)
-    slic_points = np.round(slic_points).astype(int)
+    slic_points = np.round(graph.centers).astype(int)
     label_hist = seg_lb.histogram_regions_labels_norm(slic, segm)
     slic_labels = np.argmax(label_hist, axis=1)
-    slic_weights = np.bincount(slic.ravel())
+    slic_weights = graph.sizes
     init_centres = np.round(centres).astype(int)
 
-    _, edges = seg_spx.make_graph_segm_connect2d_conn4(slic)
-    slic_neighbours = seg_spx.get_neighboring_segments(edges)
+    edges = graph.edges
+    slic_neighbours = graph.neighbours
     labels = np.zeros(len(slic_points), dtype=int)
     prob_fg_labels = np.array(prob_fg_labels)
 
@@ -1255,19 +1635,11 @@ def region_growing_shape_slic_greedy(segm, slic, centres, shape_model,
             shifts, volumes, shape_model, shape_type, None, list_swap_shift[-1],
             dict_thresholds)
 
-        energy = compute_energy(labels, lut_data_cost, lut_shape_cost,
-            slic_weights, edges, coef_shape, coef_pairwise, prob_label_trans)
-
-        candidates_scores = []
-        for idx, lb in zip(objs_idx, candidates):
-            labels_new = labels.copy()
-            labels_new[lb] = idx
-            energy_new = compute_energy(labels_new, lut_data_cost,
-                                        lut_shape_cost, slic_weights, edges,
-                                        coef_shape, coef_pairwise,
-                                        prob_label_trans)
-            energy_change = energy - energy_new
-            candidates_scores.append((idx, lb, energy_change))
+        energy_changes = compute_energy_changes(
+            labels, candidates, objs_idx, lut_data_cost, lut_shape_cost,
+            slic_weights, graph.adjacency, coef_shape, coef_pairwise,
+            prob_label_trans)
+        candidates_scores = list(zip(objs_idx, candidates, energy_changes))
         candidates_scores = sorted(candidates_scores, key=lambda x: x[2],
                                    reverse=True)
 
@@ -1296,7 +1668,8 @@ def prepare_graphcut_variables(candidates, slic_points, slic_neighbours,
     construct graph and set potentials and hard connect BG and FG in unary
 
     :param [int] candidates: list of candidates, neighbours of actual objects
-    :param [[int]] slic_neighbours: list of neighboring superpixel for each one
+    :param slic_neighbours: neighboring superpixels for each one,
+        list of lists or CSR adjacency matrix
     :param [float] slic_weights: weight for each superpixel
     :param [int] labels: labels for each superpixel
     :param int nb_centres: number of centres - classes
@@ -1307,43 +1680,91 @@ def prepare_graphcut_variables(candidates, slic_points, slic_neighbours,
     :param float coef_shape: weight for shape priors
     :param prob_label_trans:
     :return:
+
+    >>> slic = np.array([[0, 0, 1, 1, 2], [3, 3, 4, 5, 5], [6, 7, 7, 8, 8]])
+    >>> graph = seg_spx.SuperpixelGraph(slic)
+    >>> labels = np.array([0, 1, 1, 0, 1, 0, 0, 0, 0])
+    >>> lut_data = np.tile([[1., 2.]], (9, 1))
+    >>> lut_shape = np.tile([[0., 1.]], (9, 1))
+    >>> vertexes, edges, weights, unary, pairwise = prepare_graphcut_variables(
+    ...     [0, 3, 5], graph.centers, graph.adjacency, graph.sizes, labels, 1,
+    ...     lut_data, lut_shape, 1., 1., (0.1, 0.03))
+    >>> vertexes.tolist()
+    [0, 3, 5, 1, 4, 6, 7, 2, 8]
+    >>> edges.tolist()  # doctest: +NORMALIZE_WHITESPACE
+    [[0, 3], [0, 1], [1, 0], [1, 4], [1, 5], [1, 6], [2, 3], [2, 7], [2, 4],
+     [2, 8]]
+    >>> unary[:4]
+    array([[  2.00000000e+00,   6.00000000e+00],
+           [  2.00000000e+00,   6.00000000e+00],
+           [  2.00000000e+00,   6.00000000e+00],
+           [  1.00000000e+05,   0.00000000e+00]])
+    >>> prepare_graphcut_variables(
+    ...     [0, 3, 5], graph.centers, graph.neighbours, graph.sizes, labels, 1,
+    ...     lut_data, lut_shape, 1., 1., (0.1, 0.03))[1].tolist() == edges.tolist()
+    True
     """
+    if sparse.issparse(slic_neighbours):
+        adjacency = slic_neighbours.tocsr()
+        if not adjacency.has_sorted_indices:
+            adjacency = adjacency.sorted_indices()
+        indptr, indices = adjacency.indptr, adjacency.indices
+    else:
+        indptr = np.r_[0, np.cumsum([len(near) for near in slic_neighbours])]
+        indices = np.concatenate([np.asarray(near, dtype=int)
+                                  for near in slic_neighbours])
+    candidates = np.asarray(candidates, dtype=int)
     assert np.max(candidates) < len(slic_points), \
         'max candidate idx: %d for %d centres' \
         % (np.max(candidates), len(slic_points))
-    assert max(max(l) for l in slic_neighbours) < len(slic_points), \
+    assert np.max(indices) < len(slic_points), \
         'max slic neighbours idx: %d for %d centres' \
-        % (max(max(l) for l in slic_neighbours), len(slic_points))
-    unary = np.zeros((len(candidates), nb_centres + 1))
-    vertexes, edges = list(candidates), []
-    for i, idx in enumerate(candidates):
-        near_idx = slic_neighbours[idx]
-        near_labels = labels[near_idx]
-        unary[i, :] = slic_weights[idx] * (lut_data_cost[idx] +
-                                           coef_shape * lut_shape_cost[idx])
-        for lb in range(unary.shape[-1]):
-            if lb not in near_labels:
-                unary[i, lb] = GC_REPLACE_INF
-        for n_idx in near_idx:
-            if n_idx not in vertexes:
-                vertexes.append(n_idx)
-                u = np.ones(unary.shape[-1]) * GC_REPLACE_INF
-                u[labels[n_idx]] = 0
-                unary = np.vstack((unary, u))
-            j = vertexes.index(n_idx)
-            edges.append((i, j))
-
+        % (np.max(indices), len(slic_points))
+    nb_labels = nb_centres + 1
+
+    # neighbours of all candidates in the order of candidates
+    begins = indptr[candidates]
+    counts = indptr[candidates + 1] - begins
+    idx_cand = np.repeat(np.arange(len(candidates)), counts)
+    offsets = np.arange(np.sum(counts)) \
+        - np.repeat(np.cumsum(counts) - counts, counts)
+    near = indices[np.repeat(begins, counts) + offsets]
+
+    unary = np.empty((len(candidates), nb_labels))
+    unary[:] = slic_weights[candidates][:, np.newaxis] \
+        * (lut_data_cost[candidates] + coef_shape * lut_shape_cost[candidates])
+    # only labels of neighbours are allowed
+    near_labels = np.zeros(unary.shape, dtype=bool)
+    near_labels[idx_cand, labels[near]] = True
+    unary[~near_labels] = GC_REPLACE_INF
+
+    # vertex map, first occurrence of each candidate and then new neighbours
+    # in order how they were reached
+    vertex_map = np.full(len(slic_points), -1, dtype=int)
+    uq_cand, idx_first = np.unique(candidates, return_index=True)
+    vertex_map[uq_cand] = idx_first
+    near_new = near[vertex_map[near] < 0]
+    uq_near, idx_first = np.unique(near_new, return_index=True)
+    near_new = uq_near[np.argsort(idx_first)]
+    vertex_map[near_new] = len(candidates) + np.arange(len(near_new))
+    vertexes = np.r_[candidates, near_new]
+
+    unary_near = np.full((len(near_new), nb_labels), GC_REPLACE_INF)
+    unary_near[np.arange(len(near_new)), labels[near_new]] = 0
+    unary = np.vstack((unary, unary_near))
+
+    edges = np.array([idx_cand, vertex_map[near]]).T
     spatial_dist = seg_gc.compute_spatial_dist(slic_points[vertexes], edges,
                                                relative=True)
     edge_weights = np.ones(len(edges)) / spatial_dist
 
-    pairwise = np.empty((unary.shape[-1], unary.shape[-1]))
+    pairwise = np.empty((nb_labels, nb_labels))
     pairwise[:, :] = - np.log(prob_label_trans[0])
     pairwise[1:, 1:] = - np.log(prob_label_trans[1])
-    pairwise[np.eye(unary.shape[-1], dtype=bool)] = 0
+    pairwise[np.eye(nb_labels, dtype=bool)] = 0
     pairwise *= coef_pairwise
 
-    return vertexes, np.array(edges), edge_weights, unary, pairwise
+    return vertexes, edges, edge_weights, unary, pairwise
 
 
 def enforce_center_labels(slic, labels, centres):
@@ -1355,6 +1776,7 @@ def enforce_center_labels(slic, labels, centres):
     :param centres:
     :return:
     """
+    slic = seg_spx.get_segments(slic)
     for i, center in enumerate(centres):
         idx = slic[int(center[0]), int(center[1])]
         labels[idx] = i + 1
@@ -1373,7 +1795,7 @@ def region_growing_shape_slic_graphcut(segm, slic, centres, shape_model,
     it uses the GraphCut strategy on neigbouring superpixels
 
     :param ndarray segm: initial structure segmentation
-    :param ndarray slic: superpixel segmentation
+    :param slic: superpixel segmentation, ndarray or SuperpixelGraph
     :param [(int, int)] centres: list of initial centres
     :param shape_model: represent the shape prior and histograms
     :param str shape_type: identification of used shape model
@@ -1489,17 +1911,18 @@ def region_growing_shape_slic_graphcut(segm, slic, centres, shape_model,
            [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
            [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]])
     """
+    graph = seg_spx.get_superpixel_graph(slic)
+    slic = graph.segments
     assert segm.shape == slic.shape, 'dims of segm %s and slic %s not match' \
                                      % (repr(segm.shape), repr(slic.shape))
-    slic_points = seg_spx.superpixel_centers(slic)
-    slic_points = np.round(slic_points).astype(int)
+    slic_points = np.round(graph.centers).astype(int)
     label_hist = seg_lb.histogram_regions_labels_norm(slic, segm)
     slic_labels = np.argmax(label_hist, axis=1)
-    slic_weights = np.bincount(slic.ravel())
+    slic_weights = graph.sizes
     init_centres = np.round(centres).astype(int)
 
-    _, edges = seg_spx.make_graph_segm_connect2d_conn4(slic)
-    slic_neighbours = seg_spx.get_neighboring_segments(edges)
+    edges = graph.edges
+    slic_neighbours = graph.neighbours
     labels = np.zeros(len(slic_points), dtype=int)
     prob_fg_labels = np.array(prob_fg_labels)
     labels_history = [labels.copy()]
@@ -1548,7 +1971,7 @@ def region_growing_shape_slic_graphcut(segm, slic, centres, shape_model,
                 dict_thresholds)
 
             gc_vestexes, gc_edges, edge_weights, unary, pairwise = \
-                prepare_graphcut_variables(candidates, slic_points, slic_neighbours,
+                prepare_graphcut_variables(candidates, slic_points, graph.adjacency,
                     slic_weights, labels, len(centres), lut_data_cost,
                     lut_shape_cost, coef_shape, coef_pairwise, prob_label_trans)
             # run GraphCut
@@ -1568,7 +1991,7 @@ def region_growing_shape_slic_graphcut(segm, slic, centres, shape_model,
                     dict_thresholds)
 
                 gc_vestexes, gc_edges, edge_weights, unary, pairwise = \
-                    prepare_graphcut_variables(candidates, slic_points, slic_neighbours,
+                    prepare_graphcut_variables(candidates, slic_points, graph.adjacency,
                         slic_weights, labels, len(centres), lut_data_cost,
                         lut_shape_cost, coef_shape, coef_pairwise, prob_label_trans)
                 # run GraphCut
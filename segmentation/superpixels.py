@@ -10,16 +10,39 @@ Copyright (C) 2014-2016 Jiri Borovec <jiri.borovec@fel.cvut.cz>
 """
 
 
+import time
 import logging
+import multiprocessing as mproc
+from functools import partial
 
 import numpy as np
+from scipy import sparse, ndimage
 import skimage.segmentation as ski_segm
-from skimage import measure
+from skimage import measure, color, filters
+
+import segmentation.labeling as seg_lb
 
 IMAGE_SPACING = (1, 1, 1)
+# overlap of neighbouring tiles in tiled SLIC relative to superpixel size
+SLIC_TILE_OVERLAP = 2
+# minimal tile size in tiled SLIC relative to the tile overlap
+SLIC_TILE_MIN_SIZE = 4
+# minimal share of seam pixels of both segments to be merged across seam
+SLIC_TILE_MERGE_SHARE = 0.5
+# fragments along seams smaller then this fraction of superpixel are merged
+SLIC_TILE_MIN_FRAGMENT = 0.25
+# minimal difference in Lab colour space for pixel to be changed between slices
+SLIC_WARM_CHANGE_THR = 3.
+# maximal fraction of changed pixels to use warm start instead of new SLIC
+SLIC_WARM_MAX_CHANGE = 0.5
+# number of assignment iterations for warm started superpixels
+SLIC_WARM_NB_ITER = 5
+# distance to changed pixels which still affects features, e.g. by filters
+SLIC_WARM_REUSE_HALO = 3
 
 
-def segment_slic_img2d(img, sp_size=50, rltv_compact=0.1, slico=False):
+def segment_slic_img2d(img, sp_size=50, rltv_compact=0.1, slico=False,
+                       img_range=None):
     """ segmentation by SLIC superpixels using original SLIC implementation
 
     :param ndarray im: input color image
@@ -27,6 +50,8 @@ def segment_slic_img2d(img, sp_size=50, rltv_compact=0.1, slico=False):
     :param float rltv_compact: relative regularisation in range (0, 1)
         where 0 is for free form and 1 for nearly rectangular superpixels
     :param bool slico: whether use parameter free version ASLIC/SLICO
+    :param (float, float) img_range: min and max value for scaling image,
+        e.g. of the whole image if this is only a part, None means own range
     :return:
     
     >>> np.random.seed(0)
@@ -38,30 +63,22 @@ def segment_slic_img2d(img, sp_size=50, rltv_compact=0.1, slico=False):
     >>> slic = segment_slic_img2d(img, 20, 0.2)
     >>> slic.shape
     (150, 100)
+    >>> slic = segment_slic_img2d(np.zeros((50, 50)), 20, 0.2, img_range=(0, 1))
+    >>> slic.shape
+    (50, 50)
     """
     logging.debug('Init SLIC superpixels 2d RGB clustering with params'
                   ' size=%i and regul=%f for image dims %s',
                   sp_size, rltv_compact, repr(img.shape))
     nb_pixels = np.prod(img.shape[:2])
-
-    if not isinstance(img, np.ndarray):
-        img = np.array(img)
-    if img.ndim == 2:  # duplicate channels to be like RGB
-        img = np.rollaxis(np.tile(img, (3, 1, 1)), 0, 3)
-    # scale image values
-    if img.min() != 0. or img.max() != 1.:
-        img = (img - img.min()) / float(img.max() - img.min())
+    img = _prepare_img2d_rgb(img, img_range)
 
     # set native SLIC parameters
     slic_nb_spx = int(nb_pixels / (sp_size ** 2))
     slic_compact = (sp_size * rltv_compact) ** 1.5
     logging.debug('Starting SLIC with params NB=%i & compat=%f for image %s',
                   slic_nb_spx, slic_compact, repr(img.shape))
-    # run SLIC segmentation
-    slic_segments = ski_segm.slic(img, n_segments=slic_nb_spx,
-                                  compactness=slic_compact,
-                                  sigma=1, enforce_connectivity=True,
-                                  slic_zero=slico)
+    slic_segments = _run_slic_img2d(img, slic_nb_spx, slic_compact, slico)
     logging.debug('SLIC finished')
     # slic_segments, _, _ = ski_segm.relabel_sequential(slic_segments)
     # fix: unconnected segments - [ndimage.label(slic==i)[1]
@@ -70,26 +87,696 @@ def segment_slic_img2d(img, sp_size=50, rltv_compact=0.1, slico=False):
     return np.array(slic_segments)
 
 
-def segment_slic_img3d_gray(im, sp_size=50, rltv_compact=0.1,
-                            space=IMAGE_SPACING):
-    """ segmentation by SLIC superpixels using originla SLIC implementation
+def _prepare_img2d_rgb(img, img_range=None):
+    """ convert gray image to RGB and scale values to range (0, 1) """
+    if not isinstance(img, np.ndarray):
+        img = np.array(img)
+    if img.ndim == 2:  # duplicate channels to be like RGB
+        img = np.rollaxis(np.tile(img, (3, 1, 1)), 0, 3)
+    # scale image values
+    if img_range is not None:
+        img = (img - img_range[0]) / max(float(img_range[1] - img_range[0]),
+                                         1e-9)
+    elif img.min() != 0. or img.max() != 1.:
+        img = (img - img.min()) / float(img.max() - img.min())
+    return img
 
-    :param ndarray im: input 3D grascale image
+
+def _run_slic_img2d(img, nb_spx, compact, slico=False):
+    """ run SLIC segmentation on normalised RGB image """
+    return ski_segm.slic(img, n_segments=max(1, nb_spx), compactness=compact,
+                         sigma=1, enforce_connectivity=True, slic_zero=slico)
+
+
+def _superpixels_slic(img, sp_size, rltv_compact):
+    """ SLIC superpixels on normalised RGB image """
+    slic_nb_spx = int(np.prod(img.shape[:2]) / (sp_size ** 2))
+    return _run_slic_img2d(img, slic_nb_spx, (sp_size * rltv_compact) ** 1.5)
+
+
+def _superpixels_slico(img, sp_size, rltv_compact):
+    """ parameter free SLICO superpixels on normalised RGB image """
+    slic_nb_spx = int(np.prod(img.shape[:2]) / (sp_size ** 2))
+    return _run_slic_img2d(img, slic_nb_spx, (sp_size * rltv_compact) ** 1.5,
+                           slico=True)
+
+
+def _superpixels_felzenszwalb(img, sp_size, rltv_compact):
+    """ graph based segmentation by Felzenszwalb on normalised RGB image,
+    the regularisation is not used since the segments are not compact """
+    return ski_segm.felzenszwalb(img, scale=sp_size, sigma=1,
+                                 min_size=int(sp_size ** 2 / 4.))
+
+
+def _superpixels_watershed(img, sp_size, rltv_compact):
+    """ compact watershed on image gradient seeded from regular grid """
+    gradient = filters.sobel(color.rgb2gray(img))
+    offset = sp_size // 2
+    rows, cols = np.meshgrid(np.arange(offset, img.shape[0], sp_size),
+                             np.arange(offset, img.shape[1], sp_size),
+                             indexing='ij')
+    markers = np.zeros(img.shape[:2], dtype=int)
+    markers[rows, cols] = np.arange(1, rows.size + 1).reshape(rows.shape)
+    segm = ski_segm.watershed(gradient, markers,
+                              compactness=rltv_compact ** 1.5 / sp_size)
+    return segm - 1
+
+
+def _superpixels_grid(img, sp_size, rltv_compact):
+    """ regular grid of squared blocks ignoring the image content """
+    rows, cols = np.indices(img.shape[:2]) // sp_size
+    return rows * int(np.ceil(img.shape[1] / float(sp_size))) + cols
+
+
+# superpixel methods with the same signature (image, sp_size, rltv_compact)
+DICT_SUPERPIXEL_ENGINES = {
+    'slic': _superpixels_slic,
+    'slico': _superpixels_slico,
+    'felzenszwalb': _superpixels_felzenszwalb,
+    'watershed': _superpixels_watershed,
+    'grid': _superpixels_grid,
+}
+
+
+def segment_superpixels_img2d(img, sp_size=50, rltv_compact=0.1,
+                              engine='slic'):
+    """ segmentation by superpixels with selected method, the faster methods
+    as `grid` or `watershed` may be used instead of SLIC for larger data
+
+    :param ndarray img: input color or gray image
     :param int sp_size: superpixel initial size
     :param float rltv_compact: relative regularisation in range (0, 1)
         where 0 is for free form and 1 for nearly rectangular superpixels
-    :param (int, int, int) space: spacing in 3d image may not be equal
-    :return:
+    :param str engine: name of superpixel method from DICT_SUPERPIXEL_ENGINES
+    :return ndarray:
 
     >>> np.random.seed(0)
-    >>> img = np.random.random((100, 100, 10))
-    >>> slic = segment_slic_img3d_gray(img, 20, 0.2, (1, 1, 5))
+    >>> img = np.random.random((100, 150, 3))
+    >>> img[20:60, 40:100] += 1
+    >>> for engine in sorted(DICT_SUPERPIXEL_ENGINES):
+    ...     segm = segment_superpixels_img2d(img, 20, 0.2, engine)
+    ...     print (engine, segm.shape, 0 < segm.max() < 100)
+    felzenszwalb (100, 150) True
+    grid (100, 150) True
+    slic (100, 150) True
+    slico (100, 150) True
+    watershed (100, 150) True
+    >>> segment_superpixels_img2d(np.random.random((20, 30)), 10, engine='grid')
+    array([[0, 0, 0, ..., 2, 2, 2],
+           [0, 0, 0, ..., 2, 2, 2],
+           [0, 0, 0, ..., 2, 2, 2],
+           ...,
+           [3, 3, 3, ..., 5, 5, 5],
+           [3, 3, 3, ..., 5, 5, 5],
+           [3, 3, 3, ..., 5, 5, 5]])
+    """
+    if engine not in DICT_SUPERPIXEL_ENGINES:
+        raise ValueError('not supported superpixel engine "%s" from %s'
+                         % (engine, repr(sorted(DICT_SUPERPIXEL_ENGINES))))
+    logging.debug('Init %s superpixels 2d with params size=%i and regul=%f '
+                  'for image dims %s', engine, sp_size, rltv_compact,
+                  repr(np.shape(img)))
+    img = _prepare_img2d_rgb(img)
+    segm = DICT_SUPERPIXEL_ENGINES[engine](img, sp_size, rltv_compact)
+    return np.array(segm)
+
+
+def _segment_slic_tile(tile, img_range, sp_size, rltv_compact, slico=False):
+    """ run SLIC on a single extended tile normalised by global image range
+
+    :param ndarray tile: crop of the image including the overlap
+    :param (float, float) img_range: min and max value of the whole image
+    :param int sp_size: superpixel initial size
+    :param float rltv_compact: relative regularisation in range (0, 1)
+    :param bool slico: whether use parameter free version ASLIC/SLICO
+    :return ndarray:
+    """
+    tile = np.asarray(tile, dtype=np.float32)
+    tile = (tile - img_range[0]) / max(float(img_range[1] - img_range[0]),
+                                       1e-9)
+    if tile.ndim == 2:  # duplicate channels to be like RGB
+        tile = np.rollaxis(np.tile(tile, (3, 1, 1)), 0, 3)
+    nb_spx = int(np.prod(tile.shape[:2]) / (sp_size ** 2))
+    compact = (sp_size * rltv_compact) ** 1.5
+    return _run_slic_img2d(tile, nb_spx, compact, slico)
+
+
+def _merge_seam_segments(segm, raw_left, raw_right,
+                         min_share=SLIC_TILE_MERGE_SHARE):
+    """ find pairs of segments along a seam which shall be merged, the pair
+    is merged if both neighbouring tiles agree on it along the most of seam
+    pixels of both segments, so each segment is merged with at most one
+    segment on the other side and the merges do not chain along the seam
+
+    :param ndarray segm: np.array<2, length> global labels on both sides
+    :param ndarray raw_left: np.array<2, length> raw labels from first tile
+    :param ndarray raw_right: np.array<2, length> raw labels from second tile
+    :param float min_share: minimal share of the seam pixels of each segment
+    :return ndarray: np.array<nb_pairs, 2>
+
+    >>> segm = np.array([[0, 0, 0, 0, 1, 1], [2, 2, 2, 2, 2, 2]])
+    >>> raw = np.array([[0, 0, 0, 0, 1, 1], [0, 0, 0, 0, 1, 1]])
+    >>> _merge_seam_segments(segm, raw, raw)
+    array([[0, 2]])
+    """
+    agree = np.logical_and(raw_left[0] == raw_left[1],
+                           raw_right[0] == raw_right[1])
+    if not np.any(agree):
+        return np.empty((0, 2), dtype=segm.dtype)
+    nb_labels = segm.max() + 1
+    # hash the label pairs, it keeps the lexicographic order
+    hashes = segm[0] * nb_labels + segm[1]
+    pairs_agree, votes = np.unique(hashes[agree], return_counts=True)
+    first, second = pairs_agree // nb_labels, pairs_agree % nb_labels
+    # number of seam pixels of each segment on its side
+    counts_first = np.bincount(segm[0], minlength=nb_labels)
+    counts_second = np.bincount(segm[1], minlength=nb_labels)
+    merge = np.logical_and(votes > min_share * counts_first[first],
+                           votes > min_share * counts_second[second])
+    return np.c_[first[merge], second[merge]]
+
+
+def _union_find_lut(nb_labels, pairs):
+    """ create look-up table to root labels for merged pairs
+
+    >>> _union_find_lut(5, np.array([[0, 2], [3, 2]]))
+    array([0, 1, 0, 0, 4])
+    >>> _union_find_lut(6, np.array([[4, 5], [3, 4], [2, 3], [1, 5], [1, 0]]))
+    array([0, 0, 0, 0, 0, 0])
+    """
+    parents = np.arange(nb_labels)
+
+    def find(i):
+        root = i
+        while parents[root] != root:
+            root = parents[root]
+        # compress the path, all visited labels point directly to the root
+        while parents[i] != root:
+            parent = parents[i]
+            parents[i] = root
+            i = parent
+        return root
+
+    for i, j in pairs:
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            parents[max(ri, rj)] = min(ri, rj)
+    return np.array([find(i) for i in range(nb_labels)])
+
+
+def segment_slic_img2d_tiled(img, sp_size=50, rltv_compact=0.1, slico=False,
+                             tile_size=2048, nb_jobs=1):
+    """ segmentation by SLIC superpixels computed in overlapping tiles,
+    the superpixels cut by the tile seams are merged if the both tiles agree,
+    then the labeling is made connected and unique over whole image
+
+    :param ndarray img: input color or gray image
+    :param int sp_size: superpixel initial size
+    :param float rltv_compact: relative regularisation in range (0, 1)
+        where 0 is for free form and 1 for nearly rectangular superpixels
+    :param bool slico: whether use parameter free version ASLIC/SLICO
+    :param int tile_size: size of the core of each tile, it is raised to
+        `SLIC_TILE_MIN_SIZE` times the tile overlap if it is smaller
+    :param int nb_jobs: number of processes running in parallel
+    :return ndarray: np.array<height, width>
+
+    >>> np.random.seed(0)
+    >>> img = np.zeros((120, 150, 3))
+    >>> img[20:70, 30:110] = 1
+    >>> img += np.random.random(img.shape) * 0.1
+    >>> slic = segment_slic_img2d_tiled(img, 10, 0.2, tile_size=80)
     >>> slic.shape
-    (100, 100, 10)
+    (120, 150)
+    >>> nb = slic.max() + 1
+    >>> np.unique(slic).tolist() == list(range(nb))
+    True
+    >>> measure.label(slic + 1, connectivity=1).max() == nb
+    True
+    >>> nb_mono = len(np.unique(segment_slic_img2d(img, 10, 0.2)))
+    >>> abs(nb - nb_mono) < 0.1 * nb_mono
+    True
     """
-    logging.debug('Init SLIC superpixels 3d Gray clustering with params'
-                  ' size=%i and regul=%f for image dims %s',
-                  sp_size, rltv_compact, repr(im.shape))
+    logging.debug('Init tiled SLIC superpixels 2d with params size=%i, '
+                  'regul=%f and tile %i for image dims %s',
+                  sp_size, rltv_compact, tile_size, repr(img.shape))
+    img = np.asarray(img)
+    height, width = img.shape[:2]
+    overlap = int(SLIC_TILE_OVERLAP * sp_size)
+    if tile_size < SLIC_TILE_MIN_SIZE * overlap:
+        logging.warning('tile size %i is too small for overlap %i, using %i',
+                        tile_size, overlap, SLIC_TILE_MIN_SIZE * overlap)
+        tile_size = SLIC_TILE_MIN_SIZE * overlap
+    tiles_rows = list(range(0, height, tile_size))
+    tiles_cols = list(range(0, width, tile_size))
+    cores, bboxes = [], []
+    for r0 in tiles_rows:
+        for c0 in tiles_cols:
+            r1, c1 = min(r0 + tile_size, height), min(c0 + tile_size, width)
+            cores.append((r0, r1, c0, c1))
+            bboxes.append((max(0, r0 - overlap), min(height, r1 + overlap),
+                           max(0, c0 - overlap), min(width, c1 + overlap)))
+
+    # send to workers only the crops, not the whole image
+    crops = [img[b_r0:b_r1, b_c0:b_c1] for b_r0, b_r1, b_c0, b_c1 in bboxes]
+    wrapper_slic = partial(_segment_slic_tile,
+                           img_range=(float(img.min()), float(img.max())),
+                           sp_size=sp_size, rltv_compact=rltv_compact,
+                           slico=slico)
+    if nb_jobs > 1 and len(bboxes) > 1:
+        mproc_pool = mproc.Pool(nb_jobs)
+        list_tiles = mproc_pool.map(wrapper_slic, crops)
+        mproc_pool.close()
+        mproc_pool.join()
+    else:
+        list_tiles = [wrapper_slic(crop) for crop in crops]
+    del crops
+
+    # place tile cores with unique labels and keep the raw labels around
+    segm = np.empty((height, width), dtype=np.int64)
+    dict_raw = {}
+    offset = 0
+    for (r0, r1, c0, c1), (b_r0, _, b_c0, _), seg in zip(cores, bboxes,
+                                                         list_tiles):
+        segm[r0:r1, c0:c1] = seg[r0 - b_r0:r1 - b_r0,
+                                 c0 - b_c0:c1 - b_c0] + offset
+        offset += seg.max() + 1
+        dict_raw[(r0, c0)] = (seg, b_r0, b_c0)
+
+    # reconcile superpixels across all horizontal and vertical seams
+    merge_pairs = []
+    for (r0, r1, c0, c1) in cores:
+        seg, b_r0, b_c0 = dict_raw[(r0, c0)]
+        if r1 < height:
+            seg_nb, nb_r0, nb_c0 = dict_raw[(r1, c0)]
+            rows, cols = slice(r1 - 1, r1 + 1), slice(c0, c1)
+            merge_pairs.append(_merge_seam_segments(
+                segm[rows, cols],
+                seg[r1 - 1 - b_r0:r1 + 1 - b_r0, c0 - b_c0:c1 - b_c0],
+                seg_nb[r1 - 1 - nb_r0:r1 + 1 - nb_r0, c0 - nb_c0:c1 - nb_c0]))
+        if c1 < width:
+            seg_nb, nb_r0, nb_c0 = dict_raw[(r0, c1)]
+            rows, cols = slice(r0, r1), slice(c1 - 1, c1 + 1)
+            merge_pairs.append(_merge_seam_segments(
+                segm[rows, cols].T,
+                seg[r0 - b_r0:r1 - b_r0, c1 - 1 - b_c0:c1 + 1 - b_c0].T,
+                seg_nb[r0 - nb_r0:r1 - nb_r0, c1 - 1 - nb_c0:c1 + 1 - nb_c0].T))
+    del dict_raw, list_tiles
+    merge_pairs = np.vstack(merge_pairs) if merge_pairs \
+        else np.empty((0, 2), dtype=int)
+    logging.debug('merging %i superpixels pairs along seams', len(merge_pairs))
+    segm = _union_find_lut(offset, merge_pairs)[segm]
+
+    # cropping the tiles may split a superpixels to unconnected parts
+    segm = measure.label(segm + 1, connectivity=1) - 1
+    segm = _merge_seam_fragments(segm, cores, sp_size)
+    return segm
+
+
+def _merge_small_fragments(segm, candidates, min_size):
+    """ merge small candidate segments to the neighbour with the longest
+    common boundary and make the labels sequential
+
+    :param ndarray segm: segmentation
+    :param ndarray candidates: bool flag for each label allowed to be merged
+    :param float min_size: segments smaller then this are merged
+    :return ndarray, ndarray: sequential segmentation and original label
+        for each of new labels
+
+    >>> segm = np.array([[0] * 5 + [1] + [2] * 4] * 2)
+    >>> segm, labels = _merge_small_fragments(segm, np.ones(3, dtype=bool), 3)
+    >>> segm
+    array([[0, 0, 0, 0, 0, 0, 1, 1, 1, 1],
+           [0, 0, 0, 0, 0, 0, 1, 1, 1, 1]])
+    >>> labels
+    array([0, 2])
+    """
+    graph = SuperpixelGraph(segm)
+    small = np.logical_and(graph.sizes < min_size,
+                           candidates[:graph.nb_segments])
+    lut = np.arange(graph.nb_segments)
+    adjacency = graph.adjacency.tolil()
+    for lb in np.where(small)[0]:
+        if not adjacency.rows[lb]:
+            continue
+        neighbour = adjacency.rows[lb][int(np.argmax(adjacency.data[lb]))]
+        lut[lb] = neighbour
+    # follow the chains of merged fragments
+    for _ in range(graph.nb_segments):
+        lut_next = lut[lut]
+        if np.array_equal(lut_next, lut):
+            break
+        lut = lut_next
+    # compress the labels skipping the missing ones
+    labels = np.unique(lut[graph.sizes > 0])
+    lut_seq = np.searchsorted(labels, lut)
+    return lut_seq[segm], labels
+
+
+def _merge_seam_fragments(segm, cores, sp_size):
+    """ merge small segments touching tile seams to the neighbour with
+    the longest common boundary and make the labels sequential
+
+    :param ndarray segm: segmentation
+    :param [(int, int, int, int)] cores: tile cores
+    :param int sp_size: superpixel initial size
+    :return ndarray:
+    """
+    seam = np.zeros(segm.shape, dtype=bool)
+    for r0, r1, c0, c1 in cores:
+        seam[[r0, r1 - 1], c0:c1] = True
+        seam[r0:r1, [c0, c1 - 1]] = True
+    on_seam = np.bincount(segm[seam], minlength=segm.max() + 1) > 0
+    segm, _ = _merge_small_fragments(segm, on_seam,
+                                     SLIC_TILE_MIN_FRAGMENT * sp_size ** 2)
+    return segm
+
+
+def compute_boundary_recall(segm_ref, segm, tolerance=2):
+    """ fraction of reference boundary pixels which have a boundary pixel
+    of the other segmentation within given tolerance
+
+    :param ndarray segm_ref: reference segmentation
+    :param ndarray segm: evaluated segmentation
+    :param float tolerance: maximal distance in pixels
+    :return float:
+
+    >>> segm_ref = np.zeros((6, 10), dtype=int)
+    >>> segm_ref[:, 5:] = 1
+    >>> segm = np.zeros((6, 10), dtype=int)
+    >>> segm[:, 7:] = 1
+    >>> compute_boundary_recall(segm_ref, segm, tolerance=1)
+    0.5
+    >>> compute_boundary_recall(segm_ref, segm, tolerance=2)
+    1.0
+    """
+    _, dist = seg_lb.compute_boundary_distances(segm_ref, segm)
+    if len(dist) == 0:
+        return 1.
+    return float(np.mean(dist <= tolerance))
+
+
+def evaluate_slic_tiled(img, sp_size=50, rltv_compact=0.1, tile_size=2048,
+                        nb_jobs=1, tolerance=2):
+    """ compare tiled SLIC against the monolithic one by boundary recall
+    in both directions, number of superpixels and time
+
+    :param ndarray img: input color or gray image
+    :param int sp_size: superpixel initial size
+    :param float rltv_compact: relative regularisation in range (0, 1)
+    :param int tile_size: size of the core of each tile
+    :param int nb_jobs: number of processes running in parallel
+    :param float tolerance: maximal boundary distance in pixels
+    :return {str: float}:
+
+    >>> np.random.seed(0)
+    >>> img = np.random.random((100, 120, 3))
+    >>> report = evaluate_slic_tiled(img, 10, 0.2, tile_size=64)
+    >>> sorted(report.keys())  # doctest: +NORMALIZE_WHITESPACE
+    ['boundary_recall_monolithic', 'boundary_recall_tiled',
+     'nb_superpixels_monolithic', 'nb_superpixels_tiled',
+     'time_monolithic', 'time_tiled']
+    """
+    time_start = time.time()
+    slic = segment_slic_img2d(img, sp_size, rltv_compact)
+    time_monolithic = time.time() - time_start
+    time_start = time.time()
+    slic_tiled = segment_slic_img2d_tiled(img, sp_size, rltv_compact,
+                                          tile_size=tile_size, nb_jobs=nb_jobs)
+    time_tiled = time.time() - time_start
+    report = {
+        'nb_superpixels_monolithic': len(np.unique(slic)),
+        'nb_superpixels_tiled': len(np.unique(slic_tiled)),
+        # how many monolithic boundaries are found by the tiled run
+        'boundary_recall_tiled': compute_boundary_recall(slic, slic_tiled,
+                                                         tolerance),
+        'boundary_recall_monolithic': compute_boundary_recall(slic_tiled, slic,
+                                                              tolerance),
+        'time_monolithic': time_monolithic,
+        'time_tiled': time_tiled,
+    }
+    logging.debug('tiled SLIC report: %s', repr(report))
+    return report
+
+
+def _slic_lab_image(img):
+    """ normalise and smooth image and convert it to Lab as SLIC does
+
+    :param ndarray img: input color or gray image
+    :return ndarray: np.array<height, width, 3>
+    """
+    img = np.asarray(img, dtype=np.float32)
+    if img.ndim == 2:  # duplicate channels to be like RGB
+        img = np.rollaxis(np.tile(img, (3, 1, 1)), 0, 3)
+    img = (img - img.min()) / max(float(img.max() - img.min()), 1e-9)
+    img = ndimage.gaussian_filter(img, sigma=(1, 1, 0))
+    return color.rgb2lab(img)
+
+
+def _refine_slic_labels(img_lab, slic, mask_active, sp_size, rltv_compact,
+                        nb_iter=SLIC_WARM_NB_ITER):
+    """ SLIC-like local k-means iterations started from given labeling,
+    only pixels in active mask may change their label
+
+    :param ndarray img_lab: image in Lab colour space
+    :param ndarray slic: initial labeling
+    :param ndarray mask_active: pixels which can be reassigned
+    :param int sp_size: superpixel initial size
+    :param float rltv_compact: relative regularisation in range (0, 1)
+    :param int nb_iter: number of iterations
+    :return ndarray:
+    """
+    slic = slic.copy()
+    rows, cols = np.nonzero(mask_active)
+    if len(rows) == 0:
+        return slic
+    # weight of spatial distance as in SLIC
+    spatial_weight = ((sp_size * rltv_compact) ** 1.5 / float(sp_size)) ** 2
+    offsets = [(0, 0), (-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1),
+               (1, -1), (1, 1), (-2, 0), (2, 0), (0, -2), (0, 2)]
+    nb_labels = slic.max() + 1
+    grid_rows, grid_cols = np.indices(slic.shape)
+    vals = img_lab[rows, cols]
+    for _ in range(nb_iter):
+        # update cluster centres from the whole image
+        slic_flat = slic.ravel()
+        counts = np.bincount(slic_flat, minlength=nb_labels).astype(float)
+        counts[counts == 0] = np.nan
+        centre_lab = np.array([np.bincount(slic_flat, weights=img_lab[..., i].ravel(),
+                                           minlength=nb_labels)
+                               for i in range(img_lab.shape[-1])]).T \
+            / counts[:, np.newaxis]
+        centre_row = np.bincount(slic_flat, weights=grid_rows.ravel(),
+                                 minlength=nb_labels) / counts
+        centre_col = np.bincount(slic_flat, weights=grid_cols.ravel(),
+                                 minlength=nb_labels) / counts
+        # reassign active pixels to the closest of neighbouring clusters
+        best_lb = slic[rows, cols]
+        best_dist = np.full(len(rows), np.inf)
+        for dr, dc in offsets:
+            cand = slic[np.clip(rows + dr, 0, slic.shape[0] - 1),
+                        np.clip(cols + dc, 0, slic.shape[1] - 1)]
+            dist = np.sum((vals - centre_lab[cand]) ** 2, axis=1) \
+                + spatial_weight * ((rows - centre_row[cand]) ** 2
+                                    + (cols - centre_col[cand]) ** 2)
+            better = dist < best_dist
+            best_lb[better] = cand[better]
+            best_dist[better] = dist[better]
+        slic[rows, cols] = best_lb
+    return slic
+
+
+def _enforce_connectivity_stable(slic, min_size):
+    """ make each label connected keeping the label to its largest component,
+    the other components get new labels or are merged if they are small
+
+    :param ndarray slic: segmentation
+    :param float min_size: minimal size of a new component
+    :return ndarray, ndarray: sequential segmentation and original label
+        for each new label, -1 for new components
+
+    >>> slic = np.array([[0, 0, 1, 1, 0, 0, 0, 2]] * 3)
+    >>> segm, labels = _enforce_connectivity_stable(slic, 4)
+    >>> segm[0]
+    array([3, 3, 1, 1, 0, 0, 0, 2])
+    >>> labels
+    array([ 0,  1,  2, -1])
+    """
+    comps = measure.label(slic + 1, connectivity=1)
+    nb_comps = comps.max() + 1
+    comp_label = np.zeros(nb_comps, dtype=int)
+    comp_label[comps.ravel()] = slic.ravel()
+    comp_size = np.bincount(comps.ravel(), minlength=nb_comps)
+    comp_size[0] = 0
+    # keep the label for the largest component
+    order = np.argsort(-comp_size[1:], kind='stable') + 1
+    _, idx_first = np.unique(comp_label[order], return_index=True)
+    is_kept = np.zeros(nb_comps, dtype=bool)
+    is_kept[order[idx_first]] = True
+    new_label = np.zeros(nb_comps, dtype=int)
+    new_label[is_kept] = comp_label[is_kept]
+    nb_labels = slic.max() + 1
+    new_label[~is_kept] = np.arange(nb_labels, nb_labels + np.sum(~is_kept))
+    segm = new_label[comps]
+    candidates = np.ones(segm.max() + 1, dtype=bool)
+    candidates[:nb_labels] = False
+    segm, labels = _merge_small_fragments(segm, candidates, min_size)
+    labels[labels >= nb_labels] = -1
+    return segm, labels
+
+
+def segment_slic_img2d_warm(img, img_prev, slic_prev, sp_size=50,
+                            rltv_compact=0.1, change_thr=SLIC_WARM_CHANGE_THR,
+                            max_change=SLIC_WARM_MAX_CHANGE,
+                            nb_iter=SLIC_WARM_NB_ITER):
+    """ superpixels of an image started from superpixels of previous similar
+    image (next slice or time frame), only the superpixels around changed
+    regions are updated and the others are kept
+
+    If the previous image is missing, has different size or too many pixels
+    changed, new superpixels are computed by `segment_slic_img2d`.
+
+    :param ndarray img: input color or gray image
+    :param ndarray img_prev: previous image
+    :param ndarray slic_prev: superpixels of previous image
+    :param int sp_size: superpixel initial size
+    :param float rltv_compact: relative regularisation in range (0, 1)
+    :param float change_thr: minimal colour difference of changed pixel
+    :param float max_change: maximal fraction of changed pixels for warm start
+    :param int nb_iter: number of updating iterations
+    :return ndarray, ndarray: superpixels and index of the same superpixel
+        in previous labeling or -1 if it was changed
+
+    >>> np.random.seed(0)
+    >>> img = np.zeros((60, 80, 3))
+    >>> img[10:40, 20:50] = 1
+    >>> img += np.random.random(img.shape) * 0.05
+    >>> slic, lut = segment_slic_img2d_warm(img, None, None, 10, 0.2)
+    >>> bool(np.all(lut == -1))
+    True
+    >>> img2 = img.copy()
+    >>> img2[45:55, 60:70] = 1
+    >>> slic2, lut2 = segment_slic_img2d_warm(img2, img, slic, 10, 0.2)
+    >>> slic2.shape
+    (60, 80)
+    >>> bool(np.mean(lut2 >= 0) > 0.5)
+    True
+    >>> reused = lut2 >= 0
+    >>> all(np.array_equal(slic2 == lb, slic == lut2[lb])
+    ...     for lb in np.where(reused)[0])
+    True
+    """
+    if img_prev is None or slic_prev is None \
+            or np.shape(img_prev) != np.shape(img):
+        slic = segment_slic_img2d(img, sp_size, rltv_compact)
+        return slic, -np.ones(slic.max() + 1, dtype=int)
+
+    img_lab = _slic_lab_image(img)
+    diff = np.sqrt(np.sum((img_lab - _slic_lab_image(img_prev)) ** 2, axis=-1))
+    mask_changed = diff > change_thr
+    if not np.any(mask_changed):
+        return slic_prev.copy(), np.arange(slic_prev.max() + 1)
+    if np.mean(mask_changed) > max_change:
+        logging.debug('too many changed pixels (%f), new SLIC',
+                      np.mean(mask_changed))
+        slic = segment_slic_img2d(img, sp_size, rltv_compact)
+        return slic, -np.ones(slic.max() + 1, dtype=int)
+
+    # superpixels touching the changed region can be updated
+    mask_dilate = ndimage.binary_dilation(mask_changed,
+                                          iterations=max(1, sp_size // 2))
+    slic = _refine_slic_labels(img_lab, slic_prev, mask_dilate, sp_size,
+                               rltv_compact, nb_iter)
+    slic, labels = _enforce_connectivity_stable(
+        slic, SLIC_TILE_MIN_FRAGMENT * sp_size ** 2)
+
+    # reuse only superpixels which are not close to any change
+    mask_affected = ndimage.binary_dilation(mask_dilate,
+                                            iterations=SLIC_WARM_REUSE_HALO)
+    affected = np.bincount(slic[mask_affected], minlength=slic.max() + 1) > 0
+    affected_prev = np.bincount(slic_prev[mask_affected],
+                                minlength=slic_prev.max() + 1) > 0
+    unchanged = np.logical_and(~affected, labels >= 0)
+    unchanged[unchanged] = ~affected_prev[labels[unchanged]]
+    lut_prev = np.where(unchanged, labels, -1)
+    logging.debug('warm started SLIC reuses %i of %i superpixels',
+                  np.sum(unchanged), len(unchanged))
+    return slic, lut_prev
+
+
+def update_slic_warm_reference(img_ref, img, slic, lut_prev):
+    """ update the reference image of warm started superpixels, the pixels
+    of reused superpixels keep the image the superpixels were computed on,
+    so a slow drift over several images is still detected as a change
+
+    :param ndarray img_ref: reference image of previous superpixels
+    :param ndarray img: actual image
+    :param ndarray slic: superpixels of actual image
+    :param ndarray lut_prev: index of the same superpixel in previous
+        labeling or -1, see `segment_slic_img2d_warm`
+    :return ndarray: reference image for actual superpixels
+
+    >>> img_ref = np.zeros((2, 4))
+    >>> slic = np.array([[0, 0, 1, 1], [0, 0, 1, 1]])
+    >>> update_slic_warm_reference(img_ref, img_ref + 0.1, slic,
+    ...                            np.array([0, -1]))
+    array([[ 0. ,  0. ,  0.1,  0.1],
+           [ 0. ,  0. ,  0.1,  0.1]])
+    """
+    if img_ref is None or np.shape(img_ref) != np.shape(img) \
+            or np.all(lut_prev < 0):
+        return np.array(img, copy=True)
+    img_ref = np.array(img_ref, copy=True)
+    mask_new = lut_prev[slic] < 0
+    img_ref[mask_new] = np.asarray(img)[mask_new]
+    return img_ref
+
+
+def segment_slic_img2d_stack(images, sp_size=50, rltv_compact=0.1,
+                             change_thr=SLIC_WARM_CHANGE_THR,
+                             max_change=SLIC_WARM_MAX_CHANGE):
+    """ iterate over superpixels of a stack of images (z-stack or time series)
+    where each image is warm started from the previous one
+
+    :param [ndarray] images: sequence of images
+    :param int sp_size: superpixel initial size
+    :param float rltv_compact: relative regularisation in range (0, 1)
+    :param float change_thr: minimal colour difference of changed pixel
+    :param float max_change: maximal fraction of changed pixels for warm start
+    :return (ndarray, ndarray): superpixels and index of the same superpixel
+        in previous labeling or -1, see `segment_slic_img2d_warm`
+
+    >>> np.random.seed(0)
+    >>> img = np.random.random((40, 50, 3)) * 0.05
+    >>> img[10:30, 15:35] += 0.9
+    >>> stack = [img, img, img + 0.01]
+    >>> res = list(segment_slic_img2d_stack(stack, 10, 0.2))
+    >>> [np.array_equal(res[0][0], r[0]) for r in res]
+    [True, True, True]
+    >>> [bool(np.all(lut >= 0)) for _, lut in res]
+    [False, True, True]
+
+    The images are compared to the image the superpixels were computed on,
+    so also a slow drift is detected
+
+    >>> stack = [img.copy() for _ in range(8)]
+    >>> for i, im in enumerate(stack):
+    ...     im[2:8, 2:12] += i * 0.02
+    >>> [bool(np.all(lut >= 0))
+    ...  for _, lut in segment_slic_img2d_stack(stack, 10, 0.2)]
+    [False, True, False, True, False, True, False, True]
+    """
+    img_ref, slic_prev = None, None
+    for img in images:
+        slic, lut_prev = segment_slic_img2d_warm(img, img_ref, slic_prev,
+                                                 sp_size, rltv_compact,
+                                                 change_thr, max_change)
+        yield slic, lut_prev
+        img_ref = update_slic_warm_reference(img_ref, img, slic, lut_prev)
+        slic_prev = slic
+
+
+def _run_slic_img3d_gray(im, sp_size, rltv_compact, space):
+    """ run SLIC segmentation on 3D gray image with native parameters """
     nb_pixels = np.prod(im.shape)
     sp_size = np.prod(sp_size / np.asarray(space, dtype=np.float32) * min(space))
     # set native SLIC parameters
@@ -100,9 +787,34 @@ def segment_slic_img3d_gray(im, sp_size=50, rltv_compact=0.1,
                   'compat=%f and spacing=%s', slic_nb_sp, slic_compact, repr(space))
     # run SLIC segmentation
     # slic_segments = SLIC.slic_n(np.array(im), slic_nb_sp, slic_compact)
-    slic_segments = ski_segm.slic(np.array(im), n_segments=slic_nb_sp,
+    slic_segments = ski_segm.slic(im, n_segments=max(1, slic_nb_sp),
                                   compactness=slic_compact, multichannel=False,
                                   spacing=space, sigma=1)
+    return slic_segments
+
+
+def segment_slic_img3d_gray(im, sp_size=50, rltv_compact=0.1,
+                            space=IMAGE_SPACING):
+    """ segmentation by SLIC superpixels using originla SLIC implementation
+
+    :param ndarray im: input 3D grascale image
+    :param int sp_size: superpixel initial size
+    :param float rltv_compact: relative regularisation in range (0, 1)
+        where 0 is for free form and 1 for nearly rectangular superpixels
+    :param (int, int, int) space: spacing in 3d image may not be equal
+    :return:
+
+    >>> np.random.seed(0)
+    >>> img = np.random.random((100, 100, 10))
+    >>> slic = segment_slic_img3d_gray(img, 20, 0.2, (1, 1, 5))
+    >>> slic.shape
+    (100, 100, 10)
+    """
+    logging.debug('Init SLIC superpixels 3d Gray clustering with params'
+                  ' size=%i and regul=%f for image dims %s',
+                  sp_size, rltv_compact, repr(im.shape))
+    slic_segments = _run_slic_img3d_gray(np.array(im), sp_size, rltv_compact,
+                                         space)
     logging.debug('SLIC superpixels estimated.')
     # slic_segments, _, _ = ski_segm.relabel_sequential(slic_segments)
     # fix: unconnected segments - [ndimage.label(slic==i)[1]
@@ -111,23 +823,115 @@ def segment_slic_img3d_gray(im, sp_size=50, rltv_compact=0.1,
     return np.array(slic_segments)
 
 
-def make_graph_segment_connect_edges(vertices, all_edges):
+def segment_slic_img3d_gray_slabs(im, sp_size=50, rltv_compact=0.1,
+                                  space=IMAGE_SPACING, slab_size=32,
+                                  segm_out=None):
+    """ segmentation by SLIC supervoxels computed in overlapping slabs along
+    the first axis, so only a single slab has to be in memory and the volume
+    may be memory-mapped; the supervoxels cut by slab boundaries are merged
+    if both slabs agree and the intensity statistic is accumulated meanwhile
+
+    :param ndarray im: input 3D gray image, e.g. np.memmap
+    :param int sp_size: superpixel initial size
+    :param float rltv_compact: relative regularisation in range (0, 1)
+        where 0 is for free form and 1 for nearly rectangular superpixels
+    :param (int, int, int) space: spacing in 3d image may not be equal
+    :param int slab_size: number of slices in the core of each slab
+    :param ndarray segm_out: output array for the segmentation, e.g. np.memmap
+    :return ndarray, {str: ndarray}: segmentation and accumulators
+        count, sum and sum of squares of intensities for each supervoxel
+
+    >>> np.random.seed(0)
+    >>> img = np.random.random((12, 40, 40)) / 2.
+    >>> img[:, :, :20] += 0.5
+    >>> slic, accum = segment_slic_img3d_gray_slabs(img, 10, 0.2, (3, 1, 1),
+    ...                                             slab_size=4)
+    >>> slic.shape
+    (12, 40, 40)
+    >>> np.array_equal(accum['count'], np.bincount(slic.ravel()))
+    True
+    >>> np.allclose(accum['sum'], np.bincount(slic.ravel(), weights=img.ravel()))
+    True
     """
+    logging.debug('Init slab-wise SLIC superpixels 3d with params size=%i, '
+                  'regul=%f and slab %i for image dims %s',
+                  sp_size, rltv_compact, slab_size, repr(im.shape))
+    depth = im.shape[0]
+    # the size of supervoxel along the slab axis respecting the spacing
+    sp_depth = sp_size * min(space) / float(space[0])
+    overlap = max(1, int(np.ceil(SLIC_TILE_OVERLAP * sp_depth)))
+    if segm_out is None:
+        segm_out = np.empty(im.shape, dtype=np.int32)
 
-    :param vertices:
-    :param all_edges:
-    :return:
+    list_accum, merge_pairs, slabs = [], [], []
+    offset, seam_raw = 0, None
+    for z0 in range(0, depth, slab_size):
+        z1 = min(z0 + slab_size, depth)
+        e0, e1 = max(0, z0 - overlap), min(depth, z1 + overlap)
+        slab = np.asarray(im[e0:e1], dtype=np.float32)
+        raw = _run_slic_img3d_gray(slab, sp_size, rltv_compact, space)
+        # cropping may split a supervoxel to unconnected parts
+        core = measure.label(raw[z0 - e0:z1 - e0] + 1, connectivity=1) - 1
+        segm_out[z0:z1] = core + offset
+        vals = slab[z0 - e0:z1 - e0].ravel().astype(float)
+        nb = core.max() + 1
+        list_accum.append([np.bincount(core.ravel(), minlength=nb),
+                           np.bincount(core.ravel(), weights=vals, minlength=nb),
+                           np.bincount(core.ravel(), weights=vals ** 2,
+                                       minlength=nb)])
+        if seam_raw is not None:
+            merge_pairs.append(_merge_seam_segments(
+                np.asarray(segm_out[z0 - 1:z0 + 1]).reshape(2, -1),
+                seam_raw.reshape(2, -1),
+                raw[z0 - 1 - e0:z0 + 1 - e0].reshape(2, -1)))
+        # keep only raw labels around the next slab boundary
+        seam_raw = raw[z1 - 1 - e0:z1 + 1 - e0].copy() if z1 < depth else None
+        slabs.append((z0, z1))
+        offset += nb
+
+    merge_pairs = np.vstack(merge_pairs) if merge_pairs \
+        else np.empty((0, 2), dtype=int)
+    logging.debug('merging %i supervoxel pairs along slabs', len(merge_pairs))
+    lut = _union_find_lut(offset, merge_pairs)
+    _, lut = np.unique(lut, return_inverse=True)
+    lut = lut.ravel()
+    for z0, z1 in slabs:
+        segm_out[z0:z1] = lut[segm_out[z0:z1]]
+
+    accum = [np.hstack(a) for a in zip(*list_accum)]
+    accumulators = {name: np.bincount(lut, weights=a)
+                    for name, a in zip(['count', 'sum', 'sum2'], accum)}
+    accumulators['count'] = accumulators['count'].astype(int)
+    return segm_out, accumulators
+
+
+def make_graph_segment_connect_edges(vertices, all_edges,
+                                     return_lengths=False):
+    """ find unique edges among all pairs of neighbouring pixels labels,
+    the labels are expected to be indexes into vertices
+
+    :param ndarray vertices: unique labels
+    :param ndarray all_edges: np.array<nb_pairs, 2> of vertex indexes
+    :param bool return_lengths: return also number of pixel pairs per edge
+    :return ndarray, ndarray: vertices, np.array<nb_edges, 2> (, lengths)
+
+    >>> all_edges = np.array([[0, 1], [1, 0], [1, 1], [2, 0], [0, 1]])
+    >>> make_graph_segment_connect_edges(np.array([0, 3, 5]), all_edges, True)
+    (array([0, 3, 5]), array([[0, 3],
+           [0, 5]], dtype=int32), array([3, 1]))
     """
     # SEE http://peekaboo-vision.blogspot.cz/2011/08/region-connectivity-graphs-in-python.html
-    all_edges = all_edges[all_edges[:, 0] != all_edges[:, 1],:]
-    all_edges = np.sort(all_edges, axis=1)
+    all_edges = all_edges[all_edges[:, 0] != all_edges[:, 1], :]
+    all_edges = np.sort(all_edges, axis=1).astype(np.int64)
     nb_vertices = len(vertices)
-    edge_hash = all_edges[:,0] + nb_vertices * all_edges[:, 1]
+    edge_hash = all_edges[:, 0] + nb_vertices * all_edges[:, 1]
     # find unique connections
-    edges = np.unique(edge_hash)
+    edges, lengths = np.unique(edge_hash, return_counts=True)
     # undo hashing
-    edges = [[vertices[int(edge % nb_vertices)],
-              vertices[int(edge / nb_vertices)]] for edge in edges]
+    edges = np.c_[vertices[edges % nb_vertices],
+                  vertices[edges // nb_vertices]].astype(np.int32)
+    if return_lengths:
+        return vertices, edges, lengths
     return vertices, edges
 
 
@@ -154,88 +958,140 @@ def get_segment_diffs_3d_conn6(grid):
     return np.vstack([bellow, right, down])
 
 
-def make_graph_segm_connect2d_conn4(grid):
+def make_graph_segm_connect_grid(grid, return_lengths=False,
+                                 return_adjacency=False):
+    """ construct graph of connected components for 2D (4-connected)
+    or 3D (6-connected) segmentation
+
+    The adjacency is symmetric sparse matrix indexed by segment labels
+    with the shared boundary length as value.
+
+    :param ndarray grid: segmentation
+    :param bool return_lengths: return number of neighbouring pixel pairs
+        for each edge
+    :param bool return_adjacency: return also adjacency as CSR matrix
+    :return ndarray, ndarray: vertices, np.array<nb_edges, 2>
+        (, lengths) (, adjacency)
+
+    >>> grid = np.array([[0] * 5 + [1] * 5, [2] * 5 + [3] * 5])
+    >>> v, edges, lengths, adj = make_graph_segm_connect_grid(grid, True, True)
+    >>> edges
+    array([[0, 1],
+           [0, 2],
+           [1, 3],
+           [2, 3]], dtype=int32)
+    >>> lengths
+    array([1, 5, 5, 1])
+    >>> adj.toarray()
+    array([[0, 1, 5, 0],
+           [1, 0, 0, 5],
+           [5, 0, 0, 1],
+           [0, 5, 1, 0]])
+    """
+    # get unique labels and map them to [0, ..., num_labels - 1]
+    vertices, grid_idx = np.unique(grid, return_inverse=True)
+    grid_idx = grid_idx.reshape(grid.shape).astype(np.int32)
+    if grid.ndim == 2:
+        all_edges = get_segment_diffs_2d_conn4(grid_idx)
+    elif grid.ndim == 3:
+        all_edges = get_segment_diffs_3d_conn6(grid_idx)
+    else:
+        raise ValueError('not supported image dim: %s' % repr(grid.shape))
+    vertices, edges, lengths = make_graph_segment_connect_edges(
+        vertices, all_edges, return_lengths=True)
+
+    outputs = [vertices, edges]
+    if return_lengths:
+        outputs.append(lengths)
+    if return_adjacency:
+        nb = int(vertices.max()) + 1 if len(vertices) > 0 else 0
+        adjacency = sparse.coo_matrix(
+            (np.r_[lengths, lengths], (np.r_[edges[:, 0], edges[:, 1]],
+                                       np.r_[edges[:, 1], edges[:, 0]])),
+            shape=(nb, nb)).tocsr()
+        outputs.append(adjacency)
+    return tuple(outputs)
+
+
+def make_graph_segm_connect2d_conn4(grid, return_lengths=False,
+                                    return_adjacency=False):
     """ construct graph of connected components
 
     :param ndarray grid: segmentation
-    :return [int], [(int, int)]:
+    :param bool return_lengths: see `make_graph_segm_connect_grid`
+    :param bool return_adjacency: see `make_graph_segm_connect_grid`
+    :return ndarray, ndarray: vertices, np.array<nb_edges, 2>
 
     >>> grid = np.array([[0] * 5 + [1] * 5, [2] * 5 + [3] * 5])
     >>> v, edges = make_graph_segm_connect2d_conn4(grid)
     >>> v
     array([0, 1, 2, 3])
-    >>> edges
+    >>> edges.tolist()
     [[0, 1], [0, 2], [1, 3], [2, 3]]
     """
-    # get unique labels
     logging.debug('make graph segment connect edges - 2d conn4')
-    vertices = np.unique(grid)
-    # map unique labels to [1,...,num_labels]
-    reverse_dict = dict(zip(vertices, np.arange(len(vertices))))
-    grid = np.array([reverse_dict[x] for x in grid.flat]).reshape(grid.shape)
-    all_edges = get_segment_diffs_2d_conn4(grid)
-    return make_graph_segment_connect_edges(vertices, all_edges)
+    assert grid.ndim == 2
+    return make_graph_segm_connect_grid(grid, return_lengths, return_adjacency)
 
 
-def make_graph_segm_connect3d_conn6(grid):
+def make_graph_segm_connect3d_conn6(grid, return_lengths=False,
+                                    return_adjacency=False):
     """ construct graph of connected components
 
     :param ndarray grid: segmentation
-    :return [int], [(int, int)]:
+    :param bool return_lengths: see `make_graph_segm_connect_grid`
+    :param bool return_adjacency: see `make_graph_segm_connect_grid`
+    :return ndarray, ndarray: vertices, np.array<nb_edges, 2>
 
     >>> grid_2d = np.array([[0] * 5 + [1] * 5, [2] * 5 + [3] * 5])
     >>> grid = np.array([grid_2d, grid_2d + 4])
     >>> v, edges = make_graph_segm_connect3d_conn6(grid)
     >>> v
     array([0, 1, 2, 3, 4, 5, 6, 7])
-    >>> edges  # doctest: +NORMALIZE_WHITESPACE
+    >>> edges.tolist()  # doctest: +NORMALIZE_WHITESPACE
     [[0, 1], [0, 2], [1, 3], [2, 3], [0, 4], [1, 5], [4, 5], [2, 6], [4, 6],
     [3, 7], [5, 7], [6, 7]]
     """
-    # get unique labels
     logging.debug('make graph segment connect edges - 3d conn6')
-    vertices = np.unique(grid)
-    # map unique labels to [1,...,num_labels]
-    reverse_dict = dict(zip(vertices, np.arange(len(vertices))))
-    grid = np.array([reverse_dict[x] for x in grid.flat]).reshape(grid.shape)
-    all_edges = get_segment_diffs_3d_conn6(grid)
-    return make_graph_segment_connect_edges(vertices, all_edges)
+    assert grid.ndim == 3
+    return make_graph_segm_connect_grid(grid, return_lengths, return_adjacency)
 
 
 def superpixel_centers(segments):
-    """ estimate centers of each superpixel
+    """ estimate centers of each superpixel as mean of its pixel coordinates,
+    the centre of missing label is NaN
 
-    :param ndarray segments: segmentation np.array<h, w>
-    :return [(float, float)]:
+    :param ndarray segments: segmentation np.array<h, w(, d)>
+    :return ndarray: np.array<nb_segments, ndim>
 
-    >>> segm = np.array([[0] * 6 + [1] * 5, [0] * 6 + [2] * 5])
+    >>> segm = np.array([[0] * 6 + [1] * 5, [0] * 6 + [3] * 5])
     >>> superpixel_centers(segm)
-    [(0.5, 2.5), (0.0, 8.0), (1.0, 8.0)]
+    array([[ 0.5,  2.5],
+           [ 0. ,  8. ],
+           [ nan,  nan],
+           [ 1. ,  8. ]])
     >>> superpixel_centers(np.array([segm, segm, segm]))
-    [[1.0, 0.5, 2.5], [1.0, 0.0, 8.0], [1.0, 1.0, 8.0]]
+    array([[ 1. ,  0.5,  2.5],
+           [ 1. ,  0. ,  8. ],
+           [ nan,  nan,  nan],
+           [ 1. ,  1. ,  8. ]])
     """
+    segments = np.asarray(segments)
     logging.debug('compute centers for %d superpixels', segments.max())
-    centers = [list() for i in range(np.max(segments) + 1)]
-
-    if segments.ndim <= 2:
-        # regionprops works for labels from 1
-        regions = measure.regionprops(segments + 1)
-        for region in regions:
-            centers[region['label'] - 1] = region['centroid']
-    elif segments.ndim == 3:
-        # http://peekaboo-vision.blogspot.cz/2011/08/region-connectivity-graphs-in-python.html
-        grids = np.mgrid[:segments.shape[0], :segments.shape[1], :segments.shape[2]]
-        # for v in range(len(centers)):
-        #     centers[v] = [grids[g][segments == v].mean() for g in range(3)]
-        segm_flat = segments.ravel()
-        grids_flat = [g.ravel() for g in grids]
-        for i, lb in enumerate(segm_flat):
-            vals = [grids_flat[g][i] for g in range(3)]
-            centers[lb].append(vals)
-        for lb, vals in enumerate(centers):
-            centers[lb] = np.mean(vals, axis=0).tolist()
-    else:
-        logging.error('not supported image dim: %s', repr(segments.shape))
+    segm_flat = segments.ravel()
+    nb_segments = int(segm_flat.max()) + 1
+    sizes = np.bincount(segm_flat, minlength=nb_segments).astype(float)
+    sizes[sizes == 0] = np.nan
+
+    centers = np.empty((nb_segments, segments.ndim))
+    for d in range(segments.ndim):
+        # coordinates along single axis broadcast over the volume
+        shape = [1] * segments.ndim
+        shape[d] = segments.shape[d]
+        coords = np.broadcast_to(np.arange(segments.shape[d]).reshape(shape),
+                                 segments.shape)
+        centers[:, d] = np.bincount(segm_flat, weights=coords.ravel(),
+                                    minlength=nb_segments) / sizes
     return centers
 
 
@@ -254,3 +1110,154 @@ def get_neighboring_segments(edges):
         list_neighbours[e1].append(e2)
         list_neighbours[e2].append(e1)
     return list_neighbours
+
+
+class SuperpixelGraph(object):
+    """
+    Graph of superpixels shared by GraphCut, region growing and ellipse
+    fitting, all derived structures are computed lazily only once.
+
+    The segments are expected to be labeled from 0 to nb_segments - 1.
+
+    Example
+    -------
+    >>> slic = np.array([[0] * 3 + [1] * 5, [2] * 4 + [3] * 4])
+    >>> graph = SuperpixelGraph(slic)
+    >>> graph.nb_segments
+    4
+    >>> graph.sizes
+    array([3, 5, 4, 4])
+    >>> graph.edges.tolist()
+    [[0, 1], [0, 2], [1, 2], [1, 3], [2, 3]]
+    >>> graph.boundary_lengths
+    array([1, 3, 1, 4, 1])
+    >>> graph.neighbours
+    [[1, 2], [0, 2, 3], [0, 1, 3], [1, 2]]
+    >>> graph.bounding_boxes[1]
+    (slice(0, 1, None), slice(3, 8, None))
+    >>> graph.centers
+    array([[ 0. ,  1. ],
+           [ 0. ,  5. ],
+           [ 1. ,  1.5],
+           [ 1. ,  5.5]])
+    >>> get_superpixel_graph(graph) is graph
+    True
+    """
+    def __init__(self, segments):
+        """
+
+        :param ndarray segments: superpixel segmentation np.array<h, w(, d)>
+        """
+        self.segments = np.asarray(segments)
+        self.nb_segments = int(self.segments.max()) + 1
+        self._centers = None
+        self._sizes = None
+        self._edges = None
+        self._boundary_lengths = None
+        self._adjacency = None
+        self._neighbours = None
+        self._bounding_boxes = None
+
+    def _compute_connectivity(self):
+        _, self._edges, self._boundary_lengths, self._adjacency = \
+            make_graph_segm_connect_grid(self.segments, return_lengths=True,
+                                         return_adjacency=True)
+
+    @property
+    def centers(self):
+        """ superpixel centroids, see `superpixel_centers`
+
+        :return ndarray: np.array<nb_segments, ndim>
+        """
+        if self._centers is None:
+            self._centers = superpixel_centers(self.segments)
+        return self._centers
+
+    @property
+    def sizes(self):
+        """ number of pixels in each superpixel
+
+        :return ndarray: np.array<nb_segments>
+        """
+        if self._sizes is None:
+            self._sizes = np.bincount(self.segments.ravel(),
+                                      minlength=self.nb_segments)
+        return self._sizes
+
+    @property
+    def edges(self):
+        """ unique edges between neighbouring superpixels
+
+        :return ndarray: np.array<nb_edges, 2>
+        """
+        if self._edges is None:
+            self._compute_connectivity()
+        return self._edges
+
+    @property
+    def boundary_lengths(self):
+        """ number of neighbouring pixel pairs for each edge
+
+        :return ndarray: np.array<nb_edges>
+        """
+        if self._boundary_lengths is None:
+            self._compute_connectivity()
+        return self._boundary_lengths
+
+    @property
+    def adjacency(self):
+        """ symmetric adjacency with boundary lengths as values
+
+        :return csr_matrix: np.array<nb_segments, nb_segments>
+        """
+        if self._adjacency is None:
+            self._compute_connectivity()
+        return self._adjacency
+
+    @property
+    def neighbours(self):
+        """ sorted indexes of neighbouring superpixels for each superpixel
+
+        :return [[int]]:
+        """
+        if self._neighbours is None:
+            adj = self.adjacency.copy()
+            adj.sort_indices()
+            self._neighbours = [adj.indices[adj.indptr[i]:adj.indptr[i + 1]]
+                                .tolist() for i in range(self.nb_segments)]
+        return self._neighbours
+
+    @property
+    def bounding_boxes(self):
+        """ bounding box of each superpixel, None for missing labels
+
+        :return [(slice, slice)]:
+        """
+        if self._bounding_boxes is None:
+            bboxes = ndimage.find_objects(self.segments + 1)
+            bboxes += [None] * (self.nb_segments - len(bboxes))
+            self._bounding_boxes = bboxes
+        return self._bounding_boxes
+
+
+def get_superpixel_graph(segments):
+    """ wrap superpixel segmentation to a graph, if it is already a graph
+    it is returned as it is
+
+    :param segments: ndarray or SuperpixelGraph
+    :return SuperpixelGraph:
+    """
+    if isinstance(segments, SuperpixelGraph):
+        return segments
+    return SuperpixelGraph(segments)
+
+
+def get_segments(segments):
+    """ get the superpixel segmentation from array or SuperpixelGraph
+
+    :param segments: ndarray or SuperpixelGraph
+    :return ndarray:
+    """
+    if isinstance(segments, SuperpixelGraph):
+        return segments.segments
+    return segments
@@ -37,6 +37,15 @@ class TestSuperpixels(unittest.TestCase):
         vertices, edges = seg_spx.make_graph_segm_connect3d_conn6(self.seg3d)
         logging.debug('vertices: {} -> edges: {}'.format(vertices, edges))
 
+    def test_superpixel_graph(self):
+        for seg in [self.seg2d, self.seg3d]:
+            graph = seg_spx.SuperpixelGraph(seg)
+            _, edges = seg_spx.make_graph_segm_connect_grid(seg)
+            self.assertEqual(edges.tolist(), graph.edges.tolist())
+            self.assertEqual(np.sum(graph.sizes), seg.size)
+            self.assertEqual(graph.neighbours,
+                             seg_spx.get_neighboring_segments(edges))
+
     def test_general(self):
         slic = seg_spx.segment_slic_img2d(self.img, sp_size=15, rltv_compact=0.2)
 
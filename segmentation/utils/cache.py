@@ -0,0 +1,179 @@
+"""
+Content addressed on-disk cache for intermediate results such as superpixels
+and features, so repeated experiments skip unchanged stages
+
+Each entry is a folder named by hash of the input data and parameters,
+containing one memory-mappable `.npy` file per stored array.
+The least recently used entries are removed when the cache exceeds size limit.
+
+>>> import shutil
+>>> path_cache = './sample-cache'
+>>> img = np.zeros((10, 15))
+>>> key = compute_cache_key(img, name='sample', size=5)
+>>> cache_load(path_cache, key) is None
+True
+>>> data = cache_save(path_cache, key, {'features': np.ones((3, 2))})
+>>> data['features'].dtype
+dtype('float32')
+>>> cache_load(path_cache, key)['features'].tolist()
+[[1.0, 1.0], [1.0, 1.0], [1.0, 1.0]]
+>>> shutil.rmtree(path_cache)
+
+Copyright (C) 2014-2017 Jiri Borovec <jiri.borovec@fel.cvut.cz>
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+
+import numpy as np
+
+# maximal size of the cache on disk in bytes
+CACHE_SIZE_LIMIT = 5 * 1024 ** 3
+# suffix of the temporary folder while writing an entry
+CACHE_TEMP_SUFFIX = '.tmp-%i'
+
+
+def compute_cache_key(*arrays, **params):
+    """ compute hash from content of all given arrays and parameters
+
+    :param [ndarray] arrays: input data
+    :param {str: any} params: parameters which have an impact on the result
+    :return str:
+
+    >>> img = np.zeros((5, 6))
+    >>> compute_cache_key(img, size=5) == compute_cache_key(img.copy(), size=5)
+    True
+    >>> compute_cache_key(img, size=5) == compute_cache_key(img, size=6)
+    False
+    >>> compute_cache_key(img, size=5) == compute_cache_key(img.T, size=5)
+    False
+    """
+    hash_fn = hashlib.sha1()
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr)
+        hash_fn.update(repr((arr.dtype.str, arr.shape)).encode('utf-8'))
+        hash_fn.update(arr.view(np.uint8).ravel())
+    str_params = json.dumps(params, sort_keys=True, default=repr)
+    hash_fn.update(str_params.encode('utf-8'))
+    return hash_fn.hexdigest()
+
+
+def _entry_size(path_entry):
+    return sum(os.path.getsize(os.path.join(path_entry, n))
+               for n in os.listdir(path_entry))
+
+
+def cache_load(path_cache, key):
+    """ load all arrays stored in a cache entry as memory-maps,
+    the entry is touched to be marked as recently used
+
+    :param str path_cache: path to the cache folder
+    :param str key: entry key
+    :return {str: ndarray}: None if there is no such entry
+    """
+    if path_cache is None:
+        return None
+    path_entry = os.path.join(path_cache, key)
+    if not os.path.isdir(path_entry):
+        return None
+    try:
+        data = {os.path.splitext(n)[0]: np.load(os.path.join(path_entry, n),
+                                                mmap_mode='r')
+                for n in os.listdir(path_entry) if n.endswith('.npy')}
+        os.utime(path_entry, None)
+    except Exception:
+        # the entry may be just removed by other process
+        logging.warning('cache: failed loading entry "%s"', path_entry)
+        return None
+    logging.debug('cache: loaded entry "%s"', key)
+    return data
+
+
+def cache_save(path_cache, key, dict_arrays, size_limit=CACHE_SIZE_LIMIT):
+    """ store arrays to the cache, the float arrays are saved as float32,
+    and return them as they are loaded from the cache
+
+    :param str path_cache: path to the cache folder
+    :param str key: entry key
+    :param {str: ndarray} dict_arrays: arrays to be stored
+    :param int size_limit: maximal size of the cache in bytes
+    :return {str: ndarray}:
+    """
+    if not os.path.isdir(path_cache):
+        os.makedirs(path_cache)
+    path_entry = os.path.join(path_cache, key)
+    # write to temporary folder and rename it to be safe in parallel runs
+    path_temp = path_entry + CACHE_TEMP_SUFFIX % os.getpid()
+    if not os.path.isdir(path_temp):
+        os.mkdir(path_temp)
+    data_saved = {}
+    for name, arr in dict_arrays.items():
+        arr = np.asarray(arr)
+        if np.issubdtype(arr.dtype, np.floating):
+            arr = arr.astype(np.float32)
+        np.save(os.path.join(path_temp, name + '.npy'), arr)
+        data_saved[name] = arr
+    try:
+        os.rename(path_temp, path_entry)
+    except OSError:
+        # the same entry was already created by another process
+        shutil.rmtree(path_temp, ignore_errors=True)
+    logging.debug('cache: saved entry "%s"', key)
+    cache_prune(path_cache, size_limit, key_keep=key)
+    data = cache_load(path_cache, key)
+    if data is None:
+        # the entry may be removed by pruning in other process
+        logging.warning('cache: saved entry "%s" can not be loaded',
+                        path_entry)
+        return data_saved
+    return data
+
+
+def cache_prune(path_cache, size_limit=CACHE_SIZE_LIMIT, key_keep=None):
+    """ remove the least recently used entries till the cache fits the limit
+
+    :param str path_cache: path to the cache folder
+    :param int size_limit: maximal size of the cache in bytes
+    :param str key_keep: entry which is never removed,
+        None means that the most recent entry is kept
+
+    >>> path_cache = './sample-cache'
+    >>> for i in range(3):
+    ...     _= cache_save(path_cache, 'key%i' % i, {'a': np.zeros(1000)})
+    >>> cache_prune(path_cache, size_limit=5000)
+    >>> sorted(os.listdir(path_cache))
+    ['key2']
+    >>> _= cache_save(path_cache, 'key3', {'a': np.zeros(1000)})
+    >>> cache_prune(path_cache, size_limit=5000, key_keep='key2')
+    >>> sorted(os.listdir(path_cache))
+    ['key2']
+    >>> shutil.rmtree(path_cache)
+    """
+    entries = []
+    for name in os.listdir(path_cache):
+        path_entry = os.path.join(path_cache, name)
+        if not os.path.isdir(path_entry) or '.tmp-' in name:
+            continue
+        try:
+            entries.append((os.path.getmtime(path_entry), path_entry,
+                            _entry_size(path_entry)))
+        except OSError:
+            continue
+    total_size = sum(e[2] for e in entries)
+    entries = sorted(entries)
+    if key_keep is None:
+        # keep always the most recent entry
+        entries = entries[:-1]
+    path_keep = None if key_keep is None \
+        else os.path.join(path_cache, key_keep)
+    for _, path_entry, size in entries:
+        if total_size <= size_limit:
+            break
+        if path_entry == path_keep:
+            continue
+        logging.debug('cache: removing entry "%s"', path_entry)
+        shutil.rmtree(path_entry, ignore_errors=True)
+        total_size -= size